@@ -0,0 +1,112 @@
+""" Admission control: per-user and per-room token buckets in front of the handlers.
+
+An update is handled if both the bucket of its sender and the bucket of the sender's room have a token.
+Dropped updates are not handled; the first one of a user gets a throttle notice, later ones until the user
+is admitted again are dropped silently. Users outside rooms, or in rooms missing from the catalog, only have
+the user bucket of the default limits. Buckets that filled up again are removed, so the tables only hold
+users and rooms active in the last few seconds.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from functools import wraps
+
+from logs import fields
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Updates per second and burst of a user, and of all the players of a room together
+Limits = namedtuple("Limits", ["user_rate", "user_burst", "room_rate", "room_burst"])
+# Kind of the limits of users outside rooms
+DEFAULT = "default"
+
+
+def parse_limits(text):
+    """ Parses KIND=USER_RATE,USER_BURST,ROOM_RATE,ROOM_BURST of --rate-limit. """
+    kind, _, values = text.partition("=")
+    values = [float(value) for value in values.split(",")]
+    if not kind or len(values) != len(Limits._fields) or min(values) <= 0:
+        raise ValueError("expected KIND=USER_RATE,USER_BURST,ROOM_RATE,ROOM_BURST")
+    return kind, Limits(*values)
+
+
+class Admission:
+    """ Decides whether updates are handled. `limits` maps room kinds (see room_catalog) to Limits, players
+    of rooms of other kinds are not limited. Users outside rooms get the DEFAULT limits or, without them,
+    the strictest user limits of the other kinds. """
+
+    def __init__(self, limits, room_kind, sweep_interval=10.0, clock=time.monotonic):
+        self.limits = dict(limits)
+        self.default = self.limits.get(DEFAULT) or min(self.limits.values(), key=lambda limits: limits.user_rate,
+                                                       default=None)
+        self.room_kind = room_kind
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self.throttled = 0
+        self._users = {}
+        self._rooms = {}
+        # Users told they are throttled and not admitted since
+        self._notified = set()
+        self._swept = clock()
+        self._lock = threading.Lock()
+
+    def admit(self, user, room):
+        """ Returns (admitted, notify): whether to handle the update and, if not, whether to send a notice. """
+        kind = self.room_kind(room) if room is not None else None
+        if kind is None:
+            limits, room = self.default, None
+        else:
+            limits = self.limits.get(kind)
+        if limits is None:
+            return True, False
+        now = self.clock()
+        with self._lock:
+            if now - self._swept >= self.sweep_interval:
+                self._sweep(now)
+            user_bucket = self._bucket(self._users, user, limits.user_rate, limits.user_burst, now)
+            room_bucket = None if room is None else self._bucket(self._rooms, room, limits.room_rate,
+                                                                  limits.room_burst, now)
+            # Tokens are only taken when both buckets have one
+            if not user_bucket.delay(now) and (room_bucket is None or room_bucket.take(now)):
+                user_bucket.take(now)
+                self._notified.discard(user)
+                return True, False
+            self.throttled += 1
+            if user in self._notified:
+                return False, False
+            self._notified.add(user)
+        logger.info("throttled %s %s", user, room, extra=fields("throttled", user, room))
+        return False, True
+
+    def wrap(self, callback, room_for_player, notice):
+        """ Wraps a handler callback to drop updates that are not admitted. """
+
+        @wraps(callback)
+        def admitted(update, context):
+            user = update.message.from_user['id']
+            handle, notify = self.admit(user, room_for_player(user))
+            if handle:
+                return callback(update, context)
+            if notify:
+                update.message.reply_text(notice)
+
+        return admitted
+
+    def __len__(self):
+        return len(self._users) + len(self._rooms)
+
+    @staticmethod
+    def _bucket(table, key, rate, burst, now):
+        bucket = table.get(key)
+        if bucket is None or bucket.rate != rate or bucket.capacity != burst:
+            bucket = table[key] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def _sweep(self, now):
+        for table in (self._users, self._rooms):
+            for key in [key for key, bucket in table.items() if bucket.full(now)]:
+                del table[key]
+        self._notified.intersection_update(self._users)
+        self._swept = now
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Asyncio runtime of the bot.
+
+Long polling and turn timers run on an asyncio loop and every update is processed as a separate task,
+up to --concurrency at once. The handlers are the ones from bot.py: they block on SQLite and on replies,
+so they run in a dedicated executor and never stall the loop.
+
+Usage: python async_bot.py db_file log_file config [--concurrency N] [--handler-workers N] [bot.py options]
+"""
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from telegram import Bot
+from telegram.error import TelegramError
+from telegram.ext import Dispatcher
+
+import bot
+from timers import AsyncTimerService
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    """ Polls updates on the loop and runs the dispatcher's handlers for each of them concurrently. """
+
+    def __init__(self, telegram_bot, dispatcher, concurrency=256, handler_workers=16, poll_timeout=10):
+        self.bot = telegram_bot
+        self.dispatcher = dispatcher
+        self.concurrency = concurrency
+        self.poll_timeout = poll_timeout
+        self.executor = ThreadPoolExecutor(handler_workers, thread_name_prefix="handler")
+        # getUpdates blocks for up to poll_timeout, it gets its own thread
+        self._poll_executor = ThreadPoolExecutor(1, thread_name_prefix="poll")
+        self._tasks = set()
+
+    async def run(self, stopped: asyncio.Event):
+        """ Processes updates until `stopped` is set, then waits for the running ones. """
+        loop = asyncio.get_running_loop()
+        # Updates in flight; polling pauses while all of them are taken
+        slots = asyncio.Semaphore(self.concurrency)
+        offset = 0
+        while not stopped.is_set():
+            try:
+                updates = await loop.run_in_executor(
+                    self._poll_executor, partial(self.bot.get_updates, offset=offset, timeout=self.poll_timeout))
+            except TelegramError as e:
+                logger.warning("getUpdates failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await slots.acquire()
+                task = loop.create_task(self._process(update, slots))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        await asyncio.gather(*self._tasks)
+        self.executor.shutdown()
+        self._poll_executor.shutdown()
+
+    async def _process(self, update, slots):
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.dispatcher.process_update, update)
+        finally:
+            slots.release()
+
+
+def build_parser():
+    # Updates are polled and dispatched here, the webhook and room worker options don't apply
+    parser = bot.build_parser(dispatch_options=False)
+    parser.add_argument('--concurrency', type=int, default=256, help='Updates processed at once')
+    parser.add_argument('--handler-workers', type=int, default=16, help='Threads running the handlers')
+    return parser
+
+
+async def serve(args, token, base_url=None, stopped=None, extra_handlers=()):
+    """ Runs the bot until `stopped` is set, or SIGINT/SIGTERM if it is not given. """
+    loop = asyncio.get_running_loop()
+    if stopped is None:
+        stopped = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+        bot.catalog.reload_on_sighup()
+
+    telegram_bot = Bot(token, base_url=base_url, request=bot.telegram_request(args))
+    bot.setup(args, telegram_bot, AsyncTimerService(loop, tick_interval=args.timer_edit_interval))
+
+    dispatcher = Dispatcher(telegram_bot, None, workers=0, use_context=True)
+    bot.add_handlers(dispatcher)
+    for handler, group in extra_handlers:
+        dispatcher.add_handler(handler, group)
+
+    runtime = AsyncRuntime(telegram_bot, dispatcher, concurrency=args.concurrency,
+                           handler_workers=args.handler_workers)
+    await runtime.run(stopped)
+    bot.shutdown(args)
+
+
+def main():
+    args = build_parser().parse_args()
+    config = bot.load_config(args.config)
+    asyncio.run(serve(args, config.token))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+""" Filling a hat word by word against a single add_words batch.
+
+Usage: python bench_add_words.py [--words N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from db import Hat, start_game
+
+
+def words_to_add(count):
+    return ["слово" + "а" * (i % 100) + "б" * (i // 100) for i in range(count)]
+
+
+def fill_one_by_one(hat, words, room):
+    for word in words:
+        hat.add_word(word, 1, room)
+
+
+def fill_batch(hat, words, room):
+    hat.add_words(words, 1, room)
+
+
+def measure(fill, words):
+    fd, db_file = tempfile.mkstemp()
+    try:
+        hat, game = start_game(db_file)
+        start = time.perf_counter()
+        fill(hat, words, "room")
+        elapsed = time.perf_counter() - start
+        assert hat.words_in_hat("room") == len(words)
+        return elapsed
+    finally:
+        os.close(fd)
+        os.remove(db_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hat fill benchmark')
+    parser.add_argument('--words', type=int, default=Hat.max_word_count(), help='Words to add')
+    args = parser.parse_args()
+
+    words = words_to_add(args.words)
+    print("words: {}".format(args.words))
+    print("add_word loop: {:.1f} ms".format(measure(fill_one_by_one, words) * 1e3))
+    print("add_words:     {:.1f} ms".format(measure(fill_batch, words) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
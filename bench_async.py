@@ -0,0 +1,132 @@
+""" Load test of the bot runtimes against a local fake Telegram API server.
+
+Every room gets its players, their words and /ready, then the leads play turns.
+Prints updates per second and update latency for the asyncio runtime (or the
+python-telegram-bot thread pool with --runtime threads).
+
+Usage: python bench_async.py [--rooms N] [--players N] [--turns N] [--runtime asyncio|threads]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from telegram import Update
+from telegram.ext import TypeHandler, Updater
+
+import async_bot
+import bot
+import texts
+from fake_telegram import FakeTelegram, TOKEN
+
+
+class Progress:
+    """ Counts processed updates, registered after the bot's handlers. """
+
+    def __init__(self):
+        self.done = {}
+        self._lock = threading.Condition()
+
+    def __call__(self, update, context):
+        with self._lock:
+            self.done[update.update_id] = time.monotonic()
+            self._lock.notify_all()
+
+    def wait(self, count, timeout=60):
+        with self._lock:
+            if not self._lock.wait_for(lambda: len(self.done) >= count, timeout):
+                raise TimeoutError("{} of {} updates processed".format(len(self.done), count))
+
+
+def room_name(room):
+    return "нагрузка" + "а" * (room % 30) + "б" * (room // 30)
+
+
+def run_scenario(telegram, progress, rooms, players, turns):
+    """ Sends the updates phase by phase, returns the sent updates. """
+    sent = []
+
+    def phase(messages):
+        for user_id, text in messages:
+            sent.append(telegram.send_update(user_id, text))
+        progress.wait(len(sent))
+
+    users = {room: [room * 100 + player + 1 for player in range(players)] for room in range(rooms)}
+    phase((user, room_name(room)) for room in users for user in users[room])
+    phase((user, " ".join("слово" + "а" * i + "в" * (user % 7) for i in range(5))) for room in users
+          for user in users[room])
+    phase((user, "/ready") for room in users for user in users[room])
+    for _ in range(turns):
+        leads = [bot.registry.get(room_name(room)).round.lead for room in users]
+        phase((lead, texts.next_word_button) for lead in leads)
+        phase((lead, texts.guessed_button) for lead in leads)
+        phase((lead, texts.end_of_turn_button) for lead in leads)
+    return sent
+
+
+def run_asyncio(args, telegram, progress):
+    async def scenario():
+        stopped = asyncio.Event()
+        serving = asyncio.create_task(async_bot.serve(args, TOKEN, base_url=telegram.base_url, stopped=stopped,
+                                                      extra_handlers=[(TypeHandler(Update, progress), 1)]))
+        start = time.monotonic()
+        sent = await asyncio.get_running_loop().run_in_executor(
+            None, run_scenario, telegram, progress, args.rooms, args.players, args.turns)
+        elapsed = time.monotonic() - start
+        stopped.set()
+        await serving
+        return sent, elapsed
+
+    return asyncio.run(scenario())
+
+
+def run_threads(args, telegram, progress):
+    updater = Updater(TOKEN, base_url=telegram.base_url, use_context=True, workers=args.handler_workers)
+    bot.setup(args, updater.bot)
+    bot.add_handlers(updater.dispatcher)
+    updater.dispatcher.add_handler(TypeHandler(Update, progress), 1)
+    updater.start_polling(poll_interval=0, timeout=1)
+    start = time.monotonic()
+    sent = run_scenario(telegram, progress, args.rooms, args.players, args.turns)
+    elapsed = time.monotonic() - start
+    updater.stop()
+    bot.shutdown(args)
+    return sent, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bot runtime load test')
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--runtime', choices=["asyncio", "threads"], default="asyncio")
+    options, rest = parser.parse_known_args()
+
+    fd, db_file = tempfile.mkstemp()
+    telegram = FakeTelegram().start()
+    try:
+        args = async_bot.build_parser().parse_args([db_file, os.devnull, "staging"] + rest)
+        args.rooms, args.players, args.turns = options.rooms, options.players, options.turns
+        for room in range(args.rooms):
+            bot.catalog.add(room_name(room))
+        progress = Progress()
+        run = run_asyncio if options.runtime == "asyncio" else run_threads
+        sent, elapsed = run(args, telegram, progress)
+    finally:
+        telegram.stop()
+        os.close(fd)
+        os.remove(db_file)
+
+    latencies = sorted(progress.done[u["update_id"]] - u["queued_at"] for u in sent)
+    print("runtime: {}, rooms: {}, players: {}".format(options.runtime, args.rooms, args.players))
+    print("updates: {}, {:.0f} updates/s".format(len(sent), len(sent) / elapsed))
+    print("API calls by the bot: {}".format(len(telegram.sent)))
+    print("latency p50 {:.1f} ms, p99 {:.1f} ms".format(statistics.median(latencies) * 1e3,
+                                                        latencies[int(len(latencies) * 0.99)] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
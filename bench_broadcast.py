@@ -0,0 +1,67 @@
+""" Broadcast throughput against a fake Bot with network latency.
+
+Compares sending every message serially, as the handlers did, with the Broadcaster worker pool.
+Usage: python bench_broadcast.py [--rooms N] [--players N] [--latency SECONDS] [--workers N]
+"""
+import argparse
+import threading
+import time
+
+from broadcast import Broadcaster
+
+
+class FakeBot:
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        time.sleep(self.latency)
+        with self.lock:
+            self.sent += 1
+
+
+def messages(rooms, players):
+    """ One broadcast per room: a message to every player of the room. """
+    return [(room * players + player, "Поехали!") for room in range(rooms) for player in range(players)]
+
+
+def serial(bot, batch):
+    for chat_id, text in batch:
+        bot.send_message(chat_id, text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Broadcast benchmark')
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per fake API call')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--global-rate', type=float, default=1000, help='Messages per second over all chats')
+    args = parser.parse_args()
+
+    batch = messages(args.rooms, args.players)
+
+    bot = FakeBot(args.latency)
+    start = time.perf_counter()
+    serial(bot, batch)
+    serial_time = time.perf_counter() - start
+
+    bot = FakeBot(args.latency)
+    broadcaster = Broadcaster(bot, workers=args.workers, global_rate=args.global_rate)
+    start = time.perf_counter()
+    for chat_id, text in batch:
+        broadcaster.send_message(chat_id, text)
+    enqueue_time = time.perf_counter() - start
+    broadcaster.join()
+    pool_time = time.perf_counter() - start
+    broadcaster.stop()
+
+    print("messages: {}, latency: {} s".format(len(batch), args.latency))
+    print("serial:      {:8.1f} msg/s, handler blocked {:.3f} s".format(len(batch) / serial_time, serial_time))
+    print("broadcaster: {:8.1f} msg/s, handler blocked {:.3f} s".format(len(batch) / pool_time, enqueue_time))
+
+
+if __name__ == '__main__':
+    main()
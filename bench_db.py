@@ -0,0 +1,62 @@
+""" Per-call latency of the hat queries as the database history grows.
+
+Usage: python bench_db.py [--calls N]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from db import Hat, Game, migrate
+
+HISTORY_SIZES = [0, 10000, 100000, 300000]
+
+
+def fill_history(db_file, size):
+    """ Adds `size` used words spread over finished rooms. """
+    conn = sqlite3.connect(db_file)
+    conn.executemany("INSERT INTO words(word, author, room, used) VALUES(?, 0, ?, 1);",
+                     (("слово" + str(i), "old" + str(i % 1000)) for i in range(size)))
+    conn.commit()
+    conn.close()
+
+
+def per_call_us(func, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def run(history, calls, migrated):
+    fd, db_file = tempfile.mkstemp()
+    try:
+        hat = Hat(db_file)
+        Game(db_file)
+        fill_history(db_file, history)
+        if migrated:
+            migrate(hat.cursor())
+        add = per_call_us(lambda i: hat.add_word("кот" + "а" * (i % 150) + "б" * (i // 150), 1, "room"), calls)
+        count = per_call_us(lambda i: hat.words_in_hat("room"), calls)
+        get = per_call_us(lambda i: hat.get_word("room"), calls)
+        return add, count, get
+    finally:
+        os.close(fd)
+        os.remove(db_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hat query latency benchmark')
+    parser.add_argument('--calls', type=int, default=200, help='Calls per measured operation')
+    args = parser.parse_args()
+
+    print("{:>8} {:>9} {:>12} {:>12} {:>12}".format("history", "migrated", "add_word us", "count us", "get_word us"))
+    for history in HISTORY_SIZES:
+        for migrated in (False, True):
+            add, count, get = run(history, args.calls, migrated)
+            print("{:>8} {:>9} {:>12.1f} {:>12.1f} {:>12.1f}".format(history, str(migrated), add, count, get))
+
+
+if __name__ == '__main__':
+    main()
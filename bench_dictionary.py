@@ -0,0 +1,68 @@
+""" Startup time and memory of the dictionaries: Python lists against compiled memory-mapped files.
+
+Every mode runs in a fresh interpreter so that the numbers do not mix.
+Usage: python bench_dictionary.py [--samples N]
+"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+
+from dictionary import dictionary_names, read_dictionaries, compile_dictionaries
+
+
+def rss_kb():
+    """ Current resident set size, Linux only. """
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4
+
+
+def read_lists(directory="dictionaries"):
+    """ The previous loader: every dictionary as a list of str. """
+    result = {}
+    for dictionary_name in dictionary_names(directory):
+        result[dictionary_name] = list(
+            map(str.strip, open(directory + "/" + dictionary_name + ".txt", encoding='utf8').readlines()))
+    return result
+
+
+def run_mode(mode, samples):
+    rss_before = rss_kb()
+    start = time.perf_counter()
+    dictionaries = read_lists() if mode == "lists" else read_dictionaries()
+    loaded = time.perf_counter()
+    for name in dictionaries:
+        if mode == "lists":
+            random.sample(dictionaries[name], samples)
+        else:
+            dictionaries[name].sample(samples)
+    sampled = time.perf_counter()
+    return {"mode": mode,
+            "load_ms": (loaded - start) * 1e3,
+            "first_sample_ms": (sampled - loaded) * 1e3,
+            "rss_kb": rss_kb() - rss_before}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dictionary store benchmark')
+    parser.add_argument('--samples', type=int, default=100, help='Words sampled from every dictionary')
+    parser.add_argument('--mode', choices=["lists", "compact"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.samples)))
+        return
+
+    compile_dictionaries()
+    print("{:>8} {:>10} {:>16} {:>10}".format("mode", "load ms", "first sample ms", "RSS KiB"))
+    for mode in ["lists", "compact"]:
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, "--samples", str(args.samples)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+        print("{mode:>8} {load_ms:>10.2f} {first_sample_ms:>16.2f} {rss_kb:>10}".format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+""" Draw latency at a full hat: the old fetch-all path against the slot lookup.
+
+Usage: python bench_draw.py [--words N] [--draws N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from db import Hat, start_game
+
+ROOM = "room"
+
+
+def old_get_word(hat, room):
+    """ The draw path before slots: fetch every unused word and pick one in Python. """
+    words = hat.cursor().execute("SELECT word FROM words WHERE room=? AND used=0;", (room,)).fetchall()
+    if not words:
+        return None
+    word = random.choice(words)[0]
+    hat.cursor().execute("UPDATE words SET used=1, slot=NULL WHERE word=? AND room=? AND used=0;", (word, room))
+    return word
+
+
+def fill(hat: Hat, count):
+    for i in range(count):
+        hat.add_word("слово" + "а" * (i % 100) + "б" * (i // 100), 1, ROOM)
+
+
+def measure(draw, hat, draws):
+    """ Average draw latency in microseconds, the hat stays full. """
+    elapsed = 0
+    for _ in range(draws):
+        start = time.perf_counter()
+        word = draw(hat, ROOM)
+        elapsed += time.perf_counter() - start
+        # Put the word back, keeping the hat full
+        hat.add_word(word, 1, ROOM)
+    return elapsed / draws * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hat draw benchmark')
+    parser.add_argument('--words', type=int, default=Hat.max_word_count(), help='Words in the hat')
+    parser.add_argument('--draws', type=int, default=500, help='Measured draws per path')
+    args = parser.parse_args()
+
+    fd, db_file = tempfile.mkstemp()
+    try:
+        hat, game = start_game(db_file)
+        fill(hat, args.words)
+        new = measure(Hat.get_word, hat, args.draws)
+        # The old path leaves holes in the slots, so it goes last
+        old = measure(old_get_word, hat, args.draws)
+    finally:
+        os.close(fd)
+        os.remove(db_file)
+    print("words in hat: {}".format(args.words))
+    print("fetch-all draw: {:.1f} us".format(old))
+    print("slot draw:      {:.1f} us".format(new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+""" Latency of the lookups every handler starts with: the in-memory index against SQL queries.
+
+Measures what /ready does before the round logic: the player's room and the room size.
+Usage: python bench_game.py [--players N] [--calls N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from db import start_game, find_player_room_q, room_count_q
+
+
+def queried_prologue(game, player_id):
+    room = game.cursor().execute(find_player_room_q, (player_id,)).fetchone()[0]
+    return game.cursor().execute(room_count_q, (room,)).fetchone()[0]
+
+
+def indexed_prologue(game, player_id):
+    return game.room_size(game.room_for_player(player_id))
+
+
+def per_call_us(prologue, game, players, calls):
+    ids = [random.randrange(players) for _ in range(calls)]
+    start = time.perf_counter()
+    for player_id in ids:
+        prologue(game, player_id)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Player lookup benchmark')
+    parser.add_argument('--players', type=int, default=20000)
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+
+    fd, db_file = tempfile.mkstemp()
+    try:
+        hat, game = start_game(db_file)
+        game.cursor().execute("BEGIN;")
+        game.cursor().executemany("INSERT INTO players(id, room) VALUES(?, ?);",
+                                  ((i, "room" + str(i // 6)) for i in range(args.players)))
+        game.cursor().execute("COMMIT;")
+        start = time.perf_counter()
+        game.load()
+        load_ms = (time.perf_counter() - start) * 1e3
+        queried = per_call_us(queried_prologue, game, args.players, args.calls)
+        indexed = per_call_us(indexed_prologue, game, args.players, args.calls)
+    finally:
+        os.close(fd)
+        os.remove(db_file)
+    print("players: {}, index load: {:.1f} ms".format(args.players, load_ms))
+    print("SQL lookups:   {:.2f} us per handler".format(queried))
+    print("index lookups: {:.2f} us per handler".format(indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+""" Throughput of add_word and get_word from 8 threads, with the rollback journal and synchronous=FULL
+that SQLite uses by default, and with the pragmas of db.py.
+
+Usage: python bench_pool.py [--threads N] [--calls N]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import db
+from db import start_game
+
+DEFAULT_PRAGMAS = ("PRAGMA journal_mode=DELETE;", "PRAGMA synchronous=FULL;")
+
+
+def run_threads(count, func):
+    threads = [threading.Thread(target=func, args=(i,)) for i in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def bench(pragmas, threads, calls):
+    db.pragmas = pragmas
+    with tempfile.TemporaryDirectory() as directory:
+        hat, game = start_game(os.path.join(directory, "bench.db"))
+
+        def add(thread):
+            for i in range(calls):
+                hat.add_word("слово" + "а" * (i % 100) + "б" * (i // 100), thread, "room" + str(thread))
+
+        def get(thread):
+            for i in range(calls):
+                hat.get_word("room" + str(thread))
+
+        add_time = run_threads(threads, add)
+        get_time = run_threads(threads, get)
+    return threads * calls / add_time, threads * calls / get_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Connection settings benchmark')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=500)
+    args = parser.parse_args()
+    tuned = db.pragmas
+    for name, pragmas in (("rollback journal, synchronous=FULL", DEFAULT_PRAGMAS), ("db.py pragmas", tuned)):
+        add, get = bench(pragmas, args.threads, args.calls)
+        print("{}: add_word {:.0f}/s, get_word {:.0f}/s".format(name, add, get))
+
+
+if __name__ == '__main__':
+    main()
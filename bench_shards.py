@@ -0,0 +1,110 @@
+""" Load test of the room-sharded mode against a local fake Telegram API server.
+
+Plays the scenario of bench_async.py with 1, 2, 4... worker processes and prints updates per second for each.
+Leads are found from the turn messages, the workers' state is not visible from here.
+
+Usage: python bench_shards.py [--rooms N] [--players N] [--turns N] [--shards 1 2 4] [shards.py options]
+"""
+import argparse
+import os
+import re
+import statistics
+import tempfile
+import threading
+import time
+
+import shards
+import texts
+from bench_async import Progress, room_name
+from fake_telegram import FakeTelegram, TOKEN
+
+turn_re = re.compile(r"player(\d+) -> player(\d+)")
+
+
+def leads(telegram, users, turns_played, timeout=60):
+    """ Waits for the message announcing the next turn in every room, returns the leads. """
+    deadline = time.monotonic() + timeout
+    while True:
+        found = []
+        for room_users in users.values():
+            turns = [turn_re.search(text) for text in telegram.messages_to(room_users[0])]
+            turns = [turn for turn in turns if turn]
+            if len(turns) <= turns_played:
+                break
+            found.append(int(turns[-1].group(1)))
+        else:
+            return found
+        if time.monotonic() > deadline:
+            raise TimeoutError("turn messages were not sent")
+        time.sleep(0.01)
+
+
+def run_scenario(telegram, progress, rooms, players, turns):
+    sent = []
+
+    def phase(messages):
+        for user_id, text in messages:
+            sent.append(telegram.send_update(user_id, text))
+        progress.wait(len(sent))
+
+    users = {room: [room * 100 + player + 1 for player in range(players)] for room in range(rooms)}
+    phase((user, room_name(room)) for room in users for user in users[room])
+    phase((user, " ".join("слово" + "а" * i + "в" * (user % 7) for i in range(5))) for room in users
+          for user in users[room])
+    phase((user, "/ready") for room in users for user in users[room])
+    for turn in range(turns):
+        room_leads = leads(telegram, users, turn)
+        phase((lead, texts.next_word_button) for lead in room_leads)
+        phase((lead, texts.guessed_button) for lead in room_leads)
+        phase((lead, texts.end_of_turn_button) for lead in room_leads)
+    return sent
+
+
+def bench(options, rest, shard_count):
+    directory = tempfile.mkdtemp()
+    telegram = FakeTelegram().start()
+    progress = Progress()
+    stopped = threading.Event()
+    try:
+        args = shards.build_parser().parse_args([os.path.join(directory, "bot.db"), os.devnull, "staging",
+                                                 "--shards", str(shard_count), "--poll-timeout", "1"] + rest)
+        extra_rooms = [room_name(room) for room in range(options.rooms)]
+        front = threading.Thread(target=shards.run, args=(args, TOKEN, telegram.base_url, stopped),
+                                 kwargs={"on_done": lambda update_id: progress(FakeUpdate(update_id), None),
+                                         "extra_rooms": extra_rooms})
+        front.start()
+        # The front polls once the workers are up
+        while not telegram.polled:
+            time.sleep(0.01)
+        start = time.monotonic()
+        sent = run_scenario(telegram, progress, options.rooms, options.players, options.turns)
+        elapsed = time.monotonic() - start
+        stopped.set()
+        front.join()
+    finally:
+        telegram.stop()
+    latencies = sorted(progress.done[u["update_id"]] - u["queued_at"] for u in sent)
+    print("shards: {}, updates: {}, {:.0f} updates/s, latency p50 {:.1f} ms, p99 {:.1f} ms".format(
+        shard_count, len(sent), len(sent) / elapsed, statistics.median(latencies) * 1e3,
+        latencies[int(len(latencies) * 0.99)] * 1e3))
+
+
+class FakeUpdate:
+    def __init__(self, update_id):
+        self.update_id = update_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded bot load test')
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    options, rest = parser.parse_known_args()
+    print("rooms: {}, players: {}, cores: {}".format(options.rooms, options.players, os.cpu_count()))
+    for shard_count in options.shards:
+        bench(options, rest, shard_count)
+
+
+if __name__ == '__main__':
+    main()
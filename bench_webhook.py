@@ -0,0 +1,73 @@
+""" Update-to-handler latency of webhook mode against long polling, both with a local fake Telegram API server.
+
+In webhook mode the fake server posts every update to the bot's webhook as Telegram does after setWebhook,
+in polling mode the bot fetches them with getUpdates. The scenario is the one of bench_async.py.
+
+Usage: python bench_webhook.py [--rooms N] [--players N] [--turns N] [--mode webhook polling] [bot.py options]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import TypeHandler, Updater
+
+import bot
+from bench_async import Progress, room_name, run_scenario
+from fake_telegram import FakeTelegram, TOKEN
+from webhook import WebhookServer
+
+
+def bench(mode, options, rest):
+    fd, db_file = tempfile.mkstemp()
+    telegram = FakeTelegram().start()
+    progress = Progress()
+    try:
+        args = bot.build_parser().parse_args([db_file, os.devnull, "staging"] + rest)
+        updater = Updater(TOKEN, base_url=telegram.base_url, use_context=True, workers=args.webhook_workers)
+        bot.setup(args, updater.bot)
+        bot.add_handlers(updater.dispatcher)
+        updater.dispatcher.add_handler(TypeHandler(Update, progress), 1)
+        if mode == "webhook":
+            server = WebhookServer(updater.bot, updater.dispatcher, port=0, queue_size=args.webhook_queue,
+                                   workers=args.webhook_workers).start()
+            updater.bot.set_webhook(server.url, max_connections=args.webhook_workers)
+        else:
+            updater.start_polling(poll_interval=0, timeout=1)
+        start = time.monotonic()
+        sent = run_scenario(telegram, progress, options.rooms, options.players, options.turns)
+        elapsed = time.monotonic() - start
+        if mode == "webhook":
+            server.stop()
+            rejected = server.rejected
+        else:
+            updater.stop()
+            rejected = 0
+        bot.shutdown(args)
+    finally:
+        telegram.stop()
+        os.close(fd)
+        os.remove(db_file)
+    latencies = sorted(progress.done[u["update_id"]] - u["queued_at"] for u in sent)
+    print("{}: {} updates, {:.0f} updates/s, latency p50 {:.1f} ms, p99 {:.1f} ms, rejected {}".format(
+        mode, len(sent), len(sent) / elapsed, statistics.median(latencies) * 1e3,
+        latencies[int(len(latencies) * 0.99)] * 1e3, rejected))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook and polling latency')
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--mode', nargs='+', choices=["webhook", "polling"], default=["webhook", "polling"])
+    options, rest = parser.parse_known_args()
+    for room in range(options.rooms):
+        bot.catalog.add(room_name(room))
+    for mode in options.mode:
+        bench(mode, options, rest)
+
+
+if __name__ == '__main__':
+    main()
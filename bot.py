@@ -2,38 +2,53 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import importlib
 import logging
 import random
+import signal
+import ssl
+import sys
 import threading
-import time
 from datetime import datetime
+from queue import Queue
+from urllib.parse import urlsplit
 
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Bot, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
+from telegram.utils.request import Request
 
-import prod_config
-import staging_config
+import db
+import metrics
 import texts
-from db import start_game, HatWrapper, Game, Hat
+from broadcast import Broadcaster
+from db import start_game, DISCARDED, HatWrapper, Game, Hat, CachedHat, RoomStore, SubscriptionStore
+from dictionary import read_dictionaries
+from admission import Admission, parse_limits
+from logs import fields, setup_logging, stop_logging, timed_handler
+from maintenance import Maintenance
+from room_catalog import RoomCatalog
+from room_executor import RoomDispatcher, RoomExecutor
+from room_state import ALL_ROOMS, RoomRegistry
 from round import Round
+from timers import TimerService
+from webhook import WebhookServer
 
 logger = logging.getLogger(__name__)
+configs = ['prod', 'staging']
 hat: Hat
 game: Game
+timers: TimerService
+broadcaster: Broadcaster
+maintenance: Maintenance
 
-allowed_rooms = list(map(str.strip, open("rooms.txt", encoding='utf8').readlines()))
-experimental_rooms = list(map(str.strip, open("experimental_rooms.txt", encoding='utf8').readlines()))
-personal_rooms = list(map(str.strip, open("personal_rooms.txt", encoding='utf8').readlines()))
+# Rooms players can join, loaded by setup
+catalog = RoomCatalog()
 dictionaries = {}
-
-
-def read_dictionaries():
-    result = {}
-    dictionary_names = list(map(str.strip, open("dictionaries/list.txt", encoding='utf8').readlines()))
-    for dictionary_name in dictionary_names:
-        result[dictionary_name] = list(
-            map(str.strip, open("dictionaries/" + dictionary_name + ".txt", encoding='utf8').readlines()))
-    return result
+registry = RoomRegistry()
+# Rate limits of the handlers, None if disabled
+admission = None
+# Runs the updates of each room in order with --room-workers, None if disabled
+room_executor = None
 
 
 def start(update, context):
@@ -53,24 +68,24 @@ reply_markup_game = ReplyKeyboardMarkup.from_column(buttons)
 reply_markup_ready = ReplyKeyboardMarkup.from_column(ready_button)
 
 
-def pretty_turn(turn, context):
-    return "{} -> {}".format(context.bot_data["username" + str(turn[0])], context.bot_data["username" + str(turn[1])])
+def pretty_turn(turn):
+    return "{} -> {}".format(registry.usernames[turn[0]], registry.usernames[turn[1]])
 
 
-def handle_timer(context, room, timer, message):
-    iteration = 0
-    while iteration < timer and not "abort_timer_message" + room in context.bot_data:
-        time.sleep(1)
-        iteration += 1
-        message.edit_text(str(iteration))
-    if "abort_timer_message" + room in context.bot_data:
-        message.edit_text(texts.timer_aborted_message.format(context.bot_data["abort_timer_message" + room]))
-    else:
-        message.edit_text(texts.timer_stopped_message)
-        for user in context.bot_data["room" + room]:
-            context.bot.send_message(context.bot_data["chatid" + str(user)], texts.timer_finished_message)
-        for user in context.bot_data["subs"]:
-            context.bot.send_message(context.bot_data["chatid" + str(user)], texts.timer_finished_message)
+def start_timer(state, timer, message):
+    def finish():
+        broadcaster.edit_message(message, texts.timer_stopped_message, key="timer")
+        with state.lock:
+            for user in state.ready:
+                broadcaster.send_message(registry.chat_ids[user], texts.timer_finished_message)
+        for user in registry.subscribers.of_room(state.name):
+            broadcaster.send_message(registry.chat_ids[user], texts.timer_finished_message)
+
+    timers.start(state.name, timer,
+                 on_tick=lambda elapsed: broadcaster.edit_message(message, str(elapsed), key="timer"),
+                 on_finish=finish,
+                 on_abort=lambda reason: broadcaster.edit_message(message, texts.timer_aborted_message.format(reason),
+                                                                  key="timer"))
 
 
 def start_turn(update, context):
@@ -78,29 +93,29 @@ def start_turn(update, context):
     text = update.message.text.lower()
     user_id = user['id']
     room = game.room_for_player(user_id)
-    if context.bot_data["round" + room].timer:
-        context.bot_data.pop("abort_timer_message" + room, None)
-        timer_message = update.message.reply_text(str(0))
-        thread = threading.Thread(target=handle_timer, args=(context, room,
-                                                             context.bot_data["round" + room].timer, timer_message))
-        thread.start()
-    logger.info("start_turn %d %s", user_id, text)
-    for user in context.bot_data["room" + room]:
-        context.bot.send_message(context.bot_data["chatid" + str(user)], texts.turn_started_message)
-    for user in context.bot_data["subs"]:
-        context.bot.send_message(context.bot_data["chatid" + str(user)], texts.turn_started_message)
-    reply = context.bot_data["round" + room].start_move(user_id)
+    state = registry.get(room)
+    logger.info("start_turn %d %s", user_id, text, extra=fields("start_turn", user_id, room))
+    with state.lock:
+        if state.round.timer:
+            timer_message = update.message.reply_text(str(0))
+            start_timer(state, state.round.timer, timer_message)
+        for user in state.ready:
+            broadcaster.send_message(registry.chat_ids[user], texts.turn_started_message)
+        reply = state.round.start_move(user_id)
+        registry.save(state)
+    for user in registry.subscribers.of_room(room):
+        broadcaster.send_message(registry.chat_ids[user], texts.turn_started_message)
     update.message.reply_text(reply, reply_markup=reply_markup_game)
 
 
-def send_results_to_all(context, room):
-    reply = get_results_reply(context, room)
-    for user in context.bot_data["room" + room]:
-        context.bot.send_message(context.bot_data["chatid" + str(user)],
+def send_results_to_all(state):
+    reply = get_results_reply(state)
+    for user in state.ready:
+        broadcaster.send_message(registry.chat_ids[user],
                                  reply,
                                  reply_markup=ReplyKeyboardRemove())
-    for user in context.bot_data["subs"]:
-        context.bot.send_message(context.bot_data["chatid" + str(user)],
+    for user in registry.subscribers.of_room(state.name):
+        broadcaster.send_message(registry.chat_ids[user],
                                  reply)
 
 
@@ -109,16 +124,18 @@ def results(update, context):
     user = update.message.from_user
     user_id = user['id']
     room = game.room_for_player(user_id)
-    logger.info("results %d", user_id)
-    reply = get_results_reply(context, room)
+    logger.info("results %d", user_id, extra=fields("results", user_id, room))
+    state = registry.get(room)
+    with state.lock:
+        reply = get_results_reply(state)
     update.message.reply_text(reply)
 
 
-def get_results_reply(context, room):
-    scores = context.bot_data["round" + room].pretty_scores()
+def get_results_reply(state):
+    scores = state.round.pretty_scores()
     scores_names = []
     for player, total_score, explained_score, guessed_score in scores:
-        player_username = context.bot_data["username" + str(player)]
+        player_username = registry.usernames[player]
         scores_names.append("{}: {}+{}={}".format(player_username, explained_score, guessed_score, total_score))
     reply = "\n".join(scores_names)
     return reply
@@ -128,11 +145,17 @@ def finish_round(update, context):
     user = update.message.from_user
     user_id = user['id']
     room = game.room_for_player(user_id)
-    send_results_to_all(context, room)
-    users_to_kick = list(context.bot_data["room" + room])
-    print(users_to_kick)
-    for user in users_to_kick:
-        leaveroom_player(user, context.bot_data["chatid" + str(user)], context)
+    state = registry.get(room)
+    with state.lock:
+        send_results_to_all(state)
+        users_to_kick = list(state.ready)
+        maintenance.finished(room)
+        logger.info("finish_round %s", users_to_kick, extra=fields("finish_round", user_id, room))
+        state.round.finish()
+        state.round = None
+        for user in users_to_kick:
+            leaveroom_player(user, registry.chat_ids[user], context)
+        save_room(state)
 
 
 def continue_turn(update, context):
@@ -140,27 +163,31 @@ def continue_turn(update, context):
     text = update.message.text.lower()
     user_id = user_data['id']
     room = game.room_for_player(user_id)
-    logger.info("continue_turn %d %s", user_id, text)
-    if text == texts.guessed_button:
-        reply = context.bot_data["round" + room].guessed(user_id)
-        update.message.reply_text(reply, reply_markup=reply_markup_game)
-        return
-    elif text == texts.fail_button:
-        context.bot_data["abort_timer_message" + room] = text
-        turn = context.bot_data["round" + room].failed(user_id)
-        reply = pretty_turn(turn, context)
-    elif text == texts.end_of_turn_button:
-        context.bot_data["abort_timer_message" + room] = text
-        turn = context.bot_data["round" + room].time_ran_out(user_id)
-        reply = pretty_turn(turn, context)
-
-    for user in context.bot_data["room" + room]:
-        if user == turn[0]:
-            context.bot.send_message(context.bot_data["chatid" + str(user)], reply, reply_markup=reply_markup_ready)
-        else:
-            context.bot.send_message(context.bot_data["chatid" + str(user)], reply, reply_markup=ReplyKeyboardRemove())
-    for user in context.bot_data["subs"]:
-        context.bot.send_message(context.bot_data["chatid" + str(user)], reply, reply_markup=ReplyKeyboardRemove())
+    state = registry.get(room)
+    logger.info("continue_turn %d %s", user_id, text, extra=fields("continue_turn", user_id, room))
+    with state.lock:
+        if text == texts.guessed_button:
+            reply = state.round.guessed(user_id)
+            registry.save(state)
+            update.message.reply_text(reply, reply_markup=reply_markup_game)
+            return
+        elif text == texts.fail_button:
+            timers.abort(room, text)
+            turn = state.round.failed(user_id)
+            reply = pretty_turn(turn)
+        elif text == texts.end_of_turn_button:
+            timers.abort(room, text)
+            turn = state.round.time_ran_out(user_id)
+            reply = pretty_turn(turn)
+        registry.save(state)
+
+        for user in state.ready:
+            if user == turn[0]:
+                broadcaster.send_message(registry.chat_ids[user], reply, reply_markup=reply_markup_ready)
+            else:
+                broadcaster.send_message(registry.chat_ids[user], reply, reply_markup=ReplyKeyboardRemove())
+    for user in registry.subscribers.of_room(room):
+        broadcaster.send_message(registry.chat_ids[user], reply, reply_markup=ReplyKeyboardRemove())
 
 
 def echo(update, context):
@@ -169,7 +196,7 @@ def echo(update, context):
     text = update.message.text.lower()
     user_id = user['id']
     room = game.room_for_player(user_id)
-    logger.info("ECHO %d %s", user_id, text)
+    logger.info("ECHO %d %s", user_id, text, extra=fields("echo", user_id, room))
     reply_markup = None
     if "settimer" in context.user_data and context.user_data["settimer"]:
         timer = int(text) if text.isdigit() and 0 < len(text) < 4 else -1
@@ -178,9 +205,12 @@ def echo(update, context):
             if timer == 0:
                 timer = None
                 reply = texts.timer_unset_message
-            if "round" + room in context.bot_data:
-                context.bot_data["round" + room].timer = timer
-            context.bot_data["timer" + room] = timer
+            state = registry.get(room)
+            with state.lock:
+                if state.round:
+                    state.round.timer = timer
+                state.timer = timer
+                registry.save(state)
         else:
             reply = texts.invalid_timer_format_message
         context.user_data["settimer"] = False
@@ -206,12 +236,13 @@ def echo(update, context):
             reply = add_single_or_multiple_words(room, user_id, words)
     if reply is None:
         # Add user to the room
-        print(text)
+        logger.info("join %d %s", user_id, text, extra=fields("join", user_id))
         text = text.lower()
-        if text in allowed_rooms or text in personal_rooms:
+        room_info = catalog.get(text)
+        if room_info and not room_info.experimental:
             game.add_player(user_id, text)
             reply = texts.room_greeting_message.format(text, hat.words_in_hat(text))
-        elif text in experimental_rooms:
+        elif room_info:
             game.add_player(user_id, text)
             reply = texts.welcome_exp
         else:
@@ -229,8 +260,8 @@ def add_single_or_multiple_words(room, user_id, words):
     else:
         added_word_count = 0
         skipped_words = []
-        for word in words:
-            if hat.add_word(word, user_id, room):
+        for word, added in zip(words, hat.add_words(words, user_id, room)):
+            if added:
                 added_word_count += 1
             else:
                 skipped_words.append(word)
@@ -251,12 +282,13 @@ def add_words_from_dictionary(room, user_id, words):
         return texts.illegal_to_add_word_count_message.format(hat.max_word_count())
     if hat.words_in_hat(room) + to_add_word_count > hat.max_word_count():
         return texts.illegal_total_word_count_message.format(hat.max_word_count())
-    added_word_count = 0
-    while added_word_count < to_add_word_count:
-        add_words = random.sample(dictionaries[dictionary_name], to_add_word_count - added_word_count)
-        for word in add_words:
-            if hat.add_word(word, user_id, room):
-                added_word_count += 1
+    dictionary = dictionaries[dictionary_name]
+    in_hat = hat.room_words(room)
+    available_word_count = dictionary.available(in_hat)
+    if to_add_word_count > available_word_count:
+        return texts.not_enough_dictionary_words_message.format(dictionary_name, available_word_count)
+    add_words = dictionary.sample(to_add_word_count, exclude=in_hat)
+    added_word_count = sum(hat.add_words(add_words, user_id, room))
     reply = texts.words_added_from_dictionary_message.format(dictionary_name, added_word_count, hat.words_in_hat(room))
     return reply
 
@@ -287,94 +319,144 @@ def getword(update, context):
     user = update.message.from_user
     user_id = user['id']
     room = game.room_for_player(user_id)
-    logger.info("GETWORD %d", user_id)
+    logger.info("GETWORD %d", user_id, extra=fields("getword", user_id, room))
     if room:
         word = hat.get_word(room)
         if word:
-            reply = word
-        else:
-            reply = texts.words_finished_message
+            update.message.reply_text(word)
+            # The word is shown outside the round and does not go back to the hat
+            hat.finish(word, DISCARDED)
+            return
+        reply = texts.words_finished_message
     else:
         reply = texts.getword_from_hall_message
     update.message.reply_text(reply)
 
 
-def check_ready(room, context):
-    if game.room_size(room) > 1 and (len(context.bot_data["room" + room]) == game.room_size(room)):
+def check_ready(state):
+    room_size = game.room_size(state.name)
+    if room_size > 1 and len(state.ready) == room_size:
         return True
     else:
         return False
 
 
-def start_round(room, context):
+def start_round(state):
     reply = texts.everyone_ready
-    hatwr = HatWrapper(room, hat)
-    if len(context.bot_data["room" + room]) < 2:
-        reply = texts.not_enough_players_message
-        turn = (0, 0)
-    else:
-        context.bot_data["round" + room] = Round(hatwr, list(context.bot_data["room" + room]))
-        if "timer" + room in context.bot_data:
-            context.bot_data["round" + room].timer = context.bot_data["timer" + room]
-        turn = context.bot_data["round" + room].start_game()
-        reply += pretty_turn(turn, context)
-    for user in context.bot_data["room" + room]:
-        reply_markup = None
-        if user == turn[0]:
-            reply_markup = reply_markup_ready
-        context.bot.send_message(context.bot_data["chatid" + str(user)], reply,
-                                 reply_markup=reply_markup)
-    for user in context.bot_data["subs"]:
-        context.bot.send_message(context.bot_data["chatid" + str(user)], reply)
+    hatwr = HatWrapper(state.name, hat)
+    with state.lock:
+        if len(state.ready) < 2:
+            reply = texts.not_enough_players_message
+            turn = (0, 0)
+        else:
+            if state.round:
+                # /force_start replaced a running round
+                state.round.finish()
+            state.round = Round(hatwr, list(state.ready))
+            state.round.timer = state.timer
+            turn = state.round.start_game()
+            reply += pretty_turn(turn)
+            registry.save(state)
+        for user in state.ready:
+            reply_markup = None
+            if user == turn[0]:
+                reply_markup = reply_markup_ready
+            broadcaster.send_message(registry.chat_ids[user], reply,
+                                     reply_markup=reply_markup)
+    for user in registry.subscribers.of_room(state.name):
+        broadcaster.send_message(registry.chat_ids[user], reply)
 
 
 def force_start(update, context):
     user = update.message.from_user
     user_id = user['id']
     room = game.room_for_player(user_id)
-    start_round(room, context)
+    start_round(registry.get(room))
+
+
+def subscription_room(update):
+    """ Room named after the command or ALL_ROOMS, None if there is no such room. """
+    args = update.message.text.split()[1:]
+    if not args:
+        return ALL_ROOMS
+    room = args[0].lower()
+    return room if room in catalog else None
+
+
+def add_subscription(user_id, chat_id, room):
+    """ Subscribes the user to the room of subscription_room, returns the reply. """
+    if room is None:
+        return texts.no_such_rooms_message
+    if registry.subscribers.add(user_id, chat_id, room):
+        registry.chat_ids[user_id] = chat_id
+        return texts.subscribed_message
+    return texts.already_subscribed_message
+
+
+def remove_subscription(user_id, room):
+    """ Unsubscribes the user from the room or, without one, from everything, returns the reply. """
+    if registry.subscribers.remove(user_id, room):
+        return texts.unsubscribed_message
+    return texts.not_subscribed_message
 
 
 def subscribe(update, context):
     user = update.message.from_user
     user_id = user['id']
-    logger.info("SUB %d", user_id)
-    context.bot_data["chatid" + str(user_id)] = update.message.chat.id
-    if "subs" not in context.bot_data:
-        context.bot_data["subs"] = []
-    context.bot_data["subs"].append(user_id)
+    room = subscription_room(update)
+    logger.info("SUB %d %s", user_id, room, extra=fields("subscribe", user_id, room))
+    update.message.reply_text(add_subscription(user_id, update.message.chat.id, room))
+
+
+def unsubscribe(update, context):
+    user = update.message.from_user
+    user_id = user['id']
+    args = update.message.text.split()[1:]
+    room = args[0].lower() if args else None
+    logger.info("UNSUB %d %s", user_id, room, extra=fields("unsubscribe", user_id, room))
+    update.message.reply_text(remove_subscription(user_id, room))
 
 
 def ready(update, context):
     user = update.message.from_user
     user_id = user['id']
     room = game.room_for_player(user_id)
-    logger.info("READY %d", user_id)
+    logger.info("READY %d", user_id, extra=fields("ready", user_id, room))
     reply_markup = None
     if room:
-        context.bot_data["chatid" + str(user_id)] = update.message.chat.id
-        context.bot_data["username" + str(user_id)] = user['first_name']
-        if "room" + room in context.bot_data:
-            context.bot_data["room" + room].add(user_id)
-        else:
-            context.bot_data["room" + room] = {user_id}
-        reply = texts.ready
-        if check_ready(room, context):
-            start_round(room, context)
-            return
+        registry.chat_ids[user_id] = update.message.chat.id
+        registry.usernames[user_id] = user['first_name']
+        state = registry.get(room)
+        with state.lock:
+            state.ready.add(user_id)
+            registry.save(state)
+            reply = texts.ready
+            if check_ready(state):
+                start_round(state)
+                return
     else:
         reply = texts.ready_from_hall_message
     update.message.reply_text(reply, reply_markup=reply_markup)
 
 
+def save_room(state):
+    """ Saves the state of the room, or deletes it once the last player left. Hold `state.lock`. """
+    if game.room_size(state.name):
+        registry.save(state)
+    else:
+        registry.delete(state)
+
+
 def leaveroom_player(user_id, chat_id, context):
     room = game.room_for_player(user_id)
-    print(room)
-    if "room" + room in context.bot_data:
-        if user_id in context.bot_data["room" + room]:
-            context.bot_data["room" + room].remove(user_id)
+    logger.info("leaveroom %d", user_id, extra=fields("leaveroom", user_id, room))
     game.leave_room(user_id)
-    context.bot.send_message(chat_id, texts.room_left)
+    if room:
+        state = registry.get(room)
+        with state.lock:
+            state.ready.discard(user_id)
+            save_room(state)
+    broadcaster.send_message(chat_id, texts.room_left)
 
 
 def leaveroom(update, context):
@@ -388,59 +470,320 @@ def error(update, context):
     logger.warning('Update "%s" caused error "%s"', update, context.error)
 
 
-def main():
-    configs = {'prod': prod_config,
-               'staging': staging_config,
-               }
-
+def build_parser(dispatch_options=True):
+    """ Options of the bot. Runtimes with their own update dispatching leave out `dispatch_options`:
+    webhook and room worker options only apply to the Updater of main(). """
     parser = argparse.ArgumentParser(description='Hat bot')
     parser.add_argument('db_file', help='SQLite database file')
     parser.add_argument('log_file', help='Log file name')
-    parser.add_argument('config', help='Environment', choices=list(configs.keys()))
-    args = parser.parse_args()
-
-    config = configs[args.config]
-
+    parser.add_argument('config', help='Environment', choices=configs)
+    parser.add_argument('--timer-edit-interval', type=int, default=5,
+                        help='Seconds between updates of the timer message')
+    parser.add_argument('--broadcast-workers', type=int, default=4,
+                        help='Threads sending messages to players and subscribers')
+    parser.add_argument('--broadcast-rate', type=float, default=30,
+                        help='Messages per second to all chats together')
+    parser.add_argument('--chat-rate', type=float, default=1,
+                        help='Messages per second to one chat')
+    parser.add_argument('--cached-hat', action='store_true',
+                        help='Keep hats of active rooms in memory and write them to the database in background')
+    parser.add_argument('--db-connections', type=int, default=32,
+                        help='SQLite connections to the database, threads beyond it wait for one. '
+                             'Raised to the number of threads running the handlers if it is lower')
+    parser.add_argument('--maintenance-interval', type=float, default=60,
+                        help='Seconds between archival and vacuum slices, 0 disables them')
+    parser.add_argument('--retention-days', type=float,
+                        help='Days to keep archived words, forever by default')
+    if dispatch_options:
+        parser.add_argument('--webhook-port', type=int,
+                            help='Receive updates on a webhook on this port instead of long polling')
+        parser.add_argument('--webhook-host', default='127.0.0.1',
+                            help='Address the webhook listens on')
+        parser.add_argument('--webhook-url',
+                            help='Public URL registered with setWebhook, its path is the path of the webhook')
+        parser.add_argument('--webhook-queue', type=int, default=1000,
+                            help='Updates waiting for a handler, Telegram retries updates beyond it')
+        parser.add_argument('--webhook-workers', type=int, default=8,
+                            help='Threads running the handlers in webhook mode')
+        parser.add_argument('--webhook-cert', help='Certificate file to serve the webhook over HTTPS')
+        parser.add_argument('--webhook-key', help='Private key of the certificate')
+        parser.add_argument('--webhook-secret',
+                            help='Secret token registered with setWebhook, posts without it are refused')
+        parser.add_argument('--room-workers', type=int, default=0,
+                            help='Threads running the handlers with the updates of each room in order, '
+                                 '0 to run them on the dispatcher as they come')
+        parser.add_argument('--room-mailbox', type=int, default=100,
+                            help='Updates queued per room with --room-workers, later ones are dropped')
+    parser.add_argument('--rooms-reload-interval', type=float, default=5,
+                        help='Seconds between checks of the room files for changes')
+    parser.add_argument('--rate-limit', type=parse_limits, action='append', default=[],
+                        metavar='KIND=USER_RATE,USER_BURST,ROOM_RATE,ROOM_BURST',
+                        help='Updates per second and bursts of a player and of a room of this kind '
+                             '(public, personal or experimental), repeat for every kind to limit. Users '
+                             'outside rooms get the user limits of the default kind, or else the strictest ones')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve Prometheus metrics on this local port, disabled by default')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='DEBUG adds a record with the duration of every handled update')
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 2 ** 20,
+                        help='Size at which the log file is rotated')
+    parser.add_argument('--log-backups', type=int, default=5,
+                        help='Number of rotated log files to keep')
+    parser.add_argument('--log-sample', type=int, default=1,
+                        help='Write one of every N messages and game buttons to the log')
+    return parser
+
+
+def load_config(name):
+    """ Imports prod_config or staging_config, they are created locally and hold the token. """
+    return importlib.import_module(name + "_config")
+
+
+def handler_threads(args):
+    """ Number of threads running the handlers in the runtime configured by args. """
+    if getattr(args, 'handler_workers', None):
+        return args.handler_workers
+    if getattr(args, 'room_workers', None):
+        return args.room_workers
+    if getattr(args, 'webhook_port', None):
+        return args.webhook_workers
+    # The dispatcher thread of the Updater
+    return 1
+
+
+def telegram_request(args):
+    """ HTTP connections of the Bot API client: every handler thread and broadcast worker may hold one,
+    and so may polling and the Updater's own threads. """
+    return Request(con_pool_size=handler_threads(args) + args.broadcast_workers + 4)
+
+
+def setup(args, bot, timer_service=None):
+    """ Starts the services used by the handlers, messages are sent by `bot`. """
     # Initialize random from time for later use
-    random.seed(datetime.now())
+    random.seed(datetime.now().timestamp())
 
-    # Read dictionary files into RAM
+    catalog.load()
+    catalog.start_thread(args.rooms_reload_interval)
+
+    # Open dictionaries, their compiled files are memory-mapped on first use
     global dictionaries
     dictionaries = read_dictionaries()
 
-    logging.basicConfig(filename=args.log_file,
-                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                        level=logging.INFO)
+    setup_logging(args.log_file, level=args.log_level, max_bytes=args.log_max_bytes, backups=args.log_backups,
+                  sample_every=args.log_sample)
+
+    # Before the database is opened so that its cursors are instrumented
+    if args.metrics_port is not None:
+        metrics.enable()
+        metrics.count_messages(bot)
 
+    # A thread keeps its connection until it exits: every handler thread, the maintenance thread and the
+    # flush thread of the cached hat need their own
+    db.pool_size = max(args.db_connections, handler_threads(args) + 2)
+    if db.pool_size > args.db_connections:
+        logger.warning("--db-connections %d is below the threads using the database, using %d",
+                       args.db_connections, db.pool_size)
     global hat, game
     hat, game = start_game(args.db_file)
-
-    updater = Updater(token=config.token, use_context=True)
-
-    # Get the dispatcher to register handlers
-    dp = updater.dispatcher
-
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("help", help))
-    dp.add_handler(CommandHandler("getword", getword))
-    dp.add_handler(CommandHandler("leaveroom", leaveroom))
-    dp.add_handler(CommandHandler("removeword", removeword))
-    dp.add_handler(CommandHandler("settimer", settimer))
-    dp.add_handler(CommandHandler("ready", ready))
-    dp.add_handler(CommandHandler("results", results))
-    dp.add_handler(CommandHandler("force_start", force_start))
-    dp.add_handler(CommandHandler("finish_round", finish_round))
-    dp.add_handler(CommandHandler("subscribe", subscribe))
-    dp.add_handler(MessageHandler(Filters.text(ready_button), start_turn))
-    dp.add_handler(MessageHandler(Filters.text(buttons), continue_turn))
-    dp.add_handler(MessageHandler(Filters.text, echo))
+    if args.cached_hat:
+        hat = CachedHat(hat)
+
+    global maintenance
+    maintenance = Maintenance(args.db_file, retention_days=args.retention_days)
+    if args.maintenance_interval:
+        maintenance.start_thread(args.maintenance_interval)
+
+    # Rooms are restored from the database on first access
+    global registry
+    registry = RoomRegistry(RoomStore(args.db_file), lambda room: HatWrapper(room, hat),
+                            SubscriptionStore(args.db_file))
+
+    global timers
+    if timer_service is None:
+        timer_service = TimerService(tick_interval=args.timer_edit_interval)
+        timer_service.start_thread()
+    timers = timer_service
+
+    global broadcaster
+    broadcaster = Broadcaster(bot, workers=args.broadcast_workers, global_rate=args.broadcast_rate,
+                              chat_rate=args.chat_rate)
+
+    global admission
+    admission = Admission(args.rate_limit, room_kind) if args.rate_limit else None
+
+    if metrics.enabled:
+        add_metrics()
+        metrics.serve(args.metrics_port)
+
+
+def add_metrics():
+    """ Registers metrics read from the services when /metrics is scraped. """
+    metrics.registry.add(metrics.CallbackMetric(
+        "hatbot_messages_coalesced_total", "Queued edits replaced by a newer one", "counter",
+        lambda: broadcaster.coalesced))
+    metrics.registry.add(metrics.CallbackMetric(
+        "hatbot_messages_queued", "Messages waiting to be sent", "gauge", lambda: broadcaster.queued()))
+    metrics.registry.add(metrics.CallbackMetric(
+        "hatbot_active_rooms", "Rooms playing a round", "gauge", registry.active_rooms))
+    metrics.registry.add(metrics.CallbackMetric(
+        "hatbot_active_timers", "Running round timers", "gauge", lambda: timers.active()))
+    if room_executor is not None:
+        metrics.registry.add(metrics.CallbackMetric(
+            "hatbot_room_mailbox_queued", "Updates waiting in the room mailboxes", "gauge", room_executor.queued))
+        metrics.registry.add(metrics.CallbackMetric(
+            "hatbot_room_mailbox_max_depth", "Updates waiting in the fullest room mailbox", "gauge",
+            room_executor.deepest))
+        metrics.registry.add(metrics.CallbackMetric(
+            "hatbot_room_mailbox_dropped_total", "Updates dropped because their room mailbox was full", "counter",
+            lambda: room_executor.dropped))
+    if admission is not None:
+        metrics.registry.add(metrics.CallbackMetric(
+            "hatbot_updates_throttled_total", "Updates dropped by the rate limits", "counter",
+            lambda: admission.throttled))
+
+
+def room_key(update):
+    """ Mailbox of an update: the sender's room, or the sender while they are not in a room. """
+    user = update.effective_user
+    if user is None:
+        return None
+    room = game.room_for_player(user.id)
+    return room if room is not None else user.id
+
+
+def room_kind(room):
+    room_info = catalog.get(room)
+    return room_info.kind if room_info else None
+
+
+def admitted(callback):
+    """ Wraps a handler callback to drop updates over the rate limits, if they are enabled. """
+    if admission is None:
+        return callback
+    return admission.wrap(callback, game.room_for_player, texts.throttled_message)
+
+
+def add_handlers(dp):
+    # Durations are logged, and measured for metrics only if they are enabled. Updates dropped by the rate
+    # limits are neither
+    def timed(callback):
+        callback = timed_handler(callback, game.room_for_player)
+        return admitted(metrics.timed_handler(callback) if metrics.enabled else callback)
+
+    dp.add_handler(CommandHandler("start", timed(start)))
+    dp.add_handler(CommandHandler("help", timed(help)))
+    dp.add_handler(CommandHandler("getword", timed(getword)))
+    dp.add_handler(CommandHandler("leaveroom", timed(leaveroom)))
+    dp.add_handler(CommandHandler("removeword", timed(removeword)))
+    dp.add_handler(CommandHandler("settimer", timed(settimer)))
+    dp.add_handler(CommandHandler("ready", timed(ready)))
+    dp.add_handler(CommandHandler("results", timed(results)))
+    dp.add_handler(CommandHandler("force_start", timed(force_start)))
+    dp.add_handler(CommandHandler("finish_round", timed(finish_round)))
+    dp.add_handler(CommandHandler("subscribe", timed(subscribe)))
+    dp.add_handler(CommandHandler("unsubscribe", timed(unsubscribe)))
+    dp.add_handler(MessageHandler(Filters.text(ready_button), timed(start_turn)))
+    dp.add_handler(MessageHandler(Filters.text(buttons), timed(continue_turn)))
+    dp.add_handler(MessageHandler(Filters.text, timed(echo)))
 
     # log all errors
     dp.add_error_handler(error)
 
+
+def shutdown(args):
+    """ Stops the services started by setup, sending what is queued. """
+    timers.stop()
+    broadcaster.join(timeout=10)
+    broadcaster.stop()
+    maintenance.stop()
+    catalog.stop()
+    if args.cached_hat:
+        hat.close()
+    stop_logging()
+
+
+def build_maintenance_parser():
+    parser = argparse.ArgumentParser(prog='bot.py maintenance',
+                                     description='Archive used words and compact the database while the bot is stopped')
+    parser.add_argument('db_file', help='SQLite database file')
+    parser.add_argument('--retention-days', type=float,
+                        help='Days to keep archived words, forever by default, 0 deletes used words')
+    parser.add_argument('--full-vacuum', action='store_true',
+                        help='Rebuild the file first, needed once to enable incremental vacuum in old databases')
+    return parser
+
+
+def run_maintenance(argv):
+    args = build_maintenance_parser().parse_args(argv)
+    start_game(args.db_file)
+    job = Maintenance(args.db_file, retention_days=args.retention_days, batch_size=10000, vacuum_pages=10000)
+    before = job.sizes()
+    if args.full_vacuum:
+        job.full_vacuum()
+    job.run()
+    job.checkpoint()
+    after = job.sizes()
+    for name in before:
+        print("{}: {} -> {}".format(name, before[name], after[name]))
+
+
+def run_webhook(args, updater):
+    """ Processes updates posted to the webhook until SIGINT or SIGTERM. """
+    ssl_context = None
+    if args.webhook_cert:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(args.webhook_cert, args.webhook_key)
+    # Telegram posts to the root of a URL without a path
+    path = (urlsplit(args.webhook_url).path or '/') if args.webhook_url else '/webhook'
+    server = WebhookServer(updater.bot, updater.dispatcher, host=args.webhook_host, port=args.webhook_port,
+                           path=path, queue_size=args.webhook_queue, workers=args.webhook_workers,
+                           ssl_context=ssl_context, secret_token=args.webhook_secret).start()
+    if args.webhook_url:
+        secret = {'secret_token': args.webhook_secret} if args.webhook_secret else {}
+        updater.bot.set_webhook(args.webhook_url, max_connections=args.webhook_workers, **secret)
+
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopped.set())
+    stopped.wait()
+    server.stop()
+
+
+def build_updater(args, token, base_url=None):
+    """ Returns the Updater of main(), its dispatcher runs the handlers in room mailboxes with --room-workers. """
+    global room_executor
+    telegram_bot = Bot(token, base_url=base_url, request=telegram_request(args))
+    if not args.room_workers:
+        return Updater(bot=telegram_bot, use_context=True)
+    room_executor = RoomExecutor(args.room_workers, args.room_mailbox)
+    dispatcher = RoomDispatcher(telegram_bot, Queue(), room_executor, room_key, use_context=True)
+    return Updater(dispatcher=dispatcher, workers=None, use_context=True)
+
+
+def main():
+    if sys.argv[1:2] == ['maintenance']:
+        run_maintenance(sys.argv[2:])
+        return
+    args = build_parser().parse_args()
+    config = load_config(args.config)
+
+    updater = build_updater(args, config.token)
+    setup(args, updater.bot)
+    catalog.reload_on_sighup()
+
+    # Get the dispatcher to register handlers
+    add_handlers(updater.dispatcher)
+
     # Start the Bot
-    updater.start_polling()
-    updater.idle()
+    if args.webhook_port:
+        run_webhook(args, updater)
+    else:
+        updater.start_polling()
+        updater.idle()
+    if room_executor is not None:
+        room_executor.stop()
+
+    shutdown(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    __slots__ = ("func", "args", "kwargs", "key", "attempts")
+
+    def __init__(self, func, args, kwargs, key):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ("jobs", "bucket", "scheduled")
+
+    def __init__(self, bucket):
+        self.jobs = deque()
+        self.bucket = bucket
+        # The chat is in the ready heap or one of its jobs is being sent
+        self.scheduled = False
+
+
+class Broadcaster:
+    """ Sends outgoing messages from a queue on a pool of worker threads.
+
+    Messages to one chat are sent in order, at most `chat_rate` per second (bursts of `chat_burst`),
+    all chats together at most `global_rate` per second. A queued message with the same `key` as a
+    new one in the same chat is replaced by it. Calls failing with a retry_after (flood control)
+    are retried after the requested delay.
+    """
+
+    def __init__(self, bot, workers=4, global_rate=30, chat_rate=1, chat_burst=3, max_attempts=3,
+                 clock=time.monotonic):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock())
+        self.sent = 0
+        self.coalesced = 0
+        self._chats = {}
+        # Heap of (time the chat may send, sequence number, chat id)
+        self._ready = []
+        self._sequence = itertools.count()
+        self._pending = 0
+        self._lock = threading.Condition()
+        self._stopped = False
+        self._workers = [threading.Thread(target=self._run, name="broadcast-%d" % i, daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def send_message(self, chat_id, text, key=None, **kwargs):
+        self.submit(chat_id, self.bot.send_message, chat_id, text, key=key, **kwargs)
+
+    def edit_message(self, message, text, key=None, **kwargs):
+        self.submit(message.chat_id, message.edit_text, text, key=key, **kwargs)
+
+    def submit(self, chat_id, func, *args, key=None, **kwargs):
+        """ Queues func(*args, **kwargs) to be called within the limits of the chat. """
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst, self.clock()))
+            if key is not None:
+                for job in chat.jobs:
+                    if job.key == key:
+                        job.func, job.args, job.kwargs = func, args, kwargs
+                        self.coalesced += 1
+                        return
+            chat.jobs.append(_Job(func, args, kwargs, key))
+            self._pending += 1
+            if not chat.scheduled:
+                chat.scheduled = True
+                self._schedule(chat_id, self.clock())
+
+    def join(self, timeout=None):
+        """ Waits until every queued message is sent, returns False on timeout. """
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._pending, timeout)
+
+    def queued(self):
+        with self._lock:
+            return self._pending
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def _schedule(self, chat_id, when):
+        heapq.heappush(self._ready, (when, next(self._sequence), chat_id))
+        self._lock.notify()
+
+    def _next_job(self):
+        """ Waits for a chat that may send now and takes its first job. """
+        while True:
+            if self._stopped:
+                return None, None
+            now = self.clock()
+            if not self._ready or self._ready[0][0] > now:
+                self._lock.wait(self._ready[0][0] - now if self._ready else None)
+                continue
+            when, _, chat_id = heapq.heappop(self._ready)
+            chat = self._chats[chat_id]
+            delay = max(chat.bucket.delay(now), self.global_bucket.delay(now))
+            if delay:
+                self._schedule(chat_id, now + delay)
+                continue
+            chat.bucket.take(now)
+            self.global_bucket.take(now)
+            return chat_id, chat.jobs.popleft()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                chat_id, job = self._next_job()
+            if job is None:
+                return
+            sent, retry_after = True, None
+            try:
+                job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                sent = False
+                job.attempts += 1
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after is None or job.attempts >= self.max_attempts:
+                    logger.warning("Message to %s dropped after %d attempts: %s", chat_id, job.attempts, e)
+                    retry_after = None
+            with self._lock:
+                chat = self._chats[chat_id]
+                now = self.clock()
+                if retry_after is not None:
+                    chat.jobs.appendleft(job)
+                    self._schedule(chat_id, now + retry_after)
+                    continue
+                self._pending -= 1
+                self.sent += sent
+                if chat.jobs:
+                    self._schedule(chat_id, now)
+                elif chat.bucket.full(now):
+                    del self._chats[chat_id]
+                else:
+                    chat.scheduled = False
+                self._lock.notify_all()
@@ -1,9 +1,20 @@
+import json
+import logging
+import os
 import random
 import sqlite3
 import threading
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager
 from sqlite3 import Error
 from typing import Iterable
 
+from round import Word
+
+logger = logging.getLogger(__name__)
+
 create_table_players_q = """ CREATE TABLE IF NOT EXISTS players (
                                 id integer PRIMARY KEY,
                                 room text ); """
@@ -12,19 +23,123 @@ create_table_words_q = """ CREATE TABLE IF NOT EXISTS words (
                                 author integer,
                                 room text,
                                 used integer ); """
-add_word_q = """ INSERT INTO words(word, author, room, used) VALUES(?, ?, ?, 0);"""
-get_word_q = """ SELECT word FROM words WHERE room=? AND used=0; """
+# Unused words of a room occupy slots 0..n-1, so a uniformly random word is a single indexed lookup
+add_word_q = """ INSERT INTO words(word, author, room, used, slot)
+                 SELECT ?, ?, ?, 0, IFNULL(MAX(slot), -1) + 1 FROM words WHERE room=? AND used=0;"""
+add_word_to_slot_q = """ INSERT INTO words(word, author, room, used, slot) VALUES(?, ?, ?, 0, ?);"""
+last_slot_q = """ SELECT MAX(slot) FROM words WHERE room=? AND used=0; """
+get_word_in_slot_q = """ SELECT rowid, word FROM words WHERE room=? AND used=0 AND slot=?; """
 mark_word_used_q = """ UPDATE words
-                       SET used=1
-                       WHERE (word=? AND room=?);"""
-
-find_unused_word_q = """ SELECT word FROM words WHERE word=? AND used=0 AND room=?; """
-num_words_in_hat_q = """ SELECT COUNT(word) as num FROM words WHERE used=0 AND room=?; """
+                       SET used=1, slot=NULL, state=?
+                       WHERE rowid=?;"""
+# Takes the next free slot of the room, the word must be drawn
+put_back_word_q = """ UPDATE words
+                      SET used=0, state=0, slot=(SELECT IFNULL(MAX(slot), -1) + 1 FROM words WHERE room=? AND used=0)
+                      WHERE rowid=? AND state=1;"""
+finish_word_q = """ UPDATE words
+                    SET state=?
+                    WHERE rowid=? AND state=1;"""
+move_slot_q = """ UPDATE words
+                  SET slot=?
+                  WHERE room=? AND used=0 AND slot=?;"""
+
+find_unused_word_q = """ SELECT rowid, slot FROM words WHERE word=? AND used=0 AND room=?; """
+get_unused_words_q = """ SELECT word FROM words WHERE room=? AND used=0; """
+# Rooms where the unused words do not occupy slots 0..n-1
+broken_slots_q = """ SELECT room FROM words WHERE used=0
+                     GROUP BY room HAVING COUNT(*) != COUNT(slot) OR COUNT(*) != MAX(slot) + 1;"""
+get_unused_rows_q = """ SELECT rowid FROM words WHERE room=? AND used=0 ORDER BY slot IS NULL, slot, rowid;"""
+clear_slots_q = """ UPDATE words SET slot=NULL WHERE room=? AND used=0;"""
+set_slot_q = """ UPDATE words SET slot=? WHERE rowid=?;"""
 add_player_q = """ INSERT INTO players(id, room) VALUES(?, ?);"""
 find_player_room_q = """ SELECT room FROM players WHERE id=?;"""
 remove_player_room_q = """ DELETE FROM players
                        WHERE (id=?);"""
 room_count_q = """ SELECT COUNT(id) FROM players WHERE room=?;"""
+get_players_q = """ SELECT id, room FROM players;"""
+
+create_table_rooms_q = """ CREATE TABLE IF NOT EXISTS rooms (
+                                room text PRIMARY KEY,
+                                state text ); """
+save_room_q = """ INSERT OR REPLACE INTO rooms(room, state) VALUES(?, ?);"""
+load_room_q = """ SELECT state FROM rooms WHERE room=?;"""
+delete_room_q = """ DELETE FROM rooms WHERE room=?;"""
+
+# Subscribers of a room, or of every room with room='*'
+create_table_subscriptions_q = """ CREATE TABLE IF NOT EXISTS subscriptions (
+                                room text,
+                                user integer,
+                                chat_id integer,
+                                PRIMARY KEY (room, user) ) WITHOUT ROWID; """
+add_subscription_q = """ INSERT OR REPLACE INTO subscriptions(room, user, chat_id) VALUES(?, ?, ?);"""
+remove_subscription_q = """ DELETE FROM subscriptions WHERE room=? AND user=?;"""
+get_subscriptions_q = """ SELECT room, user, chat_id FROM subscriptions;"""
+
+# Used words leave the words table for the archive in batches of rowids
+# Drawn words stay, a round may put them back
+used_words_batch_q = """ SELECT rowid FROM words WHERE used=1 AND state>1 ORDER BY rowid LIMIT ?;"""
+used_room_words_batch_q = """ SELECT rowid FROM words WHERE used=1 AND state>1 AND room=? ORDER BY rowid LIMIT ?;"""
+archive_words_q = """ INSERT INTO words_archive(word, author, room, state, archived_at)
+                      SELECT word, author, room, state, ? FROM words
+                      WHERE used=1 AND state>1 AND rowid BETWEEN ? AND ?;"""
+delete_used_words_q = """ DELETE FROM words WHERE used=1 AND state>1 AND rowid BETWEEN ? AND ?;"""
+archive_room_words_q = """ INSERT INTO words_archive(word, author, room, state, archived_at)
+                           SELECT word, author, room, state, ? FROM words
+                           WHERE used=1 AND state>1 AND room=? AND rowid BETWEEN ? AND ?;"""
+delete_used_room_words_q = """ DELETE FROM words WHERE used=1 AND state>1 AND room=? AND rowid BETWEEN ? AND ?;"""
+purge_archive_q = """ DELETE FROM words_archive
+                      WHERE rowid IN (SELECT rowid FROM words_archive WHERE archived_at<? LIMIT ?);"""
+count_words_q = """ SELECT COUNT(*), IFNULL(SUM(used), 0) FROM words;"""
+count_archive_q = """ SELECT COUNT(*) FROM words_archive;"""
+
+create_table_schema_version_q = """ CREATE TABLE IF NOT EXISTS schema_version (
+                                version integer ); """
+get_schema_version_q = """ SELECT MAX(version) FROM schema_version; """
+set_schema_version_q = """ INSERT INTO schema_version(version) VALUES(?);"""
+
+# Each migration is a list of statements applied in a single transaction.
+# Only append new migrations: applied ones are recorded by their number.
+migrations = [
+    # 1: indexes for the per-room queries, unused words are unique within a room
+    [
+        """ DELETE FROM words
+            WHERE used=0 AND rowid NOT IN (SELECT MIN(rowid) FROM words WHERE used=0 GROUP BY room, word);""",
+        """ CREATE INDEX IF NOT EXISTS words_room_used_word ON words(room, used, word);""",
+        """ CREATE UNIQUE INDEX IF NOT EXISTS words_unused_room_word ON words(room, word) WHERE used=0;""",
+        """ CREATE INDEX IF NOT EXISTS players_room ON players(room);""",
+    ],
+    # 2: dense per-room slots of unused words for O(1) random draws
+    [
+        """ ALTER TABLE words ADD COLUMN slot integer;""",
+        """ UPDATE words
+            SET slot=(SELECT COUNT(*) FROM words AS w WHERE w.room=words.room AND w.used=0 AND w.rowid<words.rowid)
+            WHERE used=0;""",
+        """ CREATE UNIQUE INDEX IF NOT EXISTS words_room_slot ON words(room, slot) WHERE used=0;""",
+    ],
+    # 3: archive of used words, see maintenance.py
+    [
+        """ CREATE TABLE IF NOT EXISTS words_archive (
+                word text,
+                author integer,
+                room text,
+                archived_at integer );""",
+        """ CREATE INDEX IF NOT EXISTS words_archive_archived_at ON words_archive(archived_at);""",
+        """ CREATE INDEX IF NOT EXISTS words_used ON words(used) WHERE used=1;""",
+    ],
+    # 4: lifecycle state of words, the outcome of words used before it is unknown
+    [
+        """ ALTER TABLE words ADD COLUMN state integer NOT NULL DEFAULT 0;""",
+        """ UPDATE words SET state=3 WHERE used=1;""",
+        """ ALTER TABLE words_archive ADD COLUMN state integer;""",
+    ],
+]
+
+# States of words. Drawn words go back to the hat or end up guessed or discarded:
+# failed turns discard them, and so does /removeword for words in the hat
+IN_HAT = 0
+DRAWN = 1
+GUESSED = 2
+DISCARDED = 3
 
 
 def try_execute(cursor: sqlite3.Cursor, sql: str, parameters: Iterable = ...):
@@ -32,10 +147,36 @@ def try_execute(cursor: sqlite3.Cursor, sql: str, parameters: Iterable = ...):
         cursor.execute(sql, parameters)
         return True
     except Error as e:
-        print(e)
+        logger.warning("Query failed: %s", e)
         return False
 
 
+@contextmanager
+def transaction(cursor: sqlite3.Cursor):
+    """ Runs the block in a write transaction on an autocommit cursor. """
+    cursor.execute("BEGIN IMMEDIATE;")
+    try:
+        yield cursor
+    except BaseException:
+        cursor.execute("ROLLBACK;")
+        raise
+    cursor.execute("COMMIT;")
+
+
+def migrate(cursor: sqlite3.Cursor):
+    """ Applies pending migrations, returns the resulting schema version. """
+    cursor.execute(create_table_schema_version_q)
+    for version, statements in enumerate(migrations, start=1):
+        with transaction(cursor):
+            # Re-read under the write lock: another process may have migrated already
+            current = cursor.execute(get_schema_version_q).fetchone()[0] or 0
+            if current < version:
+                for sql in statements:
+                    cursor.execute(sql)
+                cursor.execute(set_schema_version_q, (version,))
+    return len(migrations)
+
+
 def check_word(word: str):
     def check_rus(word):
         for c in word:
@@ -55,15 +196,118 @@ def check_word(word: str):
     return check_rus(word) or check_en(word)
 
 
+# Called with the text of every statement on connections opened after it is set, used by loadtest.py
+trace_callback = None
+# Wraps cursors of connections opened after it is set, used by metrics.py
+cursor_wrapper = None
+# Run on every new connection. WAL lets readers work alongside the writer and needs no fsync per commit,
+# the page cache and the memory map keep the hot part of the database in memory
+pragmas = (
+    # Only takes effect in a new database, maintenance.py converts existing ones
+    "PRAGMA auto_vacuum=INCREMENTAL;",
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA mmap_size=268435456;",
+    "PRAGMA cache_size=-16384;",
+)
+# Connections to one database file, threads beyond it wait for one to be returned
+pool_size = 32
+# Pools by database file, shared by every object using the file while one of them is alive
+_pools = weakref.WeakValueDictionary()
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """ Connections to a database. A thread gets one on its first query and returns it when it exits. """
+
+    def __init__(self, db_file, size=None, timeout=30.0):
+        self.db_file = db_file
+        self.size = size or pool_size
+        self.timeout = timeout
+        self.opened = 0
+        self._idle = []
+        self._local = threading.local()
+        self._lock = threading.Condition()
+
+    def connection(self):
+        """ Returns the connection of the current thread. """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._acquire()
+            self._local.conn = conn
+            # Thread-local values are dropped when the thread exits, the connection goes back to the pool then
+            self._local.lease = lease = _Lease()
+            weakref.finalize(lease, _release, weakref.ref(self), conn)
+        return conn
+
+    def idle(self):
+        with self._lock:
+            return len(self._idle)
+
+    def _acquire(self):
+        with self._lock:
+            if not self._lock.wait_for(lambda: self._idle or self.opened < self.size, self.timeout):
+                raise sqlite3.OperationalError("no free connection to {} in {} s".format(self.db_file, self.timeout))
+            if self._idle:
+                return self._idle.pop()
+            self.opened += 1
+        try:
+            return self._open()
+        except BaseException:
+            with self._lock:
+                self.opened -= 1
+                self._lock.notify()
+            raise
+
+    def _open(self):
+        # isolation_level = None enables autocommit mode
+        # see https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.isolation_level
+        conn = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False, timeout=self.timeout,
+                               cached_statements=256)
+        for pragma in pragmas:
+            conn.execute(pragma)
+        if trace_callback:
+            conn.set_trace_callback(trace_callback)
+        return conn
+
+
+class _Lease:
+    pass
+
+
+def _release(pool_ref, conn):
+    if conn.in_transaction:
+        conn.rollback()
+    pool = pool_ref()
+    if pool is None:
+        conn.close()
+        return
+    with pool._lock:
+        pool._idle.append(conn)
+        pool._lock.notify()
+
+
+def get_pool(db_file):
+    """ Returns the connection pool of the database file. """
+    key = os.path.abspath(db_file)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_file)
+        return pool
+
+
 def get_local_cursor(data, db_file):
+    pool = get_pool(db_file)
+
     def cursor():
-        if 'conn' not in data.__dict__:
-            # isolation_level = None enables autocommit mode
-            # see https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.isolation_level
-            data.conn = sqlite3.connect(db_file, isolation_level=None)
-            data.cursor = data.conn.cursor()
+        if 'cursor' not in data.__dict__:
+            data.cursor = pool.connection().cursor()
+            if cursor_wrapper:
+                data.cursor = cursor_wrapper(data.cursor)
         return data.cursor
 
+    cursor.pool = pool
     return cursor
 
 
@@ -88,28 +332,278 @@ class Hat:
             return False
         if self.cursor().execute(find_unused_word_q, (word, room)).fetchall():
             return False
-        return try_execute(self.cursor(), add_word_q, (word, player_id, room))
+        return try_execute(self.cursor(), add_word_q, (word, player_id, room, room))
+
+    def add_words(self, words, player_id, room):
+        """ Adds the words in one transaction, returns whether each of them was added. """
+        words = [word.lower() for word in words]
+        with transaction(self.cursor()) as cursor:
+            in_hat = {word for word, in cursor.execute(get_unused_words_q, (room,))}
+            size = len(in_hat)
+            # After the last slot rather than the word count, a hole in the slots would make them collide
+            last_slot = cursor.execute(last_slot_q, (room,)).fetchone()[0]
+            slot = 0 if last_slot is None else last_slot + 1
+            rows = []
+            results = []
+            for word in words:
+                added = check_word(word) and len(word) <= self.max_word_length() \
+                    and size < self.max_word_count() and word not in in_hat
+                if added:
+                    in_hat.add(word)
+                    rows.append((word, player_id, room, slot))
+                    size += 1
+                    slot += 1
+                results.append(added)
+            cursor.executemany(add_word_to_slot_q, rows)
+        return results
 
     def get_word(self, room):
-        words = self.cursor().execute(get_word_q, (room,)).fetchall()
-        if not words:
-            return None
-        word = random.choice(words)[0]
-        if try_execute(self.cursor(), mark_word_used_q, (word, room)):
-            return word
-        else:
-            return None
+        """ Draws a uniformly random unused word and marks it used. """
+        with transaction(self.cursor()) as cursor:
+            last_slot = cursor.execute(last_slot_q, (room,)).fetchone()[0]
+            if last_slot is None:
+                return None
+            slot = random.randint(0, last_slot)
+            row = cursor.execute(get_word_in_slot_q, (room, slot)).fetchone()
+            if row is None:
+                logger.warning("Slots of room %s are not dense, renumbering them", room)
+                self._renumber(cursor, room)
+                last_slot = cursor.execute(last_slot_q, (room,)).fetchone()[0]
+                slot = random.randint(0, last_slot)
+                row = cursor.execute(get_word_in_slot_q, (room, slot)).fetchone()
+            row_id, word = row
+            self._take(cursor, room, row_id, slot, DRAWN)
+            return Word(word, row_id)
+
+    def put_back(self, word, player_id, room):
+        """ Returns a drawn word to the hat. """
+        if getattr(word, "id", None) is None:
+            return self.add_word(word, player_id, room)
+        try:
+            self.cursor().execute(put_back_word_q, (room, word.id))
+        except sqlite3.IntegrityError:
+            # The word was added to the hat again meanwhile
+            self.finish(word, DISCARDED)
+        return True
+
+    def finish(self, word, state):
+        """ Records whether a drawn word was guessed or discarded. """
+        if getattr(word, "id", None) is not None:
+            self.cursor().execute(finish_word_q, (state, word.id))
 
     def remove_word(self, word, room):
-        if not self.cursor().execute(find_unused_word_q, (word, room)).fetchall():
+        with transaction(self.cursor()) as cursor:
+            row = cursor.execute(find_unused_word_q, (word, room)).fetchone()
+            if not row:
+                return False
+            self._take(cursor, room, *row, DISCARDED)
+            return True
+
+    @staticmethod
+    def _take(cursor, room, row_id, slot, state):
+        """ Marks the word used and moves the last word of the room into its slot. """
+        cursor.execute(mark_word_used_q, (state, row_id))
+        last_slot = cursor.execute(last_slot_q, (room,)).fetchone()[0]
+        if last_slot is not None and last_slot > slot:
+            cursor.execute(move_slot_q, (slot, room, last_slot))
+
+    @staticmethod
+    def _renumber(cursor, room):
+        """ Gives the unused words of the room slots 0..n-1 again, keeping their order. """
+        rows = cursor.execute(get_unused_rows_q, (room,)).fetchall()
+        cursor.execute(clear_slots_q, (room,))
+        cursor.executemany(set_slot_q, ((slot, row_id) for slot, (row_id,) in enumerate(rows)))
+
+    def repair(self):
+        """ Renumbers slots of the rooms where they are not dense, returns the rooms. """
+        with transaction(self.cursor()) as cursor:
+            rooms = [room for room, in cursor.execute(broken_slots_q).fetchall()]
+            for room in rooms:
+                logger.warning("Slots of room %s are not dense, renumbering them", room)
+                self._renumber(cursor, room)
+        return rooms
+
+    def room_words(self, room):
+        """ Returns the set of unused words in the room. """
+        return {word for word, in self.cursor().execute(get_unused_words_q, (room,))}
+
+    def words_in_hat(self, room):
+        # Unused words occupy slots 0..n-1, the last slot is an index lookup unlike COUNT
+        last_slot = self.cursor().execute(last_slot_q, (room,)).fetchone()[0]
+        return 0 if last_slot is None else last_slot + 1
+
+
+class _RoomWords:
+    """ Unused words of a room: a list to draw by index and a dict of word positions. """
+    __slots__ = ("words", "positions", "last_access")
+
+    def __init__(self, words, now):
+        self.words = list(words)
+        self.positions = {word: i for i, word in enumerate(self.words)}
+        self.last_access = now
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.positions
+
+    def add(self, word):
+        self.positions[word] = len(self.words)
+        self.words.append(word)
+
+    def pop(self, position):
+        """ Removes the word at the position, moving the last word into its place. """
+        word = self.words[position]
+        last = self.words.pop()
+        del self.positions[word]
+        if last != word:
+            self.words[position] = last
+            self.positions[last] = position
+        return word
+
+
+class CachedHat:
+    """ Hat that answers from memory and writes changes to the database in the background.
+
+    Unused words of every active room are kept in memory; a room is loaded from the database
+    on first access and evicted after `room_ttl` seconds without access once its changes are written.
+    """
+
+    def __init__(self, hat: Hat, flush_interval=1.0, room_ttl=3600.0, clock=time.monotonic):
+        self.hat = hat
+        self.flush_interval = flush_interval
+        self.room_ttl = room_ttl
+        self.clock = clock
+        self._rooms = {}
+        # Changes not yet written: ("add", word, player_id, room) or ("remove", word, room)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="hat-flush", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def max_word_count():
+        return Hat.max_word_count()
+
+    @staticmethod
+    def max_word_length():
+        return Hat.max_word_length()
+
+    def add_word(self, word, player_id, room):
+        return self._add(word, player_id, room, self.max_word_count())
+
+    def _add(self, word, player_id, room, limit):
+        word = word.lower()
+        if not check_word(word) or len(word) > self.max_word_length():
             return False
-        return try_execute(self.cursor(), mark_word_used_q, (word, room))
+        with self._lock:
+            words = self._room(room)
+            if (limit is not None and len(words) >= limit) or word in words:
+                return False
+            words.add(word)
+            self._pending.append(("add", word, player_id, room))
+        return True
+
+    def add_words(self, words, player_id, room):
+        return [self.add_word(word, player_id, room) for word in words]
+
+    def get_word(self, room):
+        with self._lock:
+            words = self._room(room)
+            if not words:
+                return None
+            word = words.pop(random.randrange(len(words)))
+            self._pending.append(("remove", word, room))
+        return word
+
+    def put_back(self, word, player_id, room):
+        # Words are written as discarded when drawn, a returned word is added again even to a full hat
+        return self._add(word, player_id, room, None)
+
+    def finish(self, word, state):
+        pass
+
+    def remove_word(self, word, room):
+        with self._lock:
+            words = self._room(room)
+            if word not in words:
+                return False
+            words.pop(words.positions[word])
+            self._pending.append(("remove", word, room))
+        return True
+
+    def room_words(self, room):
+        with self._lock:
+            return set(self._room(room).words)
 
     def words_in_hat(self, room):
-        words_num = self.cursor().execute(num_words_in_hat_q, (room,)).fetchall()
-        if not words_num:
-            return None
-        return words_num[0][0]
+        with self._lock:
+            return len(self._room(room))
+
+    def flush(self):
+        """ Writes pending changes in one transaction and evicts idle rooms.
+
+        If the transaction fails, the changes are written one at a time and those that fail are dropped.
+        Changes are kept for the next flush only while the database is busy.
+        """
+        with self._lock:
+            changes, self._pending = self._pending, []
+        if changes:
+            try:
+                with transaction(self.hat.cursor()) as cursor:
+                    for change in changes:
+                        self._apply(cursor, change)
+            except Error as e:
+                logger.warning("Hat flush of %d changes failed, writing them one at a time: %s", len(changes), e)
+                for i, change in enumerate(changes):
+                    try:
+                        with transaction(self.hat.cursor()) as cursor:
+                            self._apply(cursor, change)
+                    except sqlite3.OperationalError as e:
+                        logger.warning("Hat flush failed, retrying %d changes later: %s", len(changes) - i, e)
+                        with self._lock:
+                            self._pending[:0] = changes[i:]
+                        return
+                    except Error as e:
+                        logger.warning("Hat change %s dropped: %s", change, e)
+        self._evict()
+
+    def _apply(self, cursor, change):
+        if change[0] == "add":
+            cursor.execute(add_word_q, change[1:] + (change[3],))
+        else:
+            row = cursor.execute(find_unused_word_q, change[1:]).fetchone()
+            if row:
+                self.hat._take(cursor, change[2], *row, DISCARDED)
+
+    def close(self):
+        """ Stops the background thread and writes what is left. """
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+
+    def _room(self, room):
+        words = self._rooms.get(room)
+        if words is None:
+            rows = self.hat.cursor().execute(get_unused_words_q, (room,)).fetchall()
+            words = self._rooms[room] = _RoomWords((word for word, in rows), self.clock())
+        else:
+            words.last_access = self.clock()
+        return words
+
+    def _evict(self):
+        deadline = self.clock() - self.room_ttl
+        with self._lock:
+            busy = {change[-1] for change in self._pending}
+            for room in [room for room, words in self._rooms.items() if words.last_access < deadline]:
+                if room not in busy:
+                    del self._rooms[room]
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
 
 
 class HatWrapper:
@@ -126,35 +620,103 @@ class HatWrapper:
     def add_word(self, word, player):
         return self.hat.add_word(word, player, self.room)
 
+    def put_back(self, word, player):
+        return self.hat.put_back(word, player, self.room)
+
+    def guessed(self, word):
+        self.hat.finish(word, GUESSED)
+
+    def discard(self, word):
+        self.hat.finish(word, DISCARDED)
+
 
 class Game:
+    """ Players' rooms. Reads are answered from an in-memory index, writes go through to the database. """
+
     def __init__(self, db_file):
         self.data = threading.local()
         self.cursor = get_local_cursor(self.data, db_file)
         self.cursor().execute(create_table_players_q)
+        self._lock = threading.Lock()
+        self._player_rooms = {}
+        self._room_sizes = Counter()
+        self.load()
+
+    def load(self):
+        """ Rebuilds the index from the database. """
+        with self._lock:
+            self._player_rooms = dict(self.cursor().execute(get_players_q).fetchall())
+            self._room_sizes = Counter(self._player_rooms.values())
 
     def add_player(self, player_id, room):
-        self.cursor().execute(add_player_q, (player_id, room))
+        with self._lock:
+            self.cursor().execute(add_player_q, (player_id, room))
+            self._player_rooms[player_id] = room
+            self._room_sizes[room] += 1
 
     def leave_room(self, player_id):
-        self.cursor().execute(remove_player_room_q, (player_id,))
+        with self._lock:
+            self.cursor().execute(remove_player_room_q, (player_id,))
+            room = self._player_rooms.pop(player_id, None)
+            if room is not None:
+                self._room_sizes[room] -= 1
+                if not self._room_sizes[room]:
+                    del self._room_sizes[room]
 
     def room_for_player(self, player_id):
-        result = self.cursor().execute(find_player_room_q, (player_id,)).fetchall()
-        if result:
-            return result[0][0]
-        else:
-            return None
+        return self._player_rooms.get(player_id)
+
+    def players(self):
+        """ Returns rooms by player id. """
+        with self._lock:
+            return dict(self._player_rooms)
 
     def room_size(self, room):
-        result = self.cursor().execute(room_count_q, (room,)).fetchall()
-        if result:
-            return result[0][0]
-        else:
-            return None
+        return self._room_sizes[room]
+
+
+class RoomStore:
+    """ Game states of rooms as JSON, written on every change so that a restarted bot continues the rounds. """
+
+    def __init__(self, db_file):
+        self.data = threading.local()
+        self.cursor = get_local_cursor(self.data, db_file)
+        self.cursor().execute(create_table_rooms_q)
+
+    def save(self, room, state):
+        self.cursor().execute(save_room_q, (room, json.dumps(state, ensure_ascii=False, separators=(",", ":"))))
+
+    def load(self, room):
+        """ Returns the saved state of the room or None. """
+        row = self.cursor().execute(load_room_q, (room,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, room):
+        self.cursor().execute(delete_room_q, (room,))
+
+
+class SubscriptionStore:
+    """ Subscriptions of users to the events of rooms. """
+
+    def __init__(self, db_file):
+        self.data = threading.local()
+        self.cursor = get_local_cursor(self.data, db_file)
+        self.cursor().execute(create_table_subscriptions_q)
+
+    def add(self, room, user, chat_id):
+        self.cursor().execute(add_subscription_q, (room, user, chat_id))
+
+    def remove(self, room, user):
+        self.cursor().execute(remove_subscription_q, (room, user))
+
+    def load(self):
+        """ Returns (room, user, chat_id) of every subscription. """
+        return self.cursor().execute(get_subscriptions_q).fetchall()
 
 
 def start_game(db_file):
     hat = Hat(db_file)
     game = Game(db_file)
+    migrate(hat.cursor())
+    hat.repair()
     return hat, game
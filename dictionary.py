@@ -0,0 +1,145 @@
+import bisect
+import mmap
+import os
+import random
+import sys
+import threading
+from array import array
+from collections.abc import Sequence
+
+from db import check_word, Hat
+
+# Compiled dictionary: magic, word count, (count + 1) native uint32 offsets, UTF-8 blob of sorted words
+MAGIC = b"HATDICT1"
+HEADER_SIZE = len(MAGIC) + 4
+
+
+class CompactWords(Sequence):
+    """ Sorted words of a compiled dictionary file, memory-mapped on first access.
+
+    Only the requested words are decoded, the list itself never exists as Python objects.
+    If `source` is given, the file is (re)compiled from it when missing or older.
+    """
+
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = source
+        self._map = None
+        self._blob_start = None
+        self._offsets = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._load()) - 1
+
+    def __getitem__(self, i):
+        offsets = self._load()
+        if i < 0:
+            i += len(offsets) - 1
+        if not 0 <= i < len(offsets) - 1:
+            raise IndexError("word index out of range")
+        return self._map[self._blob_start + offsets[i]:self._blob_start + offsets[i + 1]].decode('utf8')
+
+    def _load(self):
+        if self._offsets is None:
+            with self._lock:
+                if self._offsets is None:
+                    if self.source and (not os.path.exists(self.path)
+                                        or os.path.getmtime(self.path) < os.path.getmtime(self.source)):
+                        compile_dictionary(self.source, self.path)
+                    with open(self.path, 'rb') as f:
+                        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    if self._map[:len(MAGIC)] != MAGIC:
+                        raise ValueError("{} is not a compiled dictionary".format(self.path))
+                    count = int.from_bytes(self._map[len(MAGIC):HEADER_SIZE], sys.byteorder)
+                    # Offsets are relative to the blob, which follows them
+                    self._blob_start = HEADER_SIZE + 4 * (count + 1)
+                    self._offsets = memoryview(self._map)[HEADER_SIZE:self._blob_start].cast('I')
+        return self._offsets
+
+
+class Dictionary:
+    """ Sorted valid words of a dictionary, sampled without rejections. """
+
+    def __init__(self, words: Sequence):
+        """ Words must be sorted and unique. """
+        self.words = words
+
+    @classmethod
+    def from_words(cls, words):
+        return cls(valid_words(words))
+
+    def __len__(self):
+        return len(self.words)
+
+    def index(self, word):
+        """ Returns the position of the word or None if it is not in the dictionary. """
+        i = bisect.bisect_left(self.words, word)
+        if i < len(self.words) and self.words[i] == word:
+            return i
+        return None
+
+    def available(self, exclude):
+        """ Number of dictionary words that are not in `exclude`. """
+        return len(self) - len(self._excluded(exclude))
+
+    def sample(self, count, exclude=()):
+        """ Returns `count` distinct random words that are not in `exclude`. """
+        excluded = self._excluded(exclude)
+        available = len(self) - len(excluded)
+        if count > available:
+            raise ValueError("Only {} words are available, {} requested".format(available, count))
+        # Positions among the available words are mapped to dictionary positions: the k-th available
+        # word is preceded by every excluded position e_m with e_m - m <= k
+        shifts = [position - m for m, position in enumerate(excluded)]
+        return [self.words[k + bisect.bisect_right(shifts, k)] for k in random.sample(range(available), count)]
+
+    def _excluded(self, exclude):
+        return sorted({i for i in map(self.index, exclude) if i is not None})
+
+
+def valid_words(words):
+    """ Sorted unique words that can be added to a hat. """
+    return sorted({word for word in words if check_word(word) and len(word) <= Hat.max_word_length()})
+
+
+def compile_dictionary(source, path):
+    """ Compiles a text dictionary, one word per line, into the memory-mappable format. """
+    with open(source, encoding='utf8') as f:
+        words = valid_words(map(str.strip, f))
+    encoded = [word.encode('utf8') for word in words]
+    offsets = array('I', [0])
+    for word in encoded:
+        offsets.append(offsets[-1] + len(word))
+    # Write next to the target and rename, so that a reader never maps a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(encoded).to_bytes(4, sys.byteorder))
+        f.write(offsets.tobytes())
+        f.write(b"".join(encoded))
+    os.replace(tmp_path, path)
+
+
+def dictionary_names(directory):
+    return list(map(str.strip, open(directory + "/list.txt", encoding='utf8').readlines()))
+
+
+def read_dictionaries(directory="dictionaries"):
+    """ Opens the dictionaries listed in list.txt of the directory, they are mapped on first use. """
+    result = {}
+    for dictionary_name in dictionary_names(directory):
+        path = directory + "/" + dictionary_name
+        result[dictionary_name] = Dictionary(CompactWords(path + ".bin", source=path + ".txt"))
+    return result
+
+
+def compile_dictionaries(directory="dictionaries"):
+    for dictionary_name in dictionary_names(directory):
+        path = directory + "/" + dictionary_name
+        compile_dictionary(path + ".txt", path + ".bin")
+
+
+if __name__ == '__main__':
+    # Build step: python dictionary.py [directory]
+    compile_dictionaries(*sys.argv[1:])
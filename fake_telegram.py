@@ -0,0 +1,183 @@
+""" A local stand-in for the Telegram Bot API, used by the load tests.
+
+Serves queued updates to getUpdates (or posts them to a webhook) and records the messages the bot sends.
+"""
+import http.client
+import itertools
+import json
+import queue
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+TOKEN = "123456:fake"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The bot opens many connections at once under load
+    request_queue_size = 1024
+
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.updates = []
+        self.sent = []
+        # Set on the first getUpdates call
+        self.polled = False
+        # Set by setWebhook, updates are then posted to it by `max_connections` threads
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_rejected = 0
+        self._deliveries = queue.Queue()
+        self._delivery_threads = []
+        self.bot_user = {"id": 123456, "is_bot": True, "first_name": "Hat", "username": "hat_play_bot"}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Condition()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+
+    @property
+    def base_url(self):
+        """ base_url for telegram.Bot, the token is appended to it. """
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}/bot".format(host, port)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        for _ in self._delivery_threads:
+            self._deliveries.put(None)
+
+    def message_update(self, user_id, text, first_name=None):
+        """ Builds an update with a private message, commands get their entity. """
+        message = {"message_id": next(self._message_ids),
+                   "date": int(time.time()),
+                   "chat": {"id": user_id, "type": "private"},
+                   "from": {"id": user_id, "is_bot": False, "first_name": first_name or "player" + str(user_id)},
+                   "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def send_update(self, user_id, text, first_name=None):
+        """ Queues a message for getUpdates, returns the update. """
+        update = self.message_update(user_id, text, first_name)
+        with self._lock:
+            update["queued_at"] = time.monotonic()
+            if self.webhook_url:
+                self._deliveries.put(update)
+            else:
+                self.updates.append(update)
+                self._lock.notify_all()
+        return update
+
+    def messages_to(self, chat_id):
+        with self._lock:
+            return [params.get("text") for method, params, at in self.sent
+                    if method == "sendMessage" and str(params.get("chat_id")) == str(chat_id)]
+
+    def wait_sent(self, count, timeout=None):
+        """ Waits until the bot has called the API `count` times, returns False on timeout. """
+        with self._lock:
+            return self._lock.wait_for(lambda: len(self.sent) >= count, timeout)
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        self.polled = True
+        with self._lock:
+            self._lock.wait_for(lambda: any(u["update_id"] >= offset for u in self.updates), timeout)
+            # Confirmed updates are forgotten, like the real API does
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            return [{k: v for k, v in u.items() if k != "queued_at"} for u in self.updates[:100]]
+
+    def _record(self, method, params):
+        with self._lock:
+            self.sent.append((method, params, time.monotonic()))
+            self._lock.notify_all()
+        chat_id = params.get("chat_id")
+        return {"message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if chat_id else 0, "type": "private"},
+                "from": self.bot_user,
+                "text": params.get("text", "")}
+
+    def _call(self, method, params):
+        if method == "getMe":
+            return self.bot_user
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "setWebhook":
+            return self._set_webhook(params)
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        return self._record(method, params)
+
+    def _set_webhook(self, params):
+        with self._lock:
+            self.webhook_url = params.get("url") or None
+            self.webhook_secret = params.get("secret_token")
+            if self.webhook_url and not self._delivery_threads:
+                for i in range(int(params.get("max_connections") or 40)):
+                    thread = threading.Thread(target=self._deliver, name="webhook-{}".format(i), daemon=True)
+                    thread.start()
+                    self._delivery_threads.append(thread)
+        return True
+
+    def _deliver(self):
+        """ Posts updates to the webhook, retrying like Telegram does while the bot answers with an error. """
+        connection = None
+        for update in iter(self._deliveries.get, None):
+            body = json.dumps({k: v for k, v in update.items() if k != "queued_at"}).encode()
+            headers = {"Content-Type": "application/json"}
+            if self.webhook_secret:
+                headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook_secret
+            while True:
+                url = urlsplit(self.webhook_url)
+                try:
+                    if connection is None:
+                        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+                    connection.request("POST", url.path or "/", body, headers)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status == 200:
+                        break
+                    with self._lock:
+                        self.webhook_rejected += 1
+                except (OSError, http.client.HTTPException):
+                    connection = None
+                time.sleep(0.05)
+
+    def _handler_class(self):
+        telegram = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like the real API
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                params = json.loads(body) if body else {}
+                method = self.path.split("?")[0].rsplit("/", 1)[-1]
+                payload = json.dumps({"ok": True, "result": telegram._call(method, params)}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
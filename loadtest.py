@@ -0,0 +1,285 @@
+""" Load-test harness: synthetic games played against the bot.py handlers with fake Telegram objects.
+
+Every room is played on its own thread: players join, add words, set a timer, press /ready and play
+turns. For every action the harness records handler latency, SQLite statements and messages sent,
+and writes a JSON report to compare releases.
+
+Usage: python loadtest.py [--rooms N] [--players N] [--turns N] [--subscribers N] [--watchers N] [--flood N]
+                          [--output report.json] [bot.py options]
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import bot
+import db
+import texts
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeMessage:
+    def __init__(self, harness, chat_id, text="", from_user=None):
+        self.harness = harness
+        self.chat = FakeChat(chat_id)
+        self.chat_id = chat_id
+        self.text = text
+        self.from_user = from_user
+
+    def reply_text(self, text, reply_markup=None, **kwargs):
+        self.harness.count("messages")
+        return self.harness.bot.send_message(self.chat_id, text, reply_markup=reply_markup)
+
+    def edit_text(self, text, **kwargs):
+        self.harness.bot.edits += 1
+        self.text = text
+        return self
+
+
+class FakeUpdate:
+    def __init__(self, message):
+        self.message = message
+        self.effective_user = message.from_user
+
+
+class FakeContext:
+    def __init__(self, harness, user_id):
+        self.bot = harness.bot
+        self.bot_data = harness.bot_data
+        self.user_data = harness.user_data[user_id]
+        self.error = None
+
+
+class FakeBot:
+    """ Counts messages that reach the Bot API. """
+
+    def __init__(self, harness):
+        self.harness = harness
+        self.sent = 0
+        self.edits = 0
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self._lock:
+            self.sent += 1
+        return FakeMessage(self.harness, chat_id, text)
+
+
+class CountingBroadcaster:
+    """ Counts queued messages for the current action, then hands them to the real broadcaster. """
+
+    def __init__(self, harness, broadcaster):
+        self.harness = harness
+        self.broadcaster = broadcaster
+
+    def send_message(self, chat_id, text, key=None, **kwargs):
+        self.harness.count("messages")
+        self.broadcaster.send_message(chat_id, text, key=key, **kwargs)
+
+    def edit_message(self, message, text, key=None, **kwargs):
+        self.harness.count("messages")
+        self.broadcaster.edit_message(message, text, key=key, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.broadcaster, name)
+
+
+class Harness:
+    """ Runs the bot.py handlers in process and measures every call. """
+
+    def __init__(self):
+        self.bot = FakeBot(self)
+        self.bot_data = {}
+        self.user_data = defaultdict(dict)
+        self.latencies = defaultdict(list)
+        self.totals = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self._current = threading.local()
+        self._lock = threading.Lock()
+
+    def count(self, what, amount=1):
+        """ Adds to a counter of the action running on this thread, if any. """
+        action = getattr(self._current, "action", None)
+        if action:
+            with self._lock:
+                self.totals[action][what] += amount
+
+    def trace(self, statement):
+        self.count("statements")
+
+    def call(self, action, handler, user_id, text):
+        """ Calls the handler with a message from the user, as the dispatcher would. """
+        handler = bot.admitted(handler)
+        user = {'id': user_id, 'first_name': "player" + str(user_id)}
+        message = FakeMessage(self, user_id, text, user)
+        self._current.action = action
+        start = time.perf_counter()
+        try:
+            handler(FakeUpdate(message), FakeContext(self, user_id))
+        except Exception:
+            with self._lock:
+                self.errors[action] += 1
+        finally:
+            elapsed = time.perf_counter() - start
+            self._current.action = None
+        with self._lock:
+            self.latencies[action].append(elapsed)
+            self.totals[action]["calls"] += 1
+
+    def report(self):
+        actions = {}
+        for action, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            calls = len(latencies)
+            totals = self.totals[action]
+            actions[action] = {
+                "calls": calls,
+                "errors": self.errors[action],
+                "p50_ms": statistics.median(latencies) * 1e3,
+                "p99_ms": latencies[min(calls - 1, int(calls * 0.99))] * 1e3,
+                "statements_per_call": totals["statements"] / calls,
+                "messages_per_call": totals["messages"] / calls,
+            }
+        return actions
+
+
+# User ids of subscribers, far above those of players
+SUBSCRIBER_IDS = 10 ** 9
+WATCHER_IDS = 2 * 10 ** 9
+FLOODER_ID = 3 * 10 ** 9
+FLOOD_ROOM = "флуд"
+
+
+def letters(number):
+    """ A word made of the digits of the number in base 32. """
+    word = "флуд"
+    while True:
+        number, digit = divmod(number, 32)
+        word += chr(ord("а") + digit)
+        if not number:
+            return word
+
+
+def room_name(room):
+    return "нагрузка" + "а" * (room % 30) + "б" * (room // 30)
+
+
+def play_room(harness, room, players, turns, timer):
+    name = room_name(room)
+    users = [room * 1000 + player + 1 for player in range(players)]
+    for user in users:
+        harness.call("join", bot.echo, user, name)
+    for user in users:
+        harness.call("add_words", bot.echo, user, " ".join("слово" + "а" * i + "б" * (user % 50) for i in range(10)))
+    harness.call("add_dictionary", bot.echo, users[0], "easy 20")
+    if timer:
+        harness.call("settimer", bot.settimer, users[0], "/settimer")
+        harness.call("settimer", bot.echo, users[0], str(timer))
+    for user in users:
+        harness.call("ready", bot.ready, user, "/ready")
+    state = bot.registry.get(name)
+    for _ in range(turns):
+        lead = state.round.lead
+        harness.call("start_turn", bot.start_turn, lead, texts.next_word_button)
+        for _ in range(3):
+            harness.call("continue_turn", bot.continue_turn, lead, texts.guessed_button)
+        harness.call("continue_turn", bot.continue_turn, lead, texts.end_of_turn_button)
+    harness.call("results", bot.results, users[0], "/results")
+    harness.call("finish_round", bot.finish_round, users[0], "/finish_round")
+
+
+def flood_room(harness, rate, stopped):
+    """ A player pasting a list of new words `rate` times per second until `stopped` is set. """
+    harness.call("join", bot.echo, FLOODER_ID, FLOOD_ROOM)
+    for message in itertools.count():
+        if stopped.wait(1 / rate):
+            break
+        harness.call("flood", bot.echo, FLOODER_ID, " ".join(letters(message * 100 + i) for i in range(100)))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Load test of the bot handlers')
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--players', type=int, default=5)
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--timer', type=int, default=60, help='Turn timer in seconds, 0 to play without it')
+    parser.add_argument('--subscribers', type=int, default=0, help='Users subscribed to the first room')
+    parser.add_argument('--watchers', type=int, default=0, help='Users subscribed to every room')
+    parser.add_argument('--flood', type=float, default=0,
+                        help='Messages of 100 words per second sent by a player of another room during the games')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    return parser
+
+
+def run(options, bot_options=(), db_file=None):
+    """ Plays the rooms against a fresh database, or `db_file` which is kept, returns the report. """
+    keep = db_file is not None
+    if not keep:
+        fd, db_file = tempfile.mkstemp()
+        os.close(fd)
+    harness = Harness()
+    db.trace_callback = harness.trace
+    try:
+        args = bot.build_parser().parse_args([db_file, os.devnull, "staging"] + list(bot_options))
+        bot.setup(args, harness.bot)
+        bot.broadcaster = CountingBroadcaster(harness, bot.broadcaster)
+        for room in range(options.rooms):
+            bot.catalog.add(room_name(room))
+        bot.catalog.add(FLOOD_ROOM, "experimental")
+        for user in range(options.subscribers):
+            harness.call("subscribe", bot.subscribe, SUBSCRIBER_IDS + user, "/subscribe " + room_name(0))
+        for user in range(options.watchers):
+            harness.call("subscribe", bot.subscribe, WATCHER_IDS + user, "/subscribe")
+        start = time.perf_counter()
+        threads = [threading.Thread(target=play_room, args=(harness, room, options.players, options.turns,
+                                                            options.timer))
+                   for room in range(options.rooms)]
+        stopped = threading.Event()
+        flood = threading.Thread(target=flood_room, args=(harness, options.flood, stopped))
+        if options.flood:
+            flood.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stopped.set()
+        if options.flood:
+            flood.join()
+        bot.shutdown(args)
+    finally:
+        db.trace_callback = None
+        if not keep:
+            os.remove(db_file)
+    return {"rooms": options.rooms,
+            "players": options.players,
+            "turns": options.turns,
+            "bot_options": list(bot_options),
+            "seconds": elapsed,
+            "messages_sent": harness.bot.sent,
+            "throttled": bot.admission.throttled if bot.admission else 0,
+            "actions": harness.report()}
+
+
+def main():
+    options, bot_options = build_parser().parse_known_args()
+    report = run(options, bot_options)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if options.output:
+        with open(options.output, "w", encoding='utf8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
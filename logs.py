@@ -0,0 +1,124 @@
+""" Logging of the bot: handler threads put records on a queue, a listener thread writes them as JSON lines. """
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+# Fields passed in `extra` that are written to the JSON record
+FIELDS = ("action", "room", "user", "duration_ms")
+
+# Actions logged on every message of a game, only a sample of them is written with --log-sample
+SAMPLED_ACTIONS = ("echo", "continue_turn")
+
+_listener = None
+_handler = None
+
+
+def fields(action, user=None, room=None):
+    """ Returns `extra` for a log call of a handler. """
+    return {"action": action, "user": user, "room": room}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """ Passes one of every `every` info records of the sampled actions, and all other records. """
+
+    def __init__(self, every, actions=SAMPLED_ACTIONS):
+        super().__init__()
+        self.every = every
+        self._counters = {action: itertools.count() for action in actions}
+
+    def filter(self, record):
+        counter = self._counters.get(getattr(record, "action", None))
+        if counter is None or record.levelno > logging.INFO:
+            return True
+        return next(counter) % self.every == 0
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The listener formats the record, here only the message is rendered so that args are not shared
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(filename, level=logging.INFO, max_bytes=10 * 2 ** 20, backups=5, sample_every=1):
+    """ Sends records of all loggers to `filename` through a queue, replacing an earlier setup. """
+    global _listener, _handler
+    stop_logging()
+
+    file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backups,
+                                                        encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    _handler = _QueueHandler(records)
+    if sample_every > 1:
+        _handler.addFilter(SamplingFilter(sample_every))
+    _listener = logging.handlers.QueueListener(records, file_handler)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level)
+
+
+def stop_logging():
+    """ Writes queued records and closes the file. """
+    global _listener, _handler
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = _handler = None
+
+
+def timed_handler(callback, room_for_player=lambda user: None):
+    """ Wraps a handler callback to log its duration at DEBUG level. The handlers log their actions at INFO,
+    so below DEBUG nothing is added on the hot path, not even the room lookup. """
+    action = callback.__name__
+    logger = logging.getLogger(callback.__module__)
+
+    @wraps(callback)
+    def timed(update, context):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return callback(update, context)
+        start = time.perf_counter()
+        try:
+            return callback(update, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            user = update.effective_user.id if update.effective_user else None
+            logger.debug("%s handled", action, extra={"action": action, "user": user,
+                                                      "room": room_for_player(user),
+                                                      "duration_ms": round(duration, 3)})
+
+    return timed
@@ -0,0 +1,142 @@
+""" Archival of used words and compaction of the database.
+
+Used words are moved from `words` to `words_archive` in small transactions, archived words older than the
+retention period are deleted, and the freed pages are returned to the file system by incremental vacuum.
+Online, a background thread does one small slice of each step per interval so handlers wait for the write lock
+for a few milliseconds at most. `python bot.py maintenance db_file` runs everything at once.
+"""
+import logging
+import os
+import threading
+import time
+
+from db import (get_pool, transaction, used_words_batch_q, used_room_words_batch_q, archive_words_q,
+                delete_used_words_q, archive_room_words_q, delete_used_room_words_q, purge_archive_q, count_words_q,
+                count_archive_q)
+
+logger = logging.getLogger(__name__)
+
+
+class Maintenance:
+    """ `retention_days` is how long archived words are kept, None keeps them forever and 0 drops them at once. """
+
+    def __init__(self, db_file, retention_days=None, batch_size=500, vacuum_pages=100, clock=time.time):
+        self.db_file = db_file
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.clock = clock
+        self._pool = get_pool(db_file)
+        # Rooms with a finished round, their used words are archived first
+        self._finished = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def cursor(self):
+        return self._pool.connection().cursor()
+
+    def finished(self, room):
+        """ Schedules archival of the used words of the room. """
+        with self._lock:
+            self._finished.add(room)
+
+    def archive(self, room=None):
+        """ Archives one batch of used words of the room or of any room, returns the number of words. """
+        cursor = self.cursor()
+        with transaction(cursor):
+            if room is None:
+                rows = cursor.execute(used_words_batch_q, (self.batch_size,)).fetchall()
+                rooms = ()
+                archive_q, delete_q = archive_words_q, delete_used_words_q
+            else:
+                rows = cursor.execute(used_room_words_batch_q, (room, self.batch_size)).fetchall()
+                rooms = (room,)
+                archive_q, delete_q = archive_room_words_q, delete_used_room_words_q
+            if not rows:
+                return 0
+            rowids = rooms + (rows[0][0], rows[-1][0])
+            if self.retention_days != 0:
+                cursor.execute(archive_q, (int(self.clock()),) + rowids)
+            return cursor.execute(delete_q, rowids).rowcount
+
+    def purge(self):
+        """ Deletes one batch of archived words older than the retention period, returns the number of words. """
+        if self.retention_days is None:
+            return 0
+        before = int(self.clock() - self.retention_days * 86400)
+        cursor = self.cursor()
+        with transaction(cursor):
+            return cursor.execute(purge_archive_q, (before, self.batch_size)).rowcount
+
+    def vacuum(self, pages=None):
+        """ Frees up to `pages` unused pages, returns the number of pages left to free. """
+        cursor = self.cursor()
+        if not self.incremental():
+            return 0
+        cursor.execute("PRAGMA incremental_vacuum({});".format(int(pages or self.vacuum_pages))).fetchall()
+        return cursor.execute("PRAGMA freelist_count;").fetchone()[0]
+
+    def incremental(self):
+        return self.cursor().execute("PRAGMA auto_vacuum;").fetchone()[0] == 2
+
+    def full_vacuum(self):
+        """ Rebuilds the file, enabling incremental vacuum. Blocks every writer, meant for offline use. """
+        cursor = self.cursor()
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        cursor.execute("VACUUM;")
+
+    def checkpoint(self):
+        """ Copies the write-ahead log into the database file and truncates it. """
+        self.cursor().execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchall()
+
+    def step(self):
+        """ Does one slice of each step, returns True if more work is left. """
+        with self._lock:
+            room = self._finished.pop() if self._finished else None
+        more = False
+        if room is not None:
+            if self.archive(room) == self.batch_size:
+                self.finished(room)
+            more = True
+        more |= self.archive() == self.batch_size
+        more |= self.purge() == self.batch_size
+        more |= self.vacuum() > 0
+        return more
+
+    def run(self):
+        """ Does everything at once. """
+        while self.step():
+            pass
+
+    def sizes(self):
+        cursor = self.cursor()
+        words, used = cursor.execute(count_words_q).fetchone()
+        page_size = cursor.execute("PRAGMA page_size;").fetchone()[0]
+        return {
+            "words": words,
+            "used_words": used,
+            "archived_words": cursor.execute(count_archive_q).fetchone()[0],
+            "pages": cursor.execute("PRAGMA page_count;").fetchone()[0],
+            "free_pages": cursor.execute("PRAGMA freelist_count;").fetchone()[0],
+            "bytes": os.path.getsize(self.db_file) if os.path.exists(self.db_file) else 0,
+            "page_size": page_size,
+        }
+
+    def start_thread(self, interval):
+        """ Runs a step every `interval` seconds, and right away while work is left. """
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                while self.step() and not self._stopped.wait(0.01):
+                    pass
+            except Exception:
+                logger.exception("Maintenance step failed")
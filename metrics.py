@@ -0,0 +1,243 @@
+""" Prometheus metrics of the bot, served over HTTP in the text exposition format.
+
+Nothing is measured until enable() is called: handlers and database cursors are only wrapped then,
+so a disabled bot runs the same code as before.
+"""
+import bisect
+import threading
+import time
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import db
+
+enabled = False
+
+# Seconds, from a fast in-memory lookup to a slow network call
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labelnames, labels):
+    if not labelnames:
+        return ""
+    pairs = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(labelnames, labels))
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def expose(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} counter".format(self.name)]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append("{}{} {}".format(self.name, _format_labels(self.labelnames, labels), value))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Labels -> [count per bucket..., count above the last bucket, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def count(self, labels=()):
+        counts = self._values.get(labels)
+        return sum(counts[:-1]) if counts else 0
+
+    def expose(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        labelnames = self.labelnames + ("le",)
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                lines.append("{}_bucket{} {}".format(self.name, _format_labels(labelnames, labels + (bound,)), total))
+            lines.append("{}_sum{} {}".format(self.name, _format_labels(self.labelnames, labels), counts[-1]))
+            lines.append("{}_count{} {}".format(self.name, _format_labels(self.labelnames, labels), total))
+        return lines
+
+
+class CallbackMetric:
+    """ A counter or gauge read from the program when scraped, it costs nothing in between. """
+
+    def __init__(self, name, help, type, callback, labelnames=()):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.callback = callback
+        self.labelnames = labelnames
+
+    def expose(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type)]
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            lines.append("{}{} {}".format(self.name, _format_labels(self.labelnames, labels), value))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def add(self, metric):
+        """ Adds the metric, a metric with the same name is replaced. """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+handler_seconds = registry.add(Histogram("hatbot_handler_seconds", "Time spent in update handlers", ("handler",)))
+handler_errors = registry.add(Counter("hatbot_handler_errors_total", "Handlers that raised", ("handler",)))
+sql_seconds = registry.add(Histogram("hatbot_sql_seconds", "Time spent executing SQL statements", ("query",)))
+messages_sent = registry.add(Counter("hatbot_messages_sent_total",
+                                     "Messages and edits sent to Telegram, handler replies included"))
+
+
+def timed_handler(callback):
+    """ Wraps a handler callback to record its latency. """
+    labels = (callback.__name__,)
+
+    @wraps(callback)
+    def timed(update, context):
+        start = time.perf_counter()
+        try:
+            return callback(update, context)
+        except Exception:
+            handler_errors.inc(labels)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, labels)
+
+    return timed
+
+
+def count_messages(bot):
+    """ Counts the messages and edits sent through the bot: broadcasts, and the replies of the handlers,
+    whose messages are bound to the same bot. """
+    for name in ("send_message", "edit_message_text"):
+        method = getattr(bot, name, None)
+        if method is not None:
+            setattr(bot, name, _counted(method))
+
+
+def _counted(method):
+    @wraps(method)
+    def counted(*args, **kwargs):
+        result = method(*args, **kwargs)
+        messages_sent.inc()
+        return result
+
+    return counted
+
+
+def _query_names():
+    """ SQL text -> query name from the *_q constants of db.py. """
+    return {sql: name[:-2] for name, sql in vars(db).items() if name.endswith("_q") and isinstance(sql, str)}
+
+
+class InstrumentedCursor:
+    """ Cursor that records the latency of every statement under the name of its query. """
+    query_names = {}
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, parameters)
+        finally:
+            sql_seconds.observe(time.perf_counter() - start, (self._name(sql),))
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, seq_of_parameters)
+        finally:
+            sql_seconds.observe(time.perf_counter() - start, (self._name(sql),))
+
+    def _name(self, sql):
+        name = self.query_names.get(sql)
+        if name is None:
+            # BEGIN, COMMIT and other statements written inline
+            name = sql.split(None, 1)[0].lower() if sql.strip() else "empty"
+        return name
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+def enable():
+    """ Starts measuring: database connections opened from now on are instrumented. """
+    global enabled
+    enabled = True
+    InstrumentedCursor.query_names = _query_names()
+    db.cursor_wrapper = InstrumentedCursor
+
+
+def serve(port, host="127.0.0.1"):
+    """ Serves /metrics on a background thread, returns the server. """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.expose().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,28 @@
+class TokenBucket:
+    """ Allows `rate` events per second on average and bursts of up to `capacity` events. """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def delay(self, now):
+        """ Seconds until a token is available, 0 if there is one now. """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """ Takes a token if there is one, returns whether it did. """
+        if self.delay(now):
+            return False
+        self.tokens -= 1
+        return True
+
+    def full(self, now):
+        self.delay(now)
+        return self.tokens >= self.capacity
@@ -0,0 +1,121 @@
+""" Rooms players can join, read from the room files and reloaded when they change. """
+import logging
+import os
+import signal
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Room files by kind, later files win for a room listed twice
+ROOM_FILES = (
+    ("experimental", "experimental_rooms.txt"),
+    ("personal", "personal_rooms.txt"),
+    ("public", "rooms.txt"),
+)
+
+
+class RoomInfo(namedtuple("RoomInfo", ["name", "kind"])):
+    __slots__ = ()
+
+    @property
+    def experimental(self):
+        return self.kind == "experimental"
+
+
+class RoomCatalog:
+    """ Room names -> RoomInfo. Lookups read an immutable dict that reloads replace as a whole,
+    so they never wait for a reload. """
+
+    def __init__(self, files=ROOM_FILES, directory="."):
+        self.files = [(kind, os.path.join(directory, name)) for kind, name in files]
+        self._rooms = {}
+        # Rooms added at runtime, kept over reloads
+        self._added = {}
+        self._mtimes = None
+        self._lock = threading.Lock()
+        self._reload = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def get(self, name):
+        """ Returns the RoomInfo of the room or None. """
+        return self._rooms.get(name)
+
+    def __contains__(self, name):
+        return name in self._rooms
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def names(self, kind):
+        return frozenset(name for name, info in self._rooms.items() if info.kind == kind)
+
+    def add(self, name, kind="personal"):
+        with self._lock:
+            self._added[name] = RoomInfo(name, kind)
+            self._rooms = {**self._rooms, name: self._added[name]}
+
+    def load(self):
+        """ Reads the room files, a missing file has no rooms. """
+        with self._lock:
+            mtimes = self._file_mtimes()
+            rooms = {}
+            for kind, path in self.files:
+                try:
+                    with open(path, encoding='utf8') as f:
+                        names = {line.strip() for line in f}
+                except FileNotFoundError:
+                    continue
+                rooms.update((name, RoomInfo(name, kind)) for name in names if name)
+            rooms.update(self._added)
+            self._rooms = rooms
+            self._mtimes = mtimes
+        logger.info("Loaded %d rooms", len(rooms))
+
+    def reload_if_changed(self):
+        """ Loads the files again if one of them changed, returns whether it did. """
+        if self._file_mtimes() == self._mtimes:
+            return False
+        self.load()
+        return True
+
+    def reload_on_sighup(self):
+        """ Makes the watcher thread reload the files on SIGHUP, call it from the main thread. """
+        signal.signal(signal.SIGHUP, lambda signum, frame: self._reload.set())
+
+    def start_thread(self, interval=5.0):
+        """ Checks the files every `interval` seconds. """
+        self._stopped.clear()
+        self._reload.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="room-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._reload.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self, interval):
+        while not self._stopped.is_set():
+            forced = self._reload.wait(interval)
+            self._reload.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                if forced:
+                    self.load()
+                else:
+                    self.reload_if_changed()
+            except OSError:
+                logger.exception("Reading room files failed")
+
+    def _file_mtimes(self):
+        mtimes = []
+        for kind, path in self.files:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return mtimes
@@ -0,0 +1,111 @@
+""" Per-room serialized processing of updates on a shared pool of worker threads.
+
+Every room has a mailbox: its updates are processed one at a time, in the order they arrived, while the
+updates of different rooms run in parallel. A mailbox holds at most `mailbox_size` updates; updates for a
+full mailbox are dropped, so a flooding room can't take the workers or the memory from the other rooms.
+"""
+import logging
+import threading
+from collections import deque
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class RoomExecutor:
+    """ Runs the tasks of one key in order and the tasks of different keys in parallel on `workers` threads. """
+
+    def __init__(self, workers=8, mailbox_size=100):
+        self.mailbox_size = mailbox_size
+        self.dropped = 0
+        # Pending tasks by key, a key is removed when its mailbox is empty and none of its tasks runs
+        self._mailboxes = {}
+        # Keys with tasks and no task running
+        self._ready = deque()
+        self._pending = 0
+        self._lock = threading.Condition()
+        self._stopped = False
+        self._workers = [threading.Thread(target=self._run, name="room-%d" % i, daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, key, func, *args):
+        """ Queues func(*args) in the mailbox of the key, returns False if the mailbox is full. """
+        with self._lock:
+            mailbox = self._mailboxes.get(key)
+            if mailbox is None:
+                mailbox = self._mailboxes[key] = deque()
+                self._ready.append(key)
+                self._lock.notify()
+            elif len(mailbox) >= self.mailbox_size:
+                self.dropped += 1
+                return False
+            mailbox.append((func, args))
+            self._pending += 1
+        return True
+
+    def queued(self):
+        """ Tasks waiting in all mailboxes. """
+        with self._lock:
+            return self._pending
+
+    def deepest(self):
+        """ Tasks waiting in the fullest mailbox. """
+        with self._lock:
+            return max(map(len, self._mailboxes.values()), default=0)
+
+    def join(self, timeout=None):
+        """ Waits until every queued task is done, returns False on timeout. """
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._mailboxes, timeout)
+
+    def stop(self):
+        """ Runs the queued tasks and stops the workers. """
+        self.join()
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._ready or self._stopped)
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                func, args = self._mailboxes[key].popleft()
+                self._pending -= 1
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Task of %s failed", key)
+            with self._lock:
+                if self._mailboxes[key]:
+                    self._ready.append(key)
+                    self._lock.notify()
+                else:
+                    del self._mailboxes[key]
+                    self._lock.notify_all()
+
+
+class RoomDispatcher(Dispatcher):
+    """ Dispatcher handing each update to the mailbox `key(update)` of a RoomExecutor instead of processing it
+    on the calling thread. Errors raised while polling are still processed right away. """
+
+    def __init__(self, bot, update_queue, executor, key, **kwargs):
+        super().__init__(bot, update_queue, **kwargs)
+        self.executor = executor
+        self.key = key
+
+    def process_update(self, update):
+        if not isinstance(update, Update):
+            super().process_update(update)
+            return
+        key = self.key(update)
+        if not self.executor.submit(key, super().process_update, update):
+            logger.warning("Mailbox of %s is full, update %s dropped", key, update.update_id)
@@ -0,0 +1,163 @@
+import threading
+
+from round import Round
+
+
+class RoomState:
+    """ Game state of a room. Hold `lock` while reading or changing it. """
+    __slots__ = ("name", "round", "ready", "timer", "lock")
+
+    def __init__(self, name):
+        self.name = name
+        self.round = None
+        # Players who pressed /ready, they take part in the next round
+        self.ready = set()
+        # Timer duration in seconds for new rounds, None if disabled
+        self.timer = None
+        self.lock = threading.RLock()
+
+
+# Room name of subscriptions to every room
+ALL_ROOMS = "*"
+
+
+class Subscriptions:
+    """ Users following the events of rooms, by room name or ALL_ROOMS.
+
+    Changes replace the frozenset of a room, so broadcasts read the sets without a lock.
+    With a `store` (db.SubscriptionStore) subscriptions are written through and survive restarts.
+    """
+
+    def __init__(self, store=None):
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._store = store
+
+    def load(self):
+        """ Reads the saved subscriptions, returns (user, chat_id) of the subscribers. """
+        if self._store is None:
+            return []
+        rows = self._store.load()
+        with self._lock:
+            rooms = {}
+            for room, user, chat_id in rows:
+                rooms.setdefault(room, set()).add(user)
+            self._rooms = {room: frozenset(users) for room, users in rooms.items()}
+        return [(user, chat_id) for room, user, chat_id in rows]
+
+    def add(self, user, chat_id, room=ALL_ROOMS):
+        """ Subscribes the user to the room, returns False if they already were. """
+        with self._lock:
+            users = self._rooms.get(room, frozenset())
+            if user in users:
+                return False
+            if self._store is not None:
+                self._store.add(room, user, chat_id)
+            self._rooms[room] = users | {user}
+        return True
+
+    def remove(self, user, room=None):
+        """ Unsubscribes the user from the room or, without a room, from everything.
+        Returns the rooms they left. """
+        with self._lock:
+            rooms = [room] if room is not None else list(self._rooms)
+            left = [room for room in rooms if user in self._rooms.get(room, ())]
+            for room in left:
+                if self._store is not None:
+                    self._store.remove(room, user)
+                users = self._rooms[room] - {user}
+                if users:
+                    self._rooms[room] = users
+                else:
+                    del self._rooms[room]
+        return left
+
+    def of_room(self, room):
+        """ Users to notify about the room: its subscribers and those of every room, each once. """
+        users = self._rooms.get(room, frozenset())
+        everywhere = self._rooms.get(ALL_ROOMS)
+        return users | everywhere if everywhere else users
+
+    def __len__(self):
+        return sum(len(users) for users in self._rooms.values())
+
+
+class RoomRegistry:
+    """ Room states by room name, and chat ids and names of players and subscribers.
+
+    With a `store` (db.RoomStore) the state of a room is saved by save() and read back on first access,
+    rounds are restored with the word collection returned by `words(room)`. Subscribers are kept in
+    `subscriptions` (db.SubscriptionStore) if given.
+    """
+
+    def __init__(self, store=None, words=None, subscriptions=None):
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._store = store
+        self._words = words
+        self.chat_ids = {}
+        self.usernames = {}
+        self.subscribers = Subscriptions(subscriptions)
+        for user, chat_id in self.subscribers.load():
+            self.chat_ids.setdefault(user, chat_id)
+
+    def get(self, room):
+        """ Returns the state of the room, creating it on first access. """
+        state = self._rooms.get(room)
+        if state is None:
+            with self._lock:
+                state = self._rooms.get(room)
+                if state is None:
+                    state = self._rooms[room] = self._restore(room)
+        return state
+
+    def save(self, state):
+        """ Saves the state of the room, call it with `state.lock` held after changing it. """
+        if self._store is None:
+            return
+        players = set(state.ready)
+        if state.round:
+            players.update(state.round.players)
+        self._store.save(state.name, {
+            "ready": list(state.ready),
+            "timer": state.timer,
+            "round": state.round.dump() if state.round else None,
+            "chat_ids": [[user, self.chat_ids[user]] for user in players if user in self.chat_ids],
+            "usernames": [[user, self.usernames[user]] for user in players if user in self.usernames],
+        })
+
+    def delete(self, state):
+        """ Resets the room and deletes its saved state, call it with `state.lock` held. """
+        if state.round:
+            state.round.finish()
+        state.round = None
+        state.ready.clear()
+        state.timer = None
+        if self._store is not None:
+            self._store.delete(state.name)
+
+    def _restore(self, room):
+        state = RoomState(room)
+        data = self._store.load(room) if self._store is not None else None
+        if data:
+            state.ready = set(data["ready"])
+            state.timer = data["timer"]
+            if data["round"]:
+                state.round = Round.load(self._words(room), data["round"])
+            for user, chat_id in data["chat_ids"]:
+                self.chat_ids.setdefault(user, chat_id)
+            for user, username in data["usernames"]:
+                self.usernames.setdefault(user, username)
+        return state
+
+    def __contains__(self, room):
+        return room in self._rooms
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def active_rooms(self):
+        """ Number of rooms playing a round. """
+        with self._lock:
+            states = list(self._rooms.values())
+        return sum(1 for state in states if state.round is not None)
@@ -2,6 +2,15 @@ from collections import Counter
 import texts
 
 
+class Word(str):
+    """ A word drawn from the hat, `id` identifies it in the hat. """
+
+    def __new__(cls, word, id=None):
+        self = super().__new__(cls, word)
+        self.id = id
+        return self
+
+
 class Move:
     """ Implements standard Hat algorithm. """
 
@@ -27,7 +36,7 @@ class Move:
 
 class Round:
     def __init__(self, word_collection, players):
-        """ Word collection must implement get_word and add_word. """
+        """ Word collection must implement get_word, put_back, guessed and discard. """
         self.word_collection = word_collection
         self.players = players
         self.points = Counter()
@@ -53,13 +62,18 @@ class Round:
             self.explained_points[player] += 1
             self.points[self.target] += 1
             self.guessed_points[self.target] += 1
+            if getattr(self, "word", None):
+                self.word_collection.guessed(self.word)
             return self.__next_word(player)
         else:
             return texts.not_your_turn_message
 
     def failed(self, player):
-        """ Passes the turn to the next player. """
+        """ Passes the turn to the next player, the word is discarded. """
         if player == self.lead:
+            if getattr(self, "word", None):
+                self.word_collection.discard(self.word)
+                self.word = None
             return self.__next_move()
         else:
             return texts.not_your_turn_message
@@ -68,11 +82,50 @@ class Round:
         """ Puts the word back and passes the turn. """
         if player == self.lead:
             if self.word:
-                self.word_collection.add_word(self.word, player)
+                self.word_collection.put_back(self.word, player)
+                self.word = None
             return self.__next_move()
         else:
             return texts.not_your_turn_message
 
+    def finish(self):
+        """ Puts back the word of a running turn, the round is over. """
+        if getattr(self, "word", None):
+            self.word_collection.put_back(self.word, self.lead)
+            self.word = None
+
+    def dump(self):
+        """ Returns the state of the round as JSON-serializable data. """
+        data = {
+            "players": self.players,
+            "move": [self.move.lead, self.move.target],
+            "points": list(self.points.items()),
+            "explained_points": list(self.explained_points.items()),
+            "guessed_points": list(self.guessed_points.items()),
+            "timer": self._timer,
+        }
+        if hasattr(self, "lead"):
+            data["turn"] = [self.lead, self.target]
+        if hasattr(self, "word"):
+            data["word"] = self.word
+            data["word_id"] = getattr(self.word, "id", None)
+        return data
+
+    @classmethod
+    def load(cls, word_collection, data):
+        """ Creates a round in the state returned by dump. """
+        restored = cls(word_collection, data["players"])
+        restored.move.lead, restored.move.target = data["move"]
+        restored.points.update(dict(data["points"]))
+        restored.explained_points.update(dict(data["explained_points"]))
+        restored.guessed_points.update(dict(data["guessed_points"]))
+        restored.timer = data["timer"]
+        if "turn" in data:
+            restored.lead, restored.target = data["turn"]
+        if "word" in data:
+            restored.word = data["word"] and Word(data["word"], data.get("word_id"))
+        return restored
+
     def pretty_scores(self):
         most_common = self.points.most_common(len(self.players))
         player_scores = []
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Room-sharded multi-process mode of the bot.
+
+Rooms are split between worker processes by a hash of their name. Every worker runs the handlers of bot.py
+with its own SQLite file (db_file.N) and log file (log_file.N), so the shards share nothing and use a core each.
+The front process polls updates and passes each of them to the worker of the sender's room. Updates of players
+without a room go to the shard of their text, which is the room they are joining. Updates of one user are
+processed one at a time, in order, so a player is routed by the room the previous update left them in.
+/subscribe and /unsubscribe go to the shard of the room they name; without a room they go to every shard
+and the first one replies. With --metrics-port P, shard N serves its metrics on port P + N.
+
+Usage: python shards.py db_file log_file config [--shards N] [--handler-workers N] [bot.py options]
+"""
+import logging
+import multiprocessing
+import signal
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from telegram.ext import Dispatcher
+
+import bot
+from db import Game
+from logs import setup_logging
+from room_state import ALL_ROOMS
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(key, shards):
+    """ Shard of a room name, stable across processes and restarts. """
+    return zlib.crc32(key.encode()) % shards
+
+
+def shard_file(path, shard):
+    return "{}.{}".format(path, shard)
+
+
+def _sender(update):
+    """ Returns the user id and lowercased text of an update as sent by Telegram. """
+    message = update.get("message") or update.get("edited_message") or {}
+    user = message.get("from") or {}
+    return user.get("id"), (message.get("text") or "").lower()
+
+
+def _subscription(text):
+    """ Returns the command and room of a /subscribe or /unsubscribe text, ALL_ROOMS if it names no room,
+    None for other texts. """
+    words = text.split()
+    command = words[0].split("@")[0] if words else None
+    if command not in ("/subscribe", "/unsubscribe"):
+        return None
+    return command, words[1] if len(words) > 1 else ALL_ROOMS
+
+
+def shards_of(room, text, shards):
+    """ Shards an update goes to: those of the subscription it changes, otherwise the shard of the sender's
+    room or, without one, of the room named by the text. """
+    subscription = _subscription(text)
+    if subscription is not None:
+        room = subscription[1]
+        return list(range(shards)) if room == ALL_ROOMS else [shard_for(room, shards)]
+    return [shard_for(room or text, shards)]
+
+
+def worker(args, token, base_url, shard, shards, updates, results, extra_rooms=()):
+    """ Processes the updates of a shard until None is received, runs in a worker process. """
+    args.db_file = shard_file(args.db_file, shard)
+    args.log_file = shard_file(args.log_file, shard)
+    if args.metrics_port is not None:
+        args.metrics_port += shard
+    for room in extra_rooms:
+        bot.catalog.add(room)
+    telegram_bot = Bot(token, base_url=base_url, request=bot.telegram_request(args))
+    bot.setup(args, telegram_bot)
+    dispatcher = Dispatcher(telegram_bot, None, workers=0, use_context=True)
+    bot.add_handlers(dispatcher)
+
+    def process(data):
+        user, text = _sender(data)
+        subscription = _subscription(text)
+        if subscription is None and user is not None and bot.game.room_for_player(user) is None \
+                and shard_for(text, shards) != shard:
+            # The player was removed from the room by another player, the front sends the update again
+            results.put((data["update_id"], user, None, False))
+            return
+        try:
+            if subscription is not None and subscription[1] == ALL_ROOMS and shard != 0:
+                # Every shard records it, the first one replies
+                chat_id = (data.get("message") or data.get("edited_message"))["chat"]["id"]
+                if subscription[0] == "/subscribe":
+                    bot.add_subscription(user, chat_id, ALL_ROOMS)
+                else:
+                    bot.remove_subscription(user, None)
+            else:
+                dispatcher.process_update(Update.de_json(data, telegram_bot))
+        finally:
+            results.put((data["update_id"], user, bot.game.room_for_player(user), True))
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    telegram_bot.get_me()
+    results.put("ready")
+    with ThreadPoolExecutor(args.handler_workers, thread_name_prefix="handler") as executor:
+        for data in iter(updates.get, None):
+            executor.submit(process, data)
+    bot.shutdown(args)
+
+
+class Front:
+    """ Routes updates to the shard queues, one update per user at a time. """
+
+    def __init__(self, queues, player_rooms):
+        self.queues = queues
+        self._rooms = player_rooms
+        # Users with an update in a worker -> their updates waiting for it
+        self._waiting = {}
+        # Users with an update in a worker -> workers still processing it
+        self._in_flight = {}
+        self._lock = threading.Condition()
+
+    def route(self, update):
+        user, text = _sender(update)
+        with self._lock:
+            if user is not None:
+                if user in self._waiting:
+                    self._waiting[user].append(update)
+                    return
+                self._waiting[user] = deque()
+            self._send(update, user, text)
+
+    def done(self, update, user, room, processed=True):
+        """ Records the room of the user after their update was processed and sends the next one.
+        An update that was not processed is sent again. Returns whether every shard of the update
+        processed it. """
+        if user is None:
+            return processed
+        with self._lock:
+            if processed:
+                self._in_flight[user] -= 1
+                if self._in_flight[user]:
+                    return False
+            # A subscription is changed by the shard of the room subscribed to, which does not know the player
+            if _subscription(_sender(update)[1]) is None:
+                if room is None:
+                    self._rooms.pop(user, None)
+                else:
+                    self._rooms[user] = room
+            waiting = self._waiting[user]
+            if not processed:
+                waiting.appendleft(update)
+            if waiting:
+                update = waiting.popleft()
+                self._send(update, user, _sender(update)[1])
+            else:
+                del self._waiting[user]
+                del self._in_flight[user]
+                self._lock.notify_all()
+        return processed
+
+    def join(self, timeout=None):
+        """ Waits until every routed update is processed, returns False on timeout. """
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._waiting, timeout)
+
+    def _send(self, update, user, text):
+        shards = shards_of(self._rooms.get(user), text, len(self.queues))
+        if user is not None:
+            self._in_flight[user] = len(shards)
+        for shard in shards:
+            self.queues[shard].put(update)
+
+
+def run(args, token, base_url=None, stopped=None, on_done=None, extra_rooms=()):
+    """ Runs the front and --shards workers until `stopped` is set. `on_done(update_id)` is called after
+    each update is processed. """
+    if stopped is None:
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stopped.set())
+
+    player_rooms = {}
+    for shard in range(args.shards):
+        player_rooms.update(Game(shard_file(args.db_file, shard)).players())
+
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(args.shards)]
+    results = context.Queue()
+    workers = [context.Process(target=worker, name="shard-{}".format(shard),
+                               args=(args, token, base_url, shard, args.shards, queues[shard], results,
+                                     list(extra_rooms)))
+               for shard in range(args.shards)]
+    for process in workers:
+        process.start()
+    # Polling starts once every worker is up
+    ready = 0
+    while ready < len(workers):
+        try:
+            results.get(timeout=1)
+            ready += 1
+        except Empty:
+            exited = _exited(workers)
+            if exited:
+                for process in workers:
+                    process.terminate()
+                    process.join()
+                raise RuntimeError("Shard worker {} exited while starting".format(exited[0].name))
+    front = Front(queues, player_rooms)
+
+    # Updates in the workers by id, to send them again if they reach the wrong shard
+    sent = {}
+
+    def collect():
+        for update_id, user, room, processed in iter(results.get, None):
+            if front.done(sent[update_id], user, room, processed):
+                del sent[update_id]
+                if on_done:
+                    on_done(update_id)
+
+    collector = threading.Thread(target=collect, name="results")
+    collector.start()
+
+    telegram_bot = Bot(token, base_url=base_url)
+    offset = 0
+    while not stopped.is_set():
+        exited = _exited(workers)
+        if exited:
+            # Updates of its rooms would wait for it forever
+            logger.error("Shard worker %s exited with %s, stopping", exited[0].name, exited[0].exitcode)
+            break
+        try:
+            updates = telegram_bot.get_updates(offset=offset, timeout=args.poll_timeout)
+        except TelegramError as e:
+            logger.warning("getUpdates failed: %s", e)
+            stopped.wait(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            data = update.to_dict()
+            sent[update.update_id] = data
+            front.route(data)
+
+    front.join(timeout=10)
+    for queue in queues:
+        queue.put(None)
+    for process in workers:
+        process.join()
+    results.put(None)
+    collector.join()
+
+
+def _exited(workers):
+    return [process for process in workers if process.exitcode is not None]
+
+
+def build_parser():
+    # Updates are polled and routed by the front, the webhook and room worker options don't apply
+    parser = bot.build_parser(dispatch_options=False)
+    parser.add_argument('--shards', type=int, default=multiprocessing.cpu_count(), help='Worker processes')
+    parser.add_argument('--handler-workers', type=int, default=8, help='Threads running the handlers in a worker')
+    parser.add_argument('--poll-timeout', type=float, default=10, help='Long polling timeout of getUpdates')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    config = bot.load_config(args.config)
+    setup_logging(shard_file(args.log_file, "front"))
+    run(args, config.token)
+
+
+if __name__ == '__main__':
+    main()
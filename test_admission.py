@@ -0,0 +1,64 @@
+import unittest
+
+from admission import Admission, Limits, DEFAULT, parse_limits
+
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.admission = Admission({"public": Limits(1, 2, 10, 3)},
+                                   lambda room: "experimental" if room == "exp" else "public",
+                                   sweep_interval=5, clock=lambda: self.now)
+
+    def test_user_limit(self):
+        self.assertEqual(self.admission.admit(1, "room1"), (True, False))
+        self.assertEqual(self.admission.admit(1, "room1"), (True, False))
+        # One notice, then throttled silently
+        self.assertEqual(self.admission.admit(1, "room1"), (False, True))
+        self.assertEqual(self.admission.admit(1, "room1"), (False, False))
+        self.assertEqual(self.admission.admit(2, "room1"), (True, False))
+        self.now = 1
+        self.assertEqual(self.admission.admit(1, "room1"), (True, False))
+        self.assertEqual(self.admission.admit(1, "room1"), (False, True))
+        self.assertEqual(self.admission.throttled, 3)
+
+    def test_room_limit(self):
+        for user in (1, 2, 3):
+            self.assertTrue(self.admission.admit(user, "room1")[0])
+        self.assertEqual(self.admission.admit(4, "room1"), (False, True))
+        # Other rooms, rooms of unlimited kinds and users outside rooms are not affected
+        self.assertTrue(self.admission.admit(4, "room2")[0])
+        for _ in range(10):
+            self.assertTrue(self.admission.admit(5, "exp")[0])
+        for user in range(6, 16):
+            self.assertTrue(self.admission.admit(user, None)[0])
+
+    def test_default_limits(self):
+        # Without default limits users outside rooms get the strictest user limits
+        self.assertEqual([self.admission.admit(1, None)[0] for _ in range(3)], [True, True, False])
+        admission = Admission({"public": Limits(1, 2, 10, 3), DEFAULT: Limits(1, 1, 1, 1)},
+                              lambda room: None if room == "gone" else "public", clock=lambda: self.now)
+        # Users outside rooms and in rooms missing from the catalog only have a user bucket
+        self.assertEqual(admission.admit(1, None), (True, False))
+        self.assertEqual(admission.admit(1, "gone"), (False, True))
+        self.assertEqual(admission.admit(2, "gone"), (True, False))
+        self.assertEqual(admission.admit(3, None), (True, False))
+        self.assertEqual(len(admission), 3)
+
+    def test_expiry(self):
+        for user in range(100):
+            self.admission.admit(user, "room" + str(user))
+        self.assertEqual(len(self.admission), 200)
+        self.now = 10
+        self.admission.admit(1, "room1")
+        self.assertEqual(len(self.admission), 2)
+
+    def test_parse(self):
+        self.assertEqual(parse_limits("personal=1,2,3.5,4"), ("personal", Limits(1, 2, 3.5, 4)))
+        for text in ("personal=1,2,3", "=1,2,3,4", "personal=1,2,3,0"):
+            with self.assertRaises(ValueError):
+                parse_limits(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+from collections import defaultdict
+
+from broadcast import Broadcaster
+from ratelimit import TokenBucket
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Flood control exceeded")
+        self.retry_after = retry_after
+
+
+class FakeBot:
+    def __init__(self, flood_every=0):
+        self.messages = defaultdict(list)
+        # Every flood_every-th call to a chat fails with flood control
+        self.flood_every = flood_every
+        self.calls = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self.lock:
+            self.calls[chat_id] += 1
+            if self.flood_every and self.calls[chat_id] % self.flood_every == 0:
+                raise RetryAfter(0.01)
+            self.messages[chat_id].append(text)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_bucket(self):
+        bucket = TokenBucket(2, 3, 0)
+        self.assertTrue(bucket.take(0))
+        self.assertTrue(bucket.take(0))
+        self.assertTrue(bucket.take(0))
+        self.assertFalse(bucket.take(0))
+        self.assertEqual(bucket.delay(0), 0.5)
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.full(1))
+        self.assertTrue(bucket.full(2))
+
+
+class TestBroadcaster(unittest.TestCase):
+    def test_order_and_retry(self):
+        bot = FakeBot(flood_every=7)
+        broadcaster = Broadcaster(bot, workers=4, global_rate=10000, chat_rate=10000, chat_burst=100)
+        for i in range(50):
+            for chat_id in range(10):
+                broadcaster.send_message(chat_id, str(i))
+        self.assertTrue(broadcaster.join(10))
+        broadcaster.stop()
+        for chat_id in range(10):
+            self.assertEqual(bot.messages[chat_id], [str(i) for i in range(50)])
+        self.assertEqual(broadcaster.sent, 500)
+
+    def test_coalescing(self):
+        bot = FakeBot()
+        # One message at once per chat, so the ticks wait behind the first one
+        broadcaster = Broadcaster(bot, workers=1, global_rate=1000, chat_rate=20, chat_burst=1)
+        broadcaster.send_message(1, "start")
+        for i in range(10):
+            broadcaster.send_message(1, str(i), key="timer")
+        broadcaster.send_message(1, "end")
+        self.assertTrue(broadcaster.join(10))
+        broadcaster.stop()
+        self.assertEqual(bot.messages[1], ["start", "9", "end"])
+        self.assertEqual(broadcaster.coalesced, 9)
+
+    def test_chat_rate(self):
+        bot = FakeBot()
+        broadcaster = Broadcaster(bot, workers=4, global_rate=1000, chat_rate=50, chat_burst=1)
+        start = time.monotonic()
+        for i in range(6):
+            broadcaster.send_message(1, str(i))
+        self.assertTrue(broadcaster.join(10))
+        broadcaster.stop()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertEqual(bot.messages[1], [str(i) for i in range(6)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
 import os
+import random
+import sqlite3
 import tempfile
+import threading
 import unittest
 
-from db import start_game
+from db import (start_game, get_pool, migrations, CachedHat, ConnectionPool, HatWrapper, IN_HAT, DRAWN, GUESSED,
+                DISCARDED)
+from round import Round
 
 
 class TestDb(unittest.TestCase):
@@ -41,6 +46,321 @@ class TestDb(unittest.TestCase):
         self.assertTrue(hat.get_word("room1"))
         self.assertIsNone(hat.get_word("room1"))
 
+    def test_migrations(self):
+        conn = sqlite3.connect(self.db_file, isolation_level=None)
+        conn.execute("CREATE TABLE words (word text, author integer, room text, used integer);")
+        conn.executemany("INSERT INTO words VALUES (?, 1, ?, ?);",
+                         [("кот", "room1", 0), ("кот", "room1", 0), ("кот", "room1", 1), ("кот", "room2", 0)])
+        hat, game = start_game(self.db_file)
+        # Starting again must not re-apply anything
+        hat, game = start_game(self.db_file)
+        versions = conn.execute("SELECT version FROM schema_version;").fetchall()
+        self.assertEqual(versions, [(v,) for v in range(1, len(migrations) + 1)])
+        self.assertEqual(hat.words_in_hat("room1"), 1)
+        self.assertEqual(hat.words_in_hat("room2"), 1)
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT word FROM words WHERE room=? AND used=0;",
+                            ("room1",)).fetchall()
+        self.assertIn("USING", plan[0][-1])
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT COUNT(id) FROM players WHERE room=?;", ("room1",)).fetchall()
+        self.assertIn("players_room", plan[0][-1])
+        conn.close()
+
+    def test_draw_is_uniform(self):
+        hat, game = start_game(self.db_file)
+        random.seed(1)
+        words = ["один", "два", "три", "четыре"]
+        drawn = {word: 0 for word in words}
+        for _ in range(400):
+            for word in words:
+                hat.add_word(word, 1, "room1")
+            drawn[hat.get_word("room1")] += 1
+            while hat.get_word("room1"):
+                pass
+        for word in words:
+            self.assertTrue(60 < drawn[word] < 140, drawn)
+
+    def test_slots_stay_dense(self):
+        hat, game = start_game(self.db_file)
+        random.seed(2)
+        in_hat = set()
+        for i in range(300):
+            word = "слово" + "а" * random.randrange(20)
+            action = random.randrange(3)
+            if action == 0:
+                self.assertEqual(hat.add_word(word, 1, "room1"), word not in in_hat)
+                in_hat.add(word)
+            elif action == 1:
+                self.assertEqual(hat.remove_word(word, "room1"), word in in_hat)
+                in_hat.discard(word)
+            else:
+                drawn = hat.get_word("room1")
+                self.assertEqual(drawn is None, not in_hat)
+                in_hat.discard(drawn)
+            slots = hat.cursor().execute("SELECT slot FROM words WHERE room='room1' AND used=0;").fetchall()
+            self.assertEqual(sorted(slot for slot, in slots), list(range(len(in_hat))))
+
+    def test_add_words(self):
+        hat, game = start_game(self.db_file)
+        self.assertTrue(hat.add_word("первое", 1, "room1"))
+        self.assertEqual(hat.add_words(["Второе", "первое", "qcь", "", "второе", "третье"], 1, "room1"),
+                         [True, False, False, False, False, True])
+        self.assertEqual(hat.words_in_hat("room1"), 3)
+        self.assertEqual(hat.room_words("room1"), {"первое", "второе", "третье"})
+        self.assertEqual(hat.add_words([], 1, "room1"), [])
+        words = ["а" * (i % 100) + "б" * (i // 100) for i in range(1, hat.max_word_count() + 1)]
+        self.assertEqual(hat.add_words(words, 1, "room2"), [True] * hat.max_word_count())
+        self.assertEqual(hat.add_words(["ещё"], 1, "room2"), [False])
+        self.assertEqual(hat.words_in_hat("room2"), hat.max_word_count())
+        drawn = {hat.get_word("room1") for _ in range(3)}
+        self.assertEqual(drawn, {"первое", "второе", "третье"})
+
+    def test_cached_hat(self):
+        hat, game = start_game(self.db_file)
+        hat.add_word("первое", 1, "room1")
+        now = [0]
+        cached = CachedHat(hat, flush_interval=3600, room_ttl=10, clock=lambda: now[0])
+        self.assertEqual(cached.words_in_hat("room1"), 1)
+        self.assertTrue(cached.add_word("second", 1, "room1"))
+        self.assertFalse(cached.add_word("Первое", 1, "room1"))
+        self.assertFalse(cached.add_word("qcь", 1, "room1"))
+        self.assertTrue(cached.add_word("третье", 1, "room1"))
+        self.assertTrue(cached.remove_word("третье", "room1"))
+        self.assertFalse(cached.remove_word("третье", "room1"))
+        self.assertEqual(cached.words_in_hat("room1"), 2)
+        # Nothing is written before the flush
+        self.assertEqual(hat.words_in_hat("room1"), 1)
+        drawn = cached.get_word("room1")
+        self.assertIn(drawn, {"первое", "second"})
+        cached.flush()
+        self.assertEqual(hat.words_in_hat("room1"), 1)
+        self.assertEqual(hat.get_word("room1"), ({"первое", "second"} - {drawn}).pop())
+        # The room is still cached and does not see the direct draw
+        self.assertEqual(cached.words_in_hat("room1"), 1)
+        now[0] = 11
+        cached.flush()
+        self.assertEqual(cached.words_in_hat("room1"), 0)
+        self.assertIsNone(cached.get_word("room1"))
+        cached.close()
+
+    def test_cached_hat_bad_change(self):
+        hat, game = start_game(self.db_file)
+        cached = CachedHat(hat, flush_interval=3600)
+        self.assertEqual(cached.words_in_hat("room1"), 0)
+        # Added behind the cache's back, writing it again breaks the unique index
+        self.assertTrue(hat.add_word("первое", 1, "room1"))
+        self.assertTrue(cached.add_word("первое", 1, "room1"))
+        self.assertTrue(cached.add_word("второе", 1, "room1"))
+        with self.assertLogs("db", "WARNING"):
+            cached.flush()
+        self.assertEqual(hat.room_words("room1"), {"первое", "второе"})
+        # The failed change is gone, later flushes write again
+        self.assertTrue(cached.add_word("третье", 1, "room1"))
+        cached.flush()
+        self.assertEqual(hat.room_words("room1"), {"первое", "второе", "третье"})
+        cached.close()
+
+    def test_cached_hat_put_back_to_full_hat(self):
+        hat, game = start_game(self.db_file)
+        cached = CachedHat(hat, flush_interval=3600)
+        words = ["слово" + chr(ord("а") + i % 32) + chr(ord("а") + i // 32) for i in range(hat.max_word_count())]
+        self.assertTrue(all(cached.add_words(words, 1, "room1")))
+        drawn = cached.get_word("room1")
+        self.assertTrue(cached.add_word("лишнее", 1, "room1"))
+        self.assertFalse(cached.add_word("другое", 1, "room1"))
+        self.assertTrue(cached.put_back(drawn, 1, "room1"))
+        self.assertEqual(cached.words_in_hat("room1"), hat.max_word_count() + 1)
+        cached.close()
+        self.assertIn(drawn, hat.room_words("room1"))
+
+    def test_game_index(self):
+        hat, game = start_game(self.db_file)
+        random.seed(5)
+        for _ in range(500):
+            player = random.randrange(30)
+            if game.room_for_player(player) is None:
+                game.add_player(player, "room" + str(random.randrange(4)))
+            else:
+                game.leave_room(player)
+        reopened = start_game(self.db_file)[1]
+        for player in range(30):
+            result = game.cursor().execute("SELECT room FROM players WHERE id=?;", (player,)).fetchone()
+            self.assertEqual(game.room_for_player(player), result and result[0])
+            self.assertEqual(reopened.room_for_player(player), game.room_for_player(player))
+        for room in ["room" + str(i) for i in range(5)]:
+            count = game.cursor().execute("SELECT COUNT(id) FROM players WHERE room=?;", (room,)).fetchone()[0]
+            self.assertEqual(game.room_size(room), count)
+            self.assertEqual(reopened.room_size(room), count)
+
+    def test_word_lifecycle(self):
+        hat, game = start_game(self.db_file)
+        hat.add_words(["один", "два", "три"], 1, "room1")
+
+        def states():
+            return dict(hat.cursor().execute("SELECT rowid, state FROM words;").fetchall())
+
+        def slots():
+            return sorted(slot for slot, in hat.cursor().execute("SELECT slot FROM words WHERE used=0;"))
+
+        word = hat.get_word("room1")
+        self.assertEqual(states()[word.id], DRAWN)
+        self.assertEqual(slots(), [0, 1])
+        hat.put_back(word, 2, "room1")
+        self.assertEqual(states()[word.id], IN_HAT)
+        self.assertEqual(slots(), [0, 1, 2])
+        self.assertEqual(len(states()), 3)
+
+        guessed = hat.get_word("room1")
+        hat.finish(guessed, GUESSED)
+        discarded = hat.get_word("room1")
+        hat.finish(discarded, DISCARDED)
+        # Only drawn words change state
+        hat.put_back(guessed, 2, "room1")
+        self.assertEqual(hat.words_in_hat("room1"), 1)
+        self.assertEqual(states()[guessed.id], GUESSED)
+        self.assertEqual(states()[discarded.id], DISCARDED)
+
+        # The word was added again while it was drawn
+        last = hat.get_word("room1")
+        hat.add_word(last, 1, "room1")
+        hat.put_back(last, 1, "room1")
+        self.assertEqual(hat.room_words("room1"), {last})
+        self.assertEqual(states()[last.id], DISCARDED)
+
+    def test_round_statements(self):
+        hat, game = start_game(self.db_file)
+        hat.add_words(["слово" + "а" * i for i in range(10)], 1, "room1")
+        statements = []
+        hat.cursor().connection.set_trace_callback(statements.append)
+        r = Round(HatWrapper("room1", hat), [1, 2])
+        r.start_game()
+        r.start_move(1)
+        del statements[:]
+        r.time_ran_out(1)
+        # Put back is a single statement and the row is reused
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(hat.cursor().execute("SELECT COUNT(*) FROM words;").fetchone()[0], 10)
+        self.assertEqual(hat.words_in_hat("room1"), 10)
+
+    def test_words_in_hat(self):
+        hat, game = start_game(self.db_file)
+        random.seed(3)
+        rooms = ["room1", "room2", "room3"]
+        drawn = []
+        for _ in range(3000):
+            room = random.choice(rooms)
+            action = random.randrange(6)
+            if action == 0:
+                hat.add_word("слово" + "а" * random.randrange(150), 1, room)
+            elif action == 1:
+                hat.add_words(["кот" + "а" * random.randrange(150) for _ in range(5)], 1, room)
+            elif action == 2:
+                word = hat.get_word(room)
+                if word:
+                    drawn.append((word, room))
+            elif action == 3:
+                hat.remove_word("слово" + "а" * random.randrange(150), room)
+            elif action == 4 and drawn:
+                word, word_room = drawn.pop(random.randrange(len(drawn)))
+                hat.put_back(word, 1, word_room)
+            elif action == 5 and drawn:
+                word, word_room = drawn.pop(random.randrange(len(drawn)))
+                hat.finish(word, random.choice([GUESSED, DISCARDED]))
+            count = hat.cursor().execute("SELECT COUNT(*) FROM words WHERE room=? AND used=0;", (room,)).fetchone()[0]
+            self.assertEqual(hat.words_in_hat(room), count)
+        self.assertEqual(hat.repair(), [])
+
+    def test_repair(self):
+        hat, game = start_game(self.db_file)
+        hat.add_words(["слово" + "а" * i for i in range(10)], 1, "room1")
+        hat.add_words(["слово" + "а" * i for i in range(10)], 1, "room2")
+        hat.cursor().execute("UPDATE words SET slot=slot+100 WHERE room='room1' AND slot>3;")
+        hat.cursor().execute("UPDATE words SET slot=NULL WHERE room='room2' AND slot=0;")
+        hat, game = start_game(self.db_file)
+        for room in ("room1", "room2"):
+            self.assertEqual(hat.words_in_hat(room), 10)
+            slots = hat.cursor().execute("SELECT slot FROM words WHERE room=? ORDER BY slot;", (room,)).fetchall()
+            self.assertEqual([slot for slot, in slots], list(range(10)))
+
+        # Words added to a room with a hole go after its last slot, the hole is repaired later
+        hat.cursor().execute("UPDATE words SET slot=slot+100 WHERE room='room2' AND slot>=5;")
+        hat.cursor().execute("UPDATE words SET slot=slot-97 WHERE room='room2' AND slot>=100;")
+        self.assertEqual(hat.add_words(["новое", "другое"], 1, "room2"), [True, True])
+        self.assertEqual(hat.repair(), ["room2"])
+        slots = hat.cursor().execute("SELECT slot FROM words WHERE room='room2' ORDER BY slot;").fetchall()
+        self.assertEqual([slot for slot, in slots], list(range(12)))
+
+        # A hole found while drawing is repaired too
+        hat.cursor().execute("UPDATE words SET slot=slot+100 WHERE room='room1' AND slot>=5;")
+        self.assertEqual(len({hat.get_word("room1") for _ in range(10)}), 10)
+        self.assertIsNone(hat.get_word("room1"))
+
+    def test_connection_pool(self):
+        pool = ConnectionPool(self.db_file, size=1, timeout=0.1)
+        self.assertEqual(pool.connection().execute("PRAGMA journal_mode;").fetchone()[0], "wal")
+        self.assertEqual(pool.connection().execute("PRAGMA synchronous;").fetchone()[0], 1)
+        self.assertIs(pool.connection(), pool.connection())
+
+        # The only connection is taken by this thread
+        errors = []
+
+        def query():
+            try:
+                pool.connection().execute("SELECT 1;")
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=query)
+        thread.start()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+
+        # Connections of finished threads are reused
+        pool = ConnectionPool(self.db_file, size=2, timeout=1)
+        for _ in range(5):
+            thread = threading.Thread(target=query)
+            thread.start()
+            thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(pool.opened, 1)
+        self.assertEqual(pool.idle(), 1)
+
+        # A thread waits for a connection until another thread exits
+        started = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            pool.connection().execute("BEGIN;")
+            started.set()
+            release.wait()
+
+        holders = [threading.Thread(target=hold) for _ in range(2)]
+        for holder in holders:
+            started.clear()
+            holder.start()
+            started.wait()
+        self.assertEqual(pool.opened, 2)
+        waiting = threading.Thread(target=query)
+        waiting.start()
+        release.set()
+        waiting.join()
+        for holder in holders:
+            holder.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(pool.opened, 2)
+        # Open transactions of exited threads were rolled back
+        self.assertEqual(pool.idle(), 2)
+        self.assertFalse(any(conn.in_transaction for conn in pool._idle))
+
+    def test_shared_pool(self):
+        hat, game = start_game(self.db_file)
+        # Every object of a database file takes connections from the same pool
+        self.assertIs(hat.cursor.pool, game.cursor.pool)
+        self.assertIs(get_pool(self.db_file), hat.cursor.pool)
+        hat.add_word("слово", 1, "room")
+        self.assertEqual(hat.words_in_hat("room"), 1)
+        game.room_for_player(1)
+        self.assertEqual(hat.cursor.pool.opened, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,60 @@
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+
+from dictionary import Dictionary, CompactWords, compile_dictionary
+
+
+class TestDictionary(unittest.TestCase):
+    def test_words(self):
+        d = Dictionary.from_words(["кот", "пёс", "кот", "Bad", "", "ёж", "dog"])
+        self.assertEqual(len(d), 4)
+        self.assertEqual(d.index("кот"), d.words.index("кот"))
+        self.assertIsNone(d.index("Bad"))
+        self.assertIsNone(d.index("мышь"))
+
+    def test_sample_excludes(self):
+        words = ["слово" + "а" * i for i in range(50)]
+        d = Dictionary.from_words(words)
+        random.seed(3)
+        for _ in range(100):
+            exclude = set(random.sample(words, random.randrange(50))) | {"мышь"}
+            available = 50 - len(exclude) + 1
+            self.assertEqual(d.available(exclude), available)
+            sample = d.sample(available, exclude)
+            self.assertEqual(len(sample), available)
+            self.assertEqual(set(sample), set(words) - exclude)
+            with self.assertRaises(ValueError):
+                d.sample(available + 1, exclude)
+
+    def test_sample_is_uniform(self):
+        d = Dictionary.from_words(["один", "два", "три", "четыре", "пять"])
+        random.seed(4)
+        counts = Counter()
+        for _ in range(3000):
+            counts.update(d.sample(1, {"два", "четыре"}))
+        self.assertEqual(set(counts), {"один", "три", "пять"})
+        for word in counts:
+            self.assertTrue(900 < counts[word] < 1100, counts)
+
+    def test_compact_words(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "words.txt")
+            with open(source, "w", encoding='utf8') as f:
+                f.write("пёс\nкот\nBad\n\nёж\nкот\ndog\n")
+            words = CompactWords(os.path.join(directory, "words.bin"), source=source)
+            self.assertEqual(list(words), ["dog", "кот", "пёс", "ёж"])
+            self.assertEqual(words[-1], "ёж")
+            d = Dictionary(words)
+            self.assertEqual(d.index("пёс"), 2)
+            self.assertIsNone(d.index("мышь"))
+            self.assertEqual(sorted(d.sample(2, {"кот", "dog"})), ["пёс", "ёж"])
+            compiled = os.path.join(directory, "other.bin")
+            compile_dictionary(source, compiled)
+            self.assertEqual(list(CompactWords(compiled)), list(words))
+
+
+if __name__ == '__main__':
+    unittest.main()
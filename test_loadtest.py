@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import bot
+import loadtest
+import texts
+from db import RoomStore, IN_HAT, DISCARDED
+from room_state import RoomRegistry
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_games(self):
+        options = loadtest.build_parser().parse_args(["--rooms", "3", "--players", "3", "--turns", "4"])
+        report = loadtest.run(options, ["--broadcast-rate", "100000", "--chat-rate", "10000"])
+        actions = report["actions"]
+        for action in actions.values():
+            self.assertEqual(action["errors"], 0)
+        self.assertEqual(actions["join"]["calls"], 9)
+        self.assertEqual(actions["continue_turn"]["calls"], 3 * 4 * 4)
+        self.assertGreater(actions["start_turn"]["statements_per_call"], 0)
+        self.assertGreaterEqual(actions["start_turn"]["messages_per_call"], 4)
+        self.assertGreaterEqual(report["messages_sent"], sum(a["calls"] for a in actions.values()))
+
+    def test_finished_rooms_not_restored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db_file = os.path.join(directory, "bot.db")
+            options = loadtest.build_parser().parse_args(["--rooms", "2", "--players", "2", "--turns", "2",
+                                                          "--timer", "0"])
+            loadtest.run(options, ["--broadcast-rate", "100000", "--chat-rate", "10000"], db_file=db_file)
+            # A restarted bot finds the rounds finished with /finish_round gone
+            store = RoomStore(db_file)
+            registry = RoomRegistry(store)
+            for room in range(2):
+                name = loadtest.room_name(room)
+                self.assertIsNone(store.load(name))
+                self.assertIsNone(registry.get(name).round)
+
+    def test_no_words_left_drawn(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db_file = os.path.join(directory, "bot.db")
+            harness = loadtest.Harness()
+            args = bot.build_parser().parse_args([db_file, os.devnull, "staging", "--maintenance-interval", "0"])
+            bot.setup(args, harness.bot)
+
+            def start(room, users):
+                bot.catalog.add(room)
+                for user in users:
+                    harness.call("join", bot.echo, user, room)
+                harness.call("add_words", bot.echo, users[0], "один два три четыре")
+
+            def start_turn(room):
+                harness.call("start_turn", bot.start_turn, bot.registry.get(room).round.lead, texts.next_word_button)
+
+            try:
+                start("комната", (1, 2))
+                # A word shown by /getword is discarded, the word of the turn running at /finish_round put back
+                harness.call("getword", bot.getword, 2, "/getword")
+                for user in (1, 2):
+                    harness.call("ready", bot.ready, user, "/ready")
+                start_turn("комната")
+                harness.call("finish_round", bot.finish_round, 1, "/finish_round")
+
+                # The word of a turn is put back when /force_start restarts the round and when the players leave
+                start("другая", (3, 4))
+                for user in (3, 4):
+                    harness.call("ready", bot.ready, user, "/ready")
+                start_turn("другая")
+                harness.call("force_start", bot.force_start, 3, "/force_start")
+                start_turn("другая")
+                for user in (3, 4):
+                    harness.call("leaveroom", bot.leaveroom, user, "/leaveroom")
+                bot.maintenance.run()
+            finally:
+                bot.shutdown(args)
+            self.assertEqual(sum(harness.errors.values()), 0)
+            with sqlite3.connect(db_file) as conn:
+                states = {(room, state): count for room, state, count in
+                          conn.execute("SELECT room, state, COUNT(*) FROM words GROUP BY room, state;")}
+                archived = conn.execute("SELECT room, state FROM words_archive;").fetchall()
+            self.assertEqual(states, {("комната", IN_HAT): 3, ("другая", IN_HAT): 4})
+            self.assertEqual(archived, [("комната", DISCARDED)])
+
+    def test_subscribers(self):
+        def game_messages(*extra):
+            options = loadtest.build_parser().parse_args(["--rooms", "3", "--players", "2", "--turns", "3",
+                                                          "--timer", "0"] + list(extra))
+            report = loadtest.run(options, ["--broadcast-rate", "100000", "--chat-rate", "10000"])
+            return sum(round(action["messages_per_call"] * action["calls"])
+                       for name, action in report["actions"].items() if name != "subscribe")
+
+        baseline = game_messages()
+        one_room = game_messages("--subscribers", "2") - baseline
+        self.assertGreater(one_room, 0)
+        # Subscribers of a room only hear about it, those of every room about all three
+        self.assertEqual(game_messages("--subscribers", "4") - baseline, 2 * one_room)
+        self.assertEqual(game_messages("--watchers", "2") - baseline, 3 * one_room)
+
+    def test_flooding_room(self):
+        def play(*extra):
+            options = loadtest.build_parser().parse_args(["--rooms", "3", "--players", "3", "--turns", "10",
+                                                          "--timer", "0"] + list(extra))
+            return loadtest.run(options, ["--broadcast-rate", "100000", "--chat-rate", "10000",
+                                          "--rate-limit", "experimental=5,10,20,40"])
+
+        baseline = play()
+        self.assertEqual(baseline["throttled"], 0)
+        report = play("--flood", "500")
+        flood = report["actions"]["flood"]
+        # Only the burst and the refill of the flooder's bucket get through
+        self.assertGreaterEqual(report["throttled"], flood["calls"] - 10 - 5 * report["seconds"] - 1)
+        self.assertLessEqual(report["throttled"], flood["calls"])
+        # The game rooms are played as without the flood, none of their updates is dropped; the flooder joins once
+        for name, action in baseline["actions"].items():
+            self.assertEqual(report["actions"][name]["calls"], action["calls"] + (name == "join"))
+            self.assertEqual(report["actions"][name]["errors"], 0)
+            self.assertEqual(report["actions"][name]["messages_per_call"], action["messages_per_call"])
+        # Nor are they slowed down by it, the bound is loose as timings vary with the load of the machine
+        for name in ("add_words", "continue_turn"):
+            self.assertLess(report["actions"][name]["p50_ms"], 4 * baseline["actions"][name]["p50_ms"] + 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+import logs
+
+
+class TestLogs(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bot.log")
+        self.logger = logging.getLogger("test_logs")
+
+    def tearDown(self):
+        logs.stop_logging()
+        self.directory.cleanup()
+
+    def read(self):
+        with open(self.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_json_fields(self):
+        logs.setup_logging(self.path)
+        self.logger.info("ECHO %d %s", 5, "слово", extra=logs.fields("echo", 5, "room"))
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            self.logger.exception("failed")
+        logs.stop_logging()
+        echo, failed = self.read()
+        self.assertEqual(echo["message"], "ECHO 5 слово")
+        self.assertEqual((echo["action"], echo["user"], echo["room"]), ("echo", 5, "room"))
+        self.assertEqual(failed["level"], "ERROR")
+        self.assertIn("ValueError: broken", failed["exception"])
+
+    def test_sampling(self):
+        logs.setup_logging(self.path, sample_every=10)
+        for i in range(100):
+            self.logger.info("ECHO %d", i, extra=logs.fields("echo", i))
+            self.logger.info("READY %d", i, extra=logs.fields("ready", i))
+        self.logger.warning("ECHO failed", extra=logs.fields("echo"))
+        logs.stop_logging()
+        actions = [record.get("action") for record in self.read()]
+        self.assertEqual(actions.count("echo"), 11)
+        self.assertEqual(actions.count("ready"), 100)
+
+    def test_rotation(self):
+        logs.setup_logging(self.path, max_bytes=1000, backups=2)
+        for i in range(100):
+            self.logger.info("message %d", i)
+        logs.stop_logging()
+        self.assertTrue(os.path.exists(self.path + ".1"))
+        self.assertTrue(os.path.exists(self.path + ".2"))
+        self.assertFalse(os.path.exists(self.path + ".3"))
+        self.assertLessEqual(os.path.getsize(self.path), 1000)
+
+    def test_timed_handler(self):
+        class User:
+            id = 7
+
+        class Update:
+            effective_user = User
+
+        def echo(update, context):
+            return "reply"
+
+        lookups = []
+
+        def room_for_player(user):
+            lookups.append(user)
+            return "room"
+
+        timed = logs.timed_handler(echo, room_for_player)
+        logs.setup_logging(self.path)
+        self.assertEqual(timed(Update, None), "reply")
+        logs.stop_logging()
+        # Durations are only logged at DEBUG level
+        self.assertEqual(self.read(), [])
+        self.assertEqual(lookups, [])
+
+        root_level = logging.getLogger().level
+        logs.setup_logging(self.path, level=logging.DEBUG)
+        try:
+            self.assertEqual(timed(Update, None), "reply")
+        finally:
+            logs.stop_logging()
+            logging.getLogger().setLevel(root_level)
+        record, = self.read()
+        self.assertEqual(record["level"], "DEBUG")
+        self.assertEqual((record["action"], record["user"], record["room"]), ("echo", 7, "room"))
+        self.assertGreaterEqual(record["duration_ms"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from db import start_game, GUESSED
+from maintenance import Maintenance
+
+
+class TestMaintenance(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.directory.name, "test.db")
+        self.hat, self.game = start_game(self.db_file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def play(self, room, count):
+        """ Adds words, draws half of them and guesses them. """
+        words = ["слово" + "а" * i for i in range(count)]
+        self.hat.add_words(words, 1, room)
+        drawn = {self.hat.get_word(room) for _ in range(count // 2)}
+        for word in drawn:
+            self.hat.finish(word, GUESSED)
+        return drawn
+
+    def test_archive(self):
+        now = [1000.0]
+        job = Maintenance(self.db_file, batch_size=7, clock=lambda: now[0])
+        drawn1 = self.play("room1", 40)
+        drawn2 = self.play("room2", 40)
+        job.finished("room1")
+        self.assertTrue(job.step())
+        self.assertEqual(job.sizes()["used_words"], 40 - 7 * 2)
+        job.run()
+        sizes = job.sizes()
+        self.assertEqual((sizes["words"], sizes["used_words"], sizes["archived_words"]), (40, 0, 40))
+        archived = job.cursor().execute("SELECT room, word, archived_at FROM words_archive;").fetchall()
+        self.assertEqual({word for room, word, at in archived if room == "room1"}, drawn1)
+        self.assertEqual({word for room, word, at in archived if room == "room2"}, drawn2)
+        self.assertEqual({at for room, word, at in archived}, {1000})
+
+        # A drawn word may still be put back
+        drawn = self.hat.get_word("room1")
+        job.run()
+        self.assertEqual(job.sizes()["used_words"], 1)
+        self.hat.put_back(drawn, 1, "room1")
+
+        # Words left in the hat are drawn as before
+        self.assertEqual(self.hat.words_in_hat("room1"), 20)
+        self.assertEqual(len({self.hat.get_word("room1") for _ in range(20)} | drawn1), 40)
+        self.assertIsNone(self.hat.get_word("room1"))
+
+    def test_retention(self):
+        now = [0.0]
+        job = Maintenance(self.db_file, retention_days=1, clock=lambda: now[0])
+        self.play("room1", 10)
+        job.run()
+        now[0] = 86400 / 2
+        self.play("room2", 10)
+        job.run()
+        self.assertEqual(job.sizes()["archived_words"], 10)
+        now[0] = 86400 * 1.2
+        job.run()
+        self.assertEqual(job.sizes()["archived_words"], 5)
+
+        dropping = Maintenance(self.db_file, retention_days=0)
+        self.play("room3", 10)
+        dropping.run()
+        sizes = dropping.sizes()
+        self.assertEqual((sizes["words"], sizes["used_words"], sizes["archived_words"]), (15, 0, 0))
+
+    def test_vacuum(self):
+        job = Maintenance(self.db_file, retention_days=0, vacuum_pages=5)
+        self.assertTrue(job.incremental())
+        self.hat.add_words(["слово" + "а" * (i % 150) + "б" * (i // 150) for i in range(3000)], 1, "room1")
+        for _ in range(3000):
+            self.hat.finish(self.hat.get_word("room1"), GUESSED)
+        pages = job.sizes()["pages"]
+        job.archive()
+        freed = job.sizes()["free_pages"]
+        self.assertGreater(freed, 5)
+        self.assertLess(job.vacuum(), freed)
+        job.run()
+        sizes = job.sizes()
+        self.assertEqual((sizes["words"], sizes["free_pages"]), (0, 0))
+        self.assertLess(sizes["pages"], pages)
+
+    def test_full_vacuum(self):
+        path = os.path.join(self.directory.name, "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA auto_vacuum=NONE;")
+        conn.execute("CREATE TABLE t (x integer);")
+        conn.close()
+        start_game(path)
+        job = Maintenance(path)
+        self.assertFalse(job.incremental())
+        job.full_vacuum()
+        self.assertTrue(job.incremental())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import threading
+import unittest
+import urllib.request
+
+import db
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = metrics.Histogram("test_seconds", "Test", ("handler",), buckets=(0.1, 1))
+        histogram.observe(0.05, ("a",))
+        histogram.observe(0.5, ("a",))
+        histogram.observe(5, ("a",))
+        lines = histogram.expose()
+        self.assertIn('test_seconds_bucket{handler="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{handler="a",le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{handler="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{handler="a"} 3', lines)
+        self.assertEqual(histogram.count(("a",)), 3)
+
+    def test_timed_handler(self):
+        def handler(update, context):
+            if update:
+                raise ValueError
+            return 1
+
+        timed = metrics.timed_handler(handler)
+        before = metrics.handler_seconds.count(("handler",))
+        errors_before = metrics.handler_errors.value(("handler",))
+        self.assertEqual(timed(None, None), 1)
+        with self.assertRaises(ValueError):
+            timed(True, None)
+        self.assertEqual(metrics.handler_seconds.count(("handler",)), before + 2)
+        self.assertEqual(metrics.handler_errors.value(("handler",)), errors_before + 1)
+
+    def test_count_messages(self):
+        class Bot:
+            def send_message(self, chat_id, text, **kwargs):
+                return Message(self)
+
+            def edit_message_text(self, text, **kwargs):
+                return True
+
+        class Message:
+            def __init__(self, bot):
+                self.bot = bot
+
+            def reply_text(self, text):
+                return self.bot.send_message(1, text)
+
+            def edit_text(self, text):
+                return self.bot.edit_message_text(text)
+
+        bot = Bot()
+        metrics.count_messages(bot)
+        before = metrics.messages_sent.value()
+        # A handler reply and a broadcast edit of the message it returned
+        reply = Message(bot).reply_text("привет")
+        reply.edit_text("пока")
+        bot.send_message(2, "всем")
+        self.assertEqual(metrics.messages_sent.value(), before + 3)
+
+    def test_queries_by_name(self):
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                metrics.enable()
+                hat, game = db.start_game(os.path.join(directory, "test.db"))
+                before = metrics.sql_seconds.count(("add_word",))
+                # Cursors are per thread, the one of this thread may have been opened before enable()
+                thread = threading.Thread(target=hat.add_word, args=("слово", 1, "room"))
+                thread.start()
+                thread.join()
+                self.assertEqual(metrics.sql_seconds.count(("add_word",)), before + 1)
+                self.assertGreater(metrics.sql_seconds.count(("begin",)), 0)
+            finally:
+                db.cursor_wrapper = None
+                metrics.enabled = False
+
+    def test_endpoint(self):
+        metrics.registry.add(metrics.CallbackMetric("test_rooms", "Test", "gauge", lambda: 7))
+        server = metrics.serve(0)
+        try:
+            url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+            with urllib.request.urlopen(url) as response:
+                body = response.read().decode()
+            self.assertIn("# TYPE test_rooms gauge\ntest_rooms 7\n", body)
+            self.assertIn("# TYPE hatbot_handler_seconds histogram", body)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
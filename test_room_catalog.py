@@ -0,0 +1,80 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from room_catalog import RoomCatalog
+
+
+class TestRoomCatalog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.catalog = RoomCatalog(directory=self.directory.name)
+
+    def write(self, name, *rooms, mtime=None):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf8") as f:
+            f.write("".join(room + "\n" for room in rooms))
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_kinds(self):
+        self.write("rooms.txt", "кот", "общая")
+        self.write("experimental_rooms.txt", "опыт", "общая")
+        self.catalog.load()
+        self.assertEqual(self.catalog.get("кот").kind, "public")
+        self.assertTrue(self.catalog.get("опыт").experimental)
+        # A room listed as public and experimental is public
+        self.assertFalse(self.catalog.get("общая").experimental)
+        self.assertIsNone(self.catalog.get("пес"))
+        self.assertNotIn("", self.catalog)
+        self.assertEqual(self.catalog.names("experimental"), {"опыт"})
+
+    def test_reload_if_changed(self):
+        self.write("rooms.txt", "кот", mtime=1000)
+        self.catalog.load()
+        self.catalog.add("личная")
+        self.assertFalse(self.catalog.reload_if_changed())
+
+        self.write("rooms.txt", "пес", mtime=2000)
+        self.assertTrue(self.catalog.reload_if_changed())
+        self.assertNotIn("кот", self.catalog)
+        self.assertIn("пес", self.catalog)
+        # Rooms added at runtime survive reloads
+        self.assertEqual(self.catalog.get("личная").kind, "personal")
+
+    def test_watcher(self):
+        self.write("rooms.txt", "кот", mtime=1000)
+        self.catalog.load()
+        self.catalog.start_thread(0.01)
+        self.addCleanup(self.catalog.stop)
+        self.write("rooms.txt", "кот", "пес", mtime=2000)
+        deadline = time.monotonic() + 5
+        while "пес" not in self.catalog and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIn("пес", self.catalog)
+
+    def test_lookups_during_reloads(self):
+        self.write("rooms.txt", *("комната%d" % i for i in range(1000)))
+        self.catalog.load()
+        stop = threading.Event()
+        misses = []
+
+        def reload():
+            while not stop.is_set():
+                self.catalog.load()
+
+        thread = threading.Thread(target=reload)
+        thread.start()
+        for _ in range(20000):
+            if "комната500" not in self.catalog:
+                misses.append(1)
+        stop.set()
+        thread.join()
+        self.assertEqual(misses, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from queue import Queue
+
+from telegram import Bot, Update
+from telegram.ext import MessageHandler, Filters
+
+import bot
+import db
+import metrics
+from fake_telegram import FakeTelegram, TOKEN
+from room_executor import RoomDispatcher, RoomExecutor
+
+
+class TestRoomExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = RoomExecutor(workers=4, mailbox_size=50)
+        self.addCleanup(self.executor.stop)
+
+    def test_order(self):
+        done = {room: [] for room in range(4)}
+        running = set()
+        overlaps = []
+        lock = threading.Lock()
+
+        def task(room, number):
+            with lock:
+                if room in running:
+                    overlaps.append(room)
+                running.add(room)
+            time.sleep(0.0005)
+            with lock:
+                running.discard(room)
+            done[room].append(number)
+
+        for number in range(40):
+            for room in done:
+                self.assertTrue(self.executor.submit(room, task, room, number))
+        self.assertTrue(self.executor.join(10))
+        self.assertEqual(overlaps, [])
+        for numbers in done.values():
+            self.assertEqual(numbers, list(range(40)))
+        self.assertEqual(self.executor.queued(), 0)
+
+    def test_rooms_in_parallel(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started = threading.Semaphore(0)
+
+        def block():
+            started.release()
+            release.wait()
+
+        self.executor.submit("room1", block)
+        self.executor.submit("room1", block)
+        self.executor.submit("room2", block)
+        # The second task of room1 waits for the first one, room2 runs beside it
+        self.assertTrue(started.acquire(timeout=5))
+        self.assertTrue(started.acquire(timeout=5))
+        self.assertFalse(started.acquire(timeout=0.05))
+        self.assertEqual(self.executor.queued(), 1)
+        self.assertEqual(self.executor.deepest(), 1)
+        release.set()
+        self.assertTrue(self.executor.join(5))
+
+    def test_bounded_mailbox(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started = threading.Event()
+        self.executor.submit("room1", lambda: started.set() or release.wait())
+        self.assertTrue(started.wait(5))
+        accepted = [self.executor.submit("room1", lambda: None) for _ in range(60)]
+        self.assertEqual(accepted.count(True), 50)
+        self.assertEqual(self.executor.dropped, 10)
+        self.assertTrue(self.executor.submit("room2", lambda: None))
+
+    def test_failing_task(self):
+        done = []
+        self.executor.submit("room1", lambda: 1 / 0)
+        self.executor.submit("room1", done.append, 1)
+        self.assertTrue(self.executor.join(5))
+        self.assertEqual(done, [1])
+
+
+class TestRoomDispatcher(unittest.TestCase):
+    def test_dispatch(self):
+        telegram = FakeTelegram()
+        self.addCleanup(telegram._server.server_close)
+        executor = RoomExecutor(workers=4)
+        self.addCleanup(executor.stop)
+        bot = Bot("123:fake")
+        texts = {}
+
+        def handle(update, context):
+            texts.setdefault(update.effective_user.id % 3, []).append(update.message.text)
+
+        dispatcher = RoomDispatcher(bot, Queue(), executor, lambda update: update.effective_user.id % 3,
+                                    workers=0, use_context=True)
+        dispatcher.add_handler(MessageHandler(Filters.text, handle))
+        for number in range(30):
+            dispatcher.process_update(Update.de_json(telegram.message_update(number, str(number)), bot))
+        self.assertTrue(executor.join(5))
+        self.assertEqual(texts, {key: [str(number) for number in range(key, 30, 3)] for key in range(3)})
+
+
+class TestBotRoomWorkers(unittest.TestCase):
+    def setUp(self):
+        self.telegram = FakeTelegram().start()
+        self.addCleanup(self.telegram.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        args = bot.build_parser().parse_args([os.path.join(directory.name, "bot.db"), os.devnull, "staging",
+                                              "--room-workers", "2", "--db-connections", "1"])
+        self.updater = bot.build_updater(args, TOKEN, self.telegram.base_url)
+        self.addCleanup(setattr, bot, "room_executor", None)
+        self.addCleanup(setattr, db, "pool_size", db.pool_size)
+        bot.setup(args, self.updater.bot)
+        self.addCleanup(bot.shutdown, args)
+        self.addCleanup(bot.room_executor.stop)
+        bot.add_handlers(self.updater.dispatcher)
+
+    def send(self, user, text):
+        self.updater.dispatcher.process_update(Update.de_json(self.telegram.message_update(user, text),
+                                                              self.updater.bot))
+
+    def test_pool_size(self):
+        # Every room worker keeps a connection, so do the maintenance and cached hat threads
+        self.assertEqual(db.pool_size, 4)
+        self.assertEqual(bot.hat.cursor.pool.size, 4)
+
+    def test_mailbox_metrics(self):
+        saved = dict(metrics.registry._metrics)
+
+        def restore():
+            metrics.registry._metrics.clear()
+            metrics.registry._metrics.update(saved)
+
+        self.addCleanup(restore)
+        bot.add_metrics()
+        exposed = metrics.registry.expose()
+        for name in ("hatbot_room_mailbox_queued", "hatbot_room_mailbox_max_depth",
+                     "hatbot_room_mailbox_dropped_total"):
+            self.assertIn("\n{} 0\n".format(name), exposed)
+
+    def test_room_key(self):
+        bot.catalog.add("комната")
+        keys = []
+        submit = bot.room_executor.submit
+
+        def recording(key, *args):
+            keys.append(key)
+            return submit(key, *args)
+
+        bot.room_executor.submit = recording
+        self.send(1, "комната")
+        self.assertTrue(bot.room_executor.join(10))
+        # Once the player joined, their updates go to the mailbox of the room, and after /leaveroom to their own
+        self.send(1, "слово")
+        self.send(2, "слово")
+        self.send(1, "/leaveroom")
+        self.assertTrue(bot.room_executor.join(10))
+        self.send(1, "/ready")
+        self.assertTrue(bot.room_executor.join(10))
+        self.assertEqual(keys, [1, "комната", 2, "комната", 1])
+        self.assertEqual(bot.hat.words_in_hat("комната"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from db import start_game, HatWrapper, RoomStore, SubscriptionStore
+from room_state import ALL_ROOMS, RoomRegistry
+from round import Round
+
+# Moves of the lead player in a game of three, the bot is killed between the halves
+FIRST_HALF = ["start_move", "guessed", "guessed", "time_ran_out", "start_move", "guessed", "failed", "start_move",
+              "guessed"]
+SECOND_HALF = ["guessed", "time_ran_out", "start_move", "failed", "start_move", "guessed", "guessed", "failed"]
+
+
+def open_registry(db_file):
+    hat, game = start_game(db_file)
+    return hat, RoomRegistry(RoomStore(db_file), lambda room: HatWrapper(room, hat))
+
+
+def play(registry, moves):
+    """ Makes the moves in room1 as the bot handlers do, returns the turns. """
+    state = registry.get("room1")
+    turns = []
+    with state.lock:
+        for move in moves:
+            result = getattr(state.round, move)(state.round.lead)
+            if isinstance(result, tuple):
+                turns.append(result)
+            registry.save(state)
+    return turns
+
+
+def start(db_file):
+    hat, registry = open_registry(db_file)
+    hat.add_words(["слово" + "а" * i for i in range(20)], 1, "room1")
+    state = registry.get("room1")
+    with state.lock:
+        for user in (1, 2, 3):
+            registry.chat_ids[user] = user * 10
+            registry.usernames[user] = "player" + str(user)
+            state.ready.add(user)
+        state.timer = 30
+        state.round = Round(HatWrapper("room1", hat), [1, 2, 3])
+        state.round.timer = state.timer
+        state.round.start_game()
+        registry.save(state)
+    return hat, registry
+
+
+def crash(db_file):
+    """ Plays the first half and kills the process, run in a child process. """
+    hat, registry = start(db_file)
+    play(registry, FIRST_HALF)
+    print(registry.get("room1").round.word, flush=True)
+    os.kill(os.getpid(), 9)
+
+
+class TestRoomRegistry(unittest.TestCase):
+    def test_get(self):
+        registry = RoomRegistry()
+        self.assertNotIn("room1", registry)
+        state = registry.get("room1")
+        self.assertIn("room1", registry)
+        self.assertIs(registry.get("room1"), state)
+        self.assertEqual(state.name, "room1")
+        self.assertIsNone(state.round)
+        self.assertIsNone(state.timer)
+        self.assertEqual(state.ready, set())
+        with self.assertRaises(AttributeError):
+            state.other = 1
+
+    def test_concurrent_ready(self):
+        registry = RoomRegistry()
+
+        def press_ready(offset):
+            for user in range(offset, offset + 1000):
+                state = registry.get("room" + str(user % 3))
+                with state.lock:
+                    state.ready.add(user)
+
+        threads = [threading.Thread(target=press_ready, args=(i * 1000,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(registry), 3)
+        self.assertEqual(sum(len(registry.get("room" + str(i)).ready) for i in range(3)), 8000)
+
+
+class TestSubscriptions(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.db_file = os.path.join(self.directory.name, "test.db")
+        start_game(self.db_file)
+
+    def open(self):
+        return RoomRegistry(subscriptions=SubscriptionStore(self.db_file))
+
+    def test_rooms(self):
+        subscribers = self.open().subscribers
+        self.assertTrue(subscribers.add(1, 10, "room1"))
+        self.assertFalse(subscribers.add(1, 10, "room1"))
+        self.assertTrue(subscribers.add(2, 20))
+        # Subscribed to room1 and to every room, notified once
+        self.assertTrue(subscribers.add(2, 20, "room1"))
+        self.assertEqual(subscribers.of_room("room1"), {1, 2})
+        self.assertEqual(subscribers.of_room("room2"), {2})
+        self.assertEqual(len(subscribers), 3)
+
+        self.assertEqual(subscribers.remove(1, "room2"), [])
+        self.assertEqual(subscribers.remove(1, "room1"), ["room1"])
+        self.assertEqual(sorted(subscribers.remove(2)), [ALL_ROOMS, "room1"])
+        self.assertEqual(subscribers.of_room("room1"), set())
+        self.assertEqual(len(subscribers), 0)
+
+    def test_persisted(self):
+        registry = self.open()
+        registry.subscribers.add(1, 10, "room1")
+        registry.subscribers.add(2, 20)
+        registry.subscribers.add(3, 30)
+        registry.subscribers.remove(3)
+
+        registry = self.open()
+        self.assertEqual(registry.subscribers.of_room("room1"), {1, 2})
+        self.assertEqual(registry.subscribers.of_room("room2"), {2})
+        self.assertEqual(registry.chat_ids, {1: 10, 2: 20})
+
+
+class TestRestore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_not_saved(self):
+        hat, registry = open_registry(os.path.join(self.directory.name, "test.db"))
+        state = registry.get("room1")
+        self.assertIsNone(state.round)
+        self.assertEqual(state.ready, set())
+
+    def test_resume_after_kill(self):
+        # The same game played without a restart
+        hat, registry = start(os.path.join(self.directory.name, "reference.db"))
+        play(registry, FIRST_HALF)
+        expected_turns = play(registry, SECOND_HALF)
+        expected_scores = registry.get("room1").round.pretty_scores()
+
+        db_file = os.path.join(self.directory.name, "test.db")
+        script = "import test_room_state; test_room_state.crash({!r})".format(db_file)
+        child = subprocess.run([sys.executable, "-c", script],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, text=True)
+        self.assertEqual(child.returncode, -9)
+        word = child.stdout.strip()
+
+        hat, registry = open_registry(db_file)
+        self.assertNotIn("room1", registry)
+        state = registry.get("room1")
+        self.assertEqual(state.ready, {1, 2, 3})
+        self.assertEqual(state.timer, 30)
+        self.assertEqual(state.round.word, word)
+        self.assertNotIn(word, hat.room_words("room1"))
+        self.assertEqual(registry.usernames, {1: "player1", 2: "player2", 3: "player3"})
+        self.assertEqual(registry.chat_ids, {1: 10, 2: 20, 3: 30})
+        self.assertEqual(play(registry, SECOND_HALF), expected_turns)
+        self.assertEqual(state.round.pretty_scores(), expected_scores)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import json
 import unittest
 
 import texts
@@ -11,10 +12,16 @@ class SingleWordCollection:
     def get_word(self):
         return "one"
 
-    def add_word(self, word, player):
+    def put_back(self, word, player):
         self.put_back_cnt += 1
         return True
 
+    def guessed(self, word):
+        pass
+
+    def discard(self, word):
+        pass
+
 
 class ManyWordCollection:
     def __init__(self):
@@ -25,11 +32,17 @@ class ManyWordCollection:
             return None
         return self.words.pop()
 
-    def add_word(self, word, player):
+    def put_back(self, word, player):
         if word in self.words:
             raise NotImplementedError
         self.words.add(word)
 
+    def guessed(self, word):
+        pass
+
+    def discard(self, word):
+        pass
+
 
 class TestMove(unittest.TestCase):
     def test_moves(self):
@@ -109,6 +122,41 @@ class TestRound(unittest.TestCase):
         self.assertEqual(r.points[1], 4)
         self.assertEqual(r.points[2], 2)
 
+    def test_finish(self):
+        words = SingleWordCollection()
+        r = Round(words, [0, 1])
+        r.start_game()
+        r.finish()
+        self.assertEqual(words.put_back_cnt, 0)
+        # The word of a running turn goes back to the hat
+        r.start_move(0)
+        r.finish()
+        self.assertEqual(words.put_back_cnt, 1)
+        r.finish()
+        self.assertEqual(words.put_back_cnt, 1)
+
+    def test_dump_and_load(self):
+        r = Round(SingleWordCollection(), [0, 1, 2])
+        r.timer = 30
+        r.start_game()
+        r.start_move(0)
+        r.guessed(0)
+        r.time_ran_out(0)
+        r.start_move(1)
+        data = json.loads(json.dumps(r.dump()))
+
+        restored = Round.load(SingleWordCollection(), data)
+        self.assertEqual((restored.lead, restored.target, restored.word, restored.timer), (1, 2, "one", 30))
+        self.assertEqual(restored.pretty_scores(), r.pretty_scores())
+        for round_ in (r, restored):
+            self.assertEqual(round_.guessed(1), "one")
+            self.assertEqual(round_.failed(1), (2, 0))
+            self.assertEqual(round_.failed(2), (0, 2))
+        self.assertEqual(restored.pretty_scores(), r.pretty_scores())
+
+        new_round = Round.load(SingleWordCollection(), Round(SingleWordCollection(), [0, 1]).dump())
+        self.assertEqual(new_round.start_game(), (0, 1))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,150 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import shards
+import texts
+from fake_telegram import FakeTelegram, TOKEN
+
+
+class ListQueue(list):
+    put = list.append
+
+
+def message(update_id, user, text):
+    return {"update_id": update_id, "message": {"from": {"id": user}, "text": text}}
+
+
+class TestFront(unittest.TestCase):
+    def test_shard_for(self):
+        self.assertEqual(shards.shard_for("комната", 4), shards.shard_for("комната", 4))
+        counts = [0] * 4
+        for i in range(1000):
+            counts[shards.shard_for("комната" + str(i), 4)] += 1
+        self.assertTrue(all(count > 150 for count in counts))
+
+    def test_routing(self):
+        queues = [ListQueue() for _ in range(4)]
+        front = shards.Front(queues, {1: "room1"})
+        joining = message(1, 2, "Room2")
+        front.route(joining)
+        self.assertEqual(queues[shards.shard_for("room2", 4)], [joining])
+        # The next update of the user waits for the previous one
+        words = message(2, 2, "слово")
+        front.route(words)
+        self.assertEqual(sum(len(queue) for queue in queues), 1)
+        front.done(joining, 2, "room2")
+        self.assertEqual(queues[shards.shard_for("room2", 4)], [joining, words])
+        front.done(words, 2, "room2")
+        self.assertTrue(front.join(timeout=0))
+
+        ready = message(3, 1, "/ready")
+        front.route(ready)
+        self.assertEqual(queues[shards.shard_for("room1", 4)], [ready])
+        # The player was removed from room1 meanwhile, the update goes to the shard of its text
+        front.done(ready, 1, None, processed=False)
+        self.assertEqual(queues[shards.shard_for("/ready", 4)][-1], ready)
+        front.done(ready, 1, None)
+        self.assertTrue(front.join(timeout=0))
+
+    def test_subscription_routing(self):
+        queues = [ListQueue() for _ in range(4)]
+        front = shards.Front(queues, {1: "room1"})
+        # A subscription goes to the shard of its room, not that of the player's room or of the text
+        subscribe = message(1, 1, "/subscribe Room2")
+        front.route(subscribe)
+        self.assertEqual(queues[shards.shard_for("room2", 4)], [subscribe])
+        self.assertTrue(front.done(subscribe, 1, None))
+        ready = message(2, 1, "/ready")
+        front.route(ready)
+        self.assertEqual(queues[shards.shard_for("room1", 4)][-1], ready)
+        self.assertTrue(front.done(ready, 1, "room1"))
+
+        # A subscription to every room goes to every shard, the next update waits for all of them
+        watch = message(3, 2, "/subscribe")
+        front.route(watch)
+        words = message(4, 2, "/unsubscribe")
+        front.route(words)
+        self.assertEqual([queue.count(watch) for queue in queues], [1, 1, 1, 1])
+        for _ in range(3):
+            self.assertFalse(front.done(watch, 2, None))
+        self.assertEqual([queue.count(words) for queue in queues], [0, 0, 0, 0])
+        self.assertTrue(front.done(watch, 2, None))
+        self.assertEqual([queue.count(words) for queue in queues], [1, 1, 1, 1])
+        for _ in range(4):
+            front.done(words, 2, None)
+        self.assertTrue(front.join(timeout=0))
+
+    def test_game(self):
+        telegram = FakeTelegram().start()
+        stopped = threading.Event()
+        with tempfile.TemporaryDirectory() as directory:
+            args = shards.build_parser().parse_args(
+                [os.path.join(directory, "bot.db"), os.path.join(directory, "bot.log"), "staging",
+                 "--shards", "2", "--poll-timeout", "0.5", "--chat-rate", "1000"])
+            rooms = ["шарда", "шардб", "шардд", "трибуна"]
+            # A room whose subscription text hashes to the other shard
+            followed = next(room for room in rooms
+                            if shards.shard_for(room, 2) != shards.shard_for("/subscribe " + room, 2))
+            front = threading.Thread(target=shards.run, args=(args, TOKEN, telegram.base_url, stopped),
+                                     kwargs={"extra_rooms": rooms})
+            front.start()
+            try:
+                telegram.send_update(100, "/subscribe " + followed)
+                telegram.send_update(200, "/subscribe")
+                deadline = time.monotonic() + 60
+                while not (telegram.messages_to(100) and telegram.messages_to(200)):
+                    self.assertLess(time.monotonic(), deadline, "subscriptions were not answered")
+                    time.sleep(0.05)
+                for room, name in enumerate(rooms):
+                    for user in (room * 10 + 1, room * 10 + 2):
+                        telegram.send_update(user, name)
+                        telegram.send_update(user, "слово" + "а" * user)
+                        telegram.send_update(user, "/ready")
+                deadline = time.monotonic() + 60
+                while time.monotonic() < deadline:
+                    if all(any("->" in text for text in telegram.messages_to(room * 10 + 1))
+                           for room in range(len(rooms))):
+                        break
+                    time.sleep(0.05)
+                else:
+                    self.fail("rounds did not start")
+                # Round starts reach the subscriber of their room and the subscriber of every room
+                while sum("->" in text for text in telegram.messages_to(200)) < len(rooms):
+                    self.assertLess(time.monotonic(), deadline, "subscribers did not hear of the rounds")
+                    time.sleep(0.05)
+                self.assertEqual(sum("->" in text for text in telegram.messages_to(100)), 1)
+                self.assertEqual(telegram.messages_to(200).count(texts.subscribed_message), 1)
+            finally:
+                stopped.set()
+                front.join()
+                telegram.stop()
+            self.assertEqual({shards.shard_for(room, 2) for room in rooms}, {0, 1})
+            self.assertTrue(os.path.exists(os.path.join(directory, "bot.db.0")))
+            self.assertTrue(os.path.exists(os.path.join(directory, "bot.db.1")))
+
+    def test_worker_exits(self):
+        telegram = FakeTelegram().start()
+        self.addCleanup(telegram.stop)
+        # The metrics port of shard 1 is taken, shard 0 gets the one below it
+        taken = socket.socket()
+        self.addCleanup(taken.close)
+        taken.bind(("127.0.0.1", 0))
+        port = taken.getsockname()[1]
+        with tempfile.TemporaryDirectory() as directory:
+            args = shards.build_parser().parse_args(
+                [os.path.join(directory, "bot.db"), os.path.join(directory, "bot.log"), "staging",
+                 "--shards", "2", "--metrics-port", str(port - 1)])
+            with self.assertRaises(RuntimeError):
+                shards.run(args, TOKEN, telegram.base_url, threading.Event())
+
+    def test_parser(self):
+        with self.assertRaises(SystemExit):
+            shards.build_parser().parse_args(["bot.db", "bot.log", "staging", "--room-workers", "2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+import unittest
+from collections import defaultdict
+
+from timers import TimerService, AsyncTimerService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTimers(unittest.TestCase):
+    def test_many_timers(self):
+        clock = FakeClock()
+        service = TimerService(tick_interval=5, clock=clock)
+        events = defaultdict(list)
+        for room in range(1000):
+            # Rooms start over the first 10 seconds with 20..119 second timers
+            clock.now = room % 10
+            service.start(room, 20 + room % 100,
+                          on_tick=lambda elapsed, room=room: events[room].append(elapsed),
+                          on_finish=lambda room=room: events[room].append("finish"),
+                          on_abort=lambda reason, room=room: events[room].append(reason))
+        self.assertEqual(service.active(), 1000)
+        clock.now = 15
+        service.run_pending()
+        for room in range(0, 1000, 3):
+            self.assertTrue(service.abort(room, "ошибка"))
+        self.assertFalse(service.abort(0, "ошибка"))
+        while clock.now < 200:
+            clock.now += 1
+            service.run_pending()
+        self.assertEqual(service.active(), 0)
+        self.assertIsNone(service.run_pending())
+        for room in range(1000):
+            duration = 20 + room % 100
+            if room % 3 == 0:
+                ticks = [elapsed for elapsed in range(5, 16 - room % 10, 5)]
+                self.assertEqual(events[room], ticks + ["ошибка"])
+            else:
+                self.assertEqual(events[room], list(range(5, duration, 5)) + ["finish"])
+
+    def test_restart_replaces_timer(self):
+        clock = FakeClock()
+        service = TimerService(tick_interval=1, clock=clock)
+        events = []
+        service.start("room", 3, events.append, lambda: events.append("first"), events.append)
+        clock.now = 1
+        service.run_pending()
+        service.start("room", 2, events.append, lambda: events.append("second"), events.append)
+        clock.now = 10
+        service.run_pending()
+        self.assertEqual(events, [1, 1, "second"])
+
+    def test_thread(self):
+        service = TimerService(tick_interval=0.01)
+        finished = threading.Event()
+        service.start_thread()
+        service.start("room", 0.05, lambda elapsed: None, finished.set, lambda reason: None)
+        self.assertTrue(finished.wait(5))
+        service.stop()
+
+
+async def wait_for(predicate, timeout=5):
+    """ Waits for callbacks run on the callback thread. """
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        await asyncio.sleep(0.005)
+
+
+class TestAsyncTimers(unittest.TestCase):
+    def test_tasks(self):
+        events = []
+
+        async def scenario():
+            service = AsyncTimerService(asyncio.get_running_loop(), tick_interval=0.02)
+            service.start("a", 0.05, lambda elapsed: events.append(("a", elapsed)),
+                          lambda: events.append(("a", "finish")), lambda reason: events.append(("a", reason)))
+            service.start("b", 1, lambda elapsed: events.append(("b", elapsed)),
+                          lambda: events.append(("b", "finish")), lambda reason: events.append(("b", reason)))
+            self.assertEqual(service.active(), 2)
+            await asyncio.sleep(0.01)
+            # Abort from another thread, like a handler does
+            await asyncio.get_running_loop().run_in_executor(None, service.abort, "b", "ошибка")
+            self.assertFalse(service.abort("b", "ошибка"))
+            await asyncio.sleep(0.1)
+            self.assertEqual(service.active(), 0)
+            await wait_for(lambda: len(events) == 4)
+
+        asyncio.run(scenario())
+        self.assertEqual(events, [("b", "ошибка"), ("a", 0), ("a", 0), ("a", "finish")])
+
+    def test_restart_while_finishing(self):
+        events = []
+
+        async def scenario():
+            service = AsyncTimerService(asyncio.get_running_loop(), tick_interval=1)
+            service.start("a", 0, None, lambda: events.append("first"), lambda reason: None)
+            # Let the first countdown reach its last sleep, then start the key again before it wakes up
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            service.start("a", 10, None, lambda: events.append("second"), events.append)
+            await wait_for(lambda: events)
+            self.assertEqual(events, ["first"])
+            self.assertEqual(service.active(), 1)
+            self.assertTrue(service.abort("a", "стоп"))
+            self.assertEqual(service.active(), 0)
+            await wait_for(lambda: len(events) == 2)
+
+        asyncio.run(scenario())
+        self.assertEqual(events, ["first", "стоп"])
+
+    def test_callbacks_off_the_loop(self):
+        release = threading.Event()
+        events = []
+
+        async def scenario():
+            service = AsyncTimerService(asyncio.get_running_loop(), tick_interval=1)
+            # A finishing timer waiting for a room lock held by a handler
+            service.start("a", 0, None, lambda: release.wait(5) and events.append("a"), None)
+            service.start("b", 0.05, None, lambda: events.append("b"), None)
+            started = time.monotonic()
+            await asyncio.sleep(0.02)
+            self.assertLess(time.monotonic() - started, 1)
+            release.set()
+            await wait_for(lambda: len(events) == 2)
+            service.stop()
+
+        asyncio.run(scenario())
+        # Callbacks run in order
+        self.assertEqual(events, ["a", "b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
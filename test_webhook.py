@@ -0,0 +1,157 @@
+import http.client
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from fake_telegram import FakeTelegram
+from webhook import WebhookServer
+
+
+class Dispatcher:
+    def __init__(self):
+        self.updates = []
+        self.release = threading.Event()
+        self.done = threading.Semaphore(0)
+
+    def process_update(self, update):
+        self.release.wait()
+        self.updates.append(update)
+        self.done.release()
+
+
+class TestWebhook(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = Dispatcher()
+        self.server = WebhookServer(None, self.dispatcher, port=0, queue_size=2, workers=1).start()
+        host, port = self.server._server.server_address[:2]
+        self.connection = http.client.HTTPConnection(host, port, timeout=10)
+
+    def tearDown(self):
+        self.dispatcher.release.set()
+        self.connection.close()
+        self.server.stop()
+
+    def request(self, method, path, body=None, headers=None):
+        self.connection.request(method, path, None if body is None else json.dumps(body).encode(), headers or {})
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_backpressure(self):
+        telegram = FakeTelegram()
+        statuses = [self.request("POST", "/webhook", telegram.message_update(1, str(i)))[0] for i in range(5)]
+        # One update is taken by the blocked handler, two wait in the queue
+        self.assertEqual(statuses.count(200), 3)
+        self.assertEqual(statuses[-1], 503)
+        status, health = self.request("GET", "/health")
+        self.assertEqual(status, 200)
+        self.assertEqual((health["queued"], health["received"], health["rejected"]), (2, 3, 2))
+
+        self.dispatcher.release.set()
+        for _ in range(3):
+            self.assertTrue(self.dispatcher.done.acquire(timeout=10))
+        self.assertEqual([update.message.text for update in self.dispatcher.updates], ["0", "1", "2"])
+        self.assertEqual(self.request("POST", "/webhook", telegram.message_update(1, "5"))[0], 200)
+
+    def test_errors(self):
+        self.assertEqual(self.request("POST", "/other", {})[0], 404)
+        self.connection.request("POST", "/webhook", b"{")
+        response = self.connection.getresponse()
+        response.read()
+        self.assertEqual(response.status, 400)
+        for body in ([], 1, "update", {}, {"message": {}}):
+            self.assertEqual(self.request("POST", "/webhook", body)[0], 400)
+        # The handler thread still takes updates
+        self.dispatcher.release.set()
+        self.assertEqual(self.request("POST", "/webhook", FakeTelegram().message_update(1, "0"))[0], 200)
+        self.assertTrue(self.dispatcher.done.acquire(timeout=10))
+        self.assertEqual(self.server.health()["received"], 1)
+
+    def post_headers(self, path, headers):
+        """ Posts the headers without a body, returns the status. """
+        self.connection.putrequest("POST", path)
+        for name, value in headers.items():
+            self.connection.putheader(name, value)
+        self.connection.endheaders()
+        response = self.connection.getresponse()
+        response.read()
+        return response.status
+
+    def test_body_limits(self):
+        self.server.max_body = 100
+        self.assertEqual(self.request("POST", "/webhook", "а" * 100)[0], 413)
+        self.assertEqual(self.post_headers("/webhook", {"Content-Length": "-1"}), 400)
+        # Refused before the body is read, which never comes
+        self.assertEqual(self.post_headers("/other", {"Content-Length": str(10 ** 9)}), 404)
+        self.server.secret_token = "secret"
+        self.assertEqual(self.post_headers("/webhook", {"Content-Length": str(10 ** 9)}), 403)
+        self.assertEqual(self.server.health()["received"], 0)
+
+    def test_secret_token(self):
+        self.server.secret_token = "secret"
+        update = FakeTelegram().message_update(1, "0")
+        self.assertEqual(self.request("POST", "/webhook", update)[0], 403)
+        self.assertEqual(self.request("POST", "/webhook", update, {"X-Telegram-Bot-Api-Secret-Token": "other"})[0],
+                         403)
+        self.assertEqual(self.request("POST", "/webhook", update, {"X-Telegram-Bot-Api-Secret-Token": "secret"})[0],
+                         200)
+
+        telegram = FakeTelegram().start()
+        try:
+            self.dispatcher.release.set()
+            telegram._set_webhook({"url": self.server.url, "max_connections": 1, "secret_token": "secret"})
+            telegram.send_update(2, "слово")
+            for _ in range(2):
+                self.assertTrue(self.dispatcher.done.acquire(timeout=10))
+            self.assertEqual(telegram.webhook_rejected, 0)
+        finally:
+            telegram.stop()
+
+    def test_fake_telegram_delivery(self):
+        telegram = FakeTelegram().start()
+        try:
+            self.dispatcher.release.set()
+            telegram._set_webhook({"url": self.server.url, "max_connections": 2})
+            for i in range(20):
+                telegram.send_update(i, "слово")
+            for _ in range(20):
+                self.assertTrue(self.dispatcher.done.acquire(timeout=10))
+            self.assertEqual(sorted(update.effective_user.id for update in self.dispatcher.updates), list(range(20)))
+        finally:
+            telegram.stop()
+
+
+class TestWebhookTls(unittest.TestCase):
+    @unittest.skipUnless(shutil.which("openssl"), "openssl is needed to make a certificate")
+    def test_silent_client(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+                            "-days", "1", "-subj", "/CN=127.0.0.1"], check=True, capture_output=True)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+        dispatcher = Dispatcher()
+        dispatcher.release.set()
+        server = WebhookServer(None, dispatcher, port=0, workers=1, ssl_context=context).start()
+        self.addCleanup(server.stop)
+        host, port = server._server.server_address[:2]
+        # A client that connects and never starts the handshake does not hold up the others
+        silent = socket.create_connection((host, port))
+        self.addCleanup(silent.close)
+        connection = http.client.HTTPSConnection(host, port, timeout=10,
+                                                 context=ssl._create_unverified_context())
+        self.addCleanup(connection.close)
+        connection.request("POST", "/webhook", json.dumps(FakeTelegram().message_update(1, "0")).encode())
+        response = connection.getresponse()
+        response.read()
+        self.assertEqual(response.status, 200)
+        self.assertTrue(dispatcher.done.acquire(timeout=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,6 +34,7 @@ words_added_skipped_words_message = "Добавлено слов: {}, не до
 word_not_added_message = "Слово не добавлено. Может быть, оно уже есть"
 illegal_to_add_word_count_message = "Некорректное количество слов: ожидается от 1 до {}"
 illegal_total_word_count_message = "Некорректное количество слов: в шляпе суммарно не может оказаться более {} слов"
+not_enough_dictionary_words_message = "В словаре {} осталось только {} слов, которых ещё нет в шляпе"
 room_greeting_message = "Ура, ты в комнате {}! Теперь пиши слова по одному или несколько сразу, чтобы добавить их в шляпу. Можно добавить несколько случайных слов из словарей easy, medium или hard, написав «словарь количество» (например, «medium 12»). Вызывай команду /getword, чтобы достать слово из шляпы. Можно также вызвать /removeword, чтобы убрать слово. Сейчас в шляпе слов: {}"
 no_such_rooms_message = "Такой комнаты нет!"
 words_finished_message = "Слова закончились!"
@@ -59,6 +60,11 @@ turn_started_message = "Поехали!"
 not_enough_players_message = "Для начала игры нужно хотя бы два игрока"
 not_your_turn_message = "Сейчас не ваш ход"
 no_more_words_message = "Слова закончились"
+subscribed_message = "Подписка оформлена. Пришлю новости игры: /subscribe комната — только одной комнаты, /subscribe — всех"
+already_subscribed_message = "Подписка уже есть"
+unsubscribed_message = "Подписка отменена"
+throttled_message = "Слишком много сообщений! Подожди немного, пока что они не обрабатываются"
+not_subscribed_message = "Подписки не было. /unsubscribe комната отменяет подписку на комнату, /unsubscribe — на всё"
 
 guessed_button = "угадано!"
 fail_button = "ошибка :("
@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class _Timer:
+    __slots__ = ("key", "started", "duration", "on_tick", "on_finish", "on_abort", "abort_reason", "done")
+
+    def __init__(self, key, started, duration, on_tick, on_finish, on_abort):
+        self.key = key
+        self.started = started
+        self.duration = duration
+        self.on_tick = on_tick
+        self.on_finish = on_finish
+        self.on_abort = on_abort
+        self.abort_reason = None
+        self.done = False
+
+
+class TimerService:
+    """ Runs the countdowns of all rooms on a single thread.
+
+    Every timer calls on_tick(elapsed_seconds) each `tick_interval` seconds, then on_finish(),
+    or on_abort(reason) once aborted. Callbacks run on the service thread and must not block for long.
+    """
+
+    def __init__(self, tick_interval=5, clock=time.monotonic):
+        self.tick_interval = tick_interval
+        self.clock = clock
+        # Heap of (due time, sequence number, timer), entries of finished timers are skipped
+        self._heap = []
+        self._timers = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self, key, duration, on_tick, on_finish, on_abort):
+        """ Starts a timer, a running timer with the same key is dropped. """
+        with self._lock:
+            now = self.clock()
+            old = self._timers.get(key)
+            if old:
+                old.done = True
+            timer = self._timers[key] = _Timer(key, now, duration, on_tick, on_finish, on_abort)
+            self._push(min(now + self.tick_interval, now + duration), timer)
+
+    def abort(self, key, reason):
+        """ Aborts the running timer, returns False if there is none. """
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if timer is None:
+                return False
+            timer.abort_reason = reason
+            self._push(self.clock(), timer)
+            return True
+
+    def active(self):
+        with self._lock:
+            return len(self._timers)
+
+    def run_pending(self):
+        """ Fires every due event, returns the time of the next one or None. """
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > self.clock():
+                    return self._heap[0][0] if self._heap else None
+                due, _, timer = heapq.heappop(self._heap)
+                if timer.done:
+                    continue
+                if timer.abort_reason is not None:
+                    timer.done = True
+                    callback, args = timer.on_abort, (timer.abort_reason,)
+                elif due >= timer.started + timer.duration:
+                    timer.done = True
+                    self._timers.pop(timer.key, None)
+                    callback, args = timer.on_finish, ()
+                else:
+                    self._push(min(due + self.tick_interval, timer.started + timer.duration), timer)
+                    callback, args = timer.on_tick, (round(due - timer.started),)
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception("Timer %s callback failed", timer.key)
+
+    def start_thread(self):
+        self._thread = threading.Thread(target=self._run, name="timers", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+        if self._thread:
+            self._thread.join()
+
+    def _push(self, due, timer):
+        heapq.heappush(self._heap, (due, next(self._sequence), timer))
+        self._lock.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stopped and not (self._heap and self._heap[0][0] <= self.clock()):
+                    self._lock.wait(self._heap[0][0] - self.clock() if self._heap else None)
+                if self._stopped:
+                    return
+            self.run_pending()
+
+
+
+class AsyncTimerService:
+    """ TimerService counterpart that runs every countdown as a task of an asyncio loop.
+
+    start and abort may be called from any thread. Callbacks take room locks, so they run off the loop,
+    in order on a thread of their own.
+    """
+
+    def __init__(self, loop, tick_interval=5):
+        self.loop = loop
+        self.tick_interval = tick_interval
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="timer-callbacks")
+        # Key -> (countdown task, on_abort), only touched on the loop
+        self._tasks = {}
+        # Keys of running timers -> token of their latest start, readable from other threads
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def start(self, key, duration, on_tick, on_finish, on_abort):
+        token = object()
+        with self._lock:
+            self._active[key] = token
+        self.loop.call_soon_threadsafe(self._start, key, token, duration, on_tick, on_finish, on_abort)
+
+    def abort(self, key, reason):
+        with self._lock:
+            if self._active.pop(key, None) is None:
+                return False
+        self.loop.call_soon_threadsafe(self._abort, key, reason)
+        return True
+
+    def active(self):
+        with self._lock:
+            return len(self._active)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._cancel_all)
+
+    def _start(self, key, token, duration, on_tick, on_finish, on_abort):
+        old = self._tasks.pop(key, None)
+        if old:
+            old[0].cancel()
+        task = self.loop.create_task(self._countdown(key, token, duration, on_tick, on_finish))
+        self._tasks[key] = (task, on_abort)
+
+    def _abort(self, key, reason):
+        entry = self._tasks.pop(key, None)
+        if entry:
+            task, on_abort = entry
+            task.cancel()
+            self._call(key, on_abort, reason)
+
+    def _cancel_all(self):
+        for task, on_abort in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._executor.shutdown(wait=False)
+
+    async def _countdown(self, key, token, duration, on_tick, on_finish):
+        elapsed = 0
+        while elapsed + self.tick_interval < duration:
+            await asyncio.sleep(self.tick_interval)
+            elapsed += self.tick_interval
+            self._call(key, on_tick, round(elapsed))
+        await asyncio.sleep(duration - elapsed)
+        if self._tasks.get(key, (None,))[0] is asyncio.current_task():
+            del self._tasks[key]
+        # A timer started for the key meanwhile stays active
+        with self._lock:
+            if self._active.get(key) is token:
+                del self._active[key]
+        self._call(key, on_finish)
+
+    def _call(self, key, callback, *args):
+        self.loop.run_in_executor(self._executor, _run_callback, key, callback, *args)
+
+
+def _run_callback(key, callback, *args):
+    try:
+        callback(*args)
+    except Exception:
+        logger.exception("Timer %s callback failed", key)
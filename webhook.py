@@ -0,0 +1,177 @@
+""" Webhook intake of updates: Telegram posts them to an embedded HTTP server instead of being polled.
+
+HTTP threads read and parse the updates and put them on a bounded queue, handler threads take them from it.
+When the queue is full the server answers 503 and Telegram delivers the update again later, so a burst
+slows Telegram down instead of growing the queue. GET /health reports the queue and the counters.
+With a secret token, posts without it in the X-Telegram-Bot-Api-Secret-Token header are refused.
+Bodies are read after those checks and only up to max_body bytes. With TLS the handshake runs on the thread
+of the connection, so a client that never completes it holds only that thread, until the timeout.
+"""
+import hmac
+import json
+import logging
+import queue
+import ssl
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    ssl_context = None
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+    def handle_error(self, request, client_address):
+        logger.debug("Webhook connection from %s failed", client_address[0], exc_info=True)
+
+
+class WebhookServer:
+    def __init__(self, telegram_bot, dispatcher, host="127.0.0.1", port=8443, path="/webhook", queue_size=1000,
+                 workers=8, ssl_context=None, secret_token=None, max_body=1 << 20, timeout=30):
+        self.bot = telegram_bot
+        self.dispatcher = dispatcher
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body = max_body
+        self.timeout = timeout
+        self.workers = workers
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self.started_at = time.monotonic()
+        self._intake = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler_class())
+        self._server.ssl_context = ssl_context
+        self._threads = []
+
+    @property
+    def url(self):
+        """ Local URL of the webhook. """
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}{}".format(host, port, self.path)
+
+    def start(self):
+        self._threads.append(threading.Thread(target=self._server.serve_forever, name="webhook", daemon=True))
+        self._threads.extend(threading.Thread(target=self._work, name="webhook-handler-{}".format(i), daemon=True)
+                             for i in range(self.workers))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """ Stops receiving updates and processes the queued ones. """
+        self._server.shutdown()
+        self._server.server_close()
+        for _ in range(self.workers):
+            self._intake.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def health(self):
+        with self._lock:
+            return {"status": "ok", "queued": self._intake.qsize(), "queue_size": self._intake.maxsize,
+                    "received": self.received, "rejected": self.rejected, "processed": self.processed,
+                    "uptime": round(time.monotonic() - self.started_at, 1)}
+
+    def _receive(self, body):
+        """ Queues a posted update, returns False if the queue is full. Raises ValueError or TypeError
+        if the body is not an update. """
+        data = json.loads(body)
+        if not isinstance(data, dict) or not data:
+            raise ValueError("not an update")
+        update = Update.de_json(data, self.bot)
+        try:
+            self._intake.put_nowait(update)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.received += 1
+        return True
+
+    def _work(self):
+        for update in iter(self._intake.get, None):
+            try:
+                self.dispatcher.process_update(update)
+            except Exception:
+                logger.exception("Update %s failed", update.update_id)
+            with self._lock:
+                self.processed += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            timeout = server.timeout
+
+            def setup(self):
+                self.request.settimeout(self.timeout)
+                if isinstance(self.request, ssl.SSLSocket):
+                    self.request.do_handshake()
+                super().setup()
+
+            def do_GET(self):
+                if self.path != "/health":
+                    self._reply(404, {"ok": False})
+                    return
+                self._reply(200, server.health())
+
+            def do_POST(self):
+                status = self._refusal()
+                if status:
+                    # The body is not read, the connection cannot be reused
+                    self._reply(status, {"ok": False}, {"Connection": "close"})
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    accepted = server._receive(body)
+                except (ValueError, TypeError):
+                    self._reply(400, {"ok": False})
+                    return
+                if accepted:
+                    self._reply(200, {"ok": True})
+                else:
+                    self._reply(503, {"ok": False}, {"Retry-After": "1"})
+
+            def _refusal(self):
+                """ Returns the status refusing the post before its body is read, if any. """
+                if self.path != server.path:
+                    return 404
+                if server.secret_token is not None and not hmac.compare_digest(
+                        self.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), server.secret_token):
+                    return 403
+                length = self.headers.get("Content-Length") or "0"
+                if not (length.isascii() and length.isdigit()):
+                    return 400
+                if int(length) > server.max_body:
+                    return 413
+                return None
+
+            def _reply(self, status, data, headers=None):
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler